@@ -0,0 +1,85 @@
+"""Throughput of reply-to token encryption
+
+Compares CryptHelper against the previous implementation, which
+converted hex a byte at a time.
+
+    python -m benchmarks.crypt
+"""
+import timeit
+
+from Crypto.Cipher import AES
+
+from community_share.crypt import CryptHelper
+
+N_MESSAGES = 2000
+KEY = CryptHelper.encode(b'This is a key123This is an IV456')
+
+
+class LegacyCryptHelper(object):
+    @classmethod
+    def encode(cls, bytestring):
+        encoded = ''.join(["%02X" % x for x in bytestring])
+        return encoded
+
+    @classmethod
+    def decode(cls, hexstring):
+        bs = []
+        for i in range(0, len(hexstring), 2):
+            bs.append(int(hexstring[i:i + 2], 16))
+        return bytes(bs)
+
+    def __init__(self, combined_key):
+        combined = self.decode(combined_key)
+        key = combined[0:AES.block_size]
+        iv = combined[AES.block_size:2 * AES.block_size]
+        self.params = (key, AES.MODE_CBC, iv)
+
+    def make_aes(self):
+        return AES.new(*self.params)
+
+    def encrypt(self, message):
+        message = message.encode('utf8')
+        aes = self.make_aes()
+        offset = len(message) % AES.block_size
+        if offset == 0:
+            padding_required = 0
+        else:
+            padding_required = AES.block_size - offset
+        message += padding_required * b' '
+        encrypted = aes.encrypt(message)
+        encoded = self.encode(encrypted)
+        return encoded
+
+    def decrypt(self, message):
+        aes = self.make_aes()
+        decoded = self.decode(message)
+        decrypted = aes.decrypt(decoded)
+        stripped = decrypted.decode('utf8').strip()
+        return stripped
+
+
+def messages_per_second(func, n_messages=N_MESSAGES):
+    seconds = min(timeit.repeat(func, number=1, repeat=7))
+    return n_messages / seconds
+
+
+if __name__ == '__main__':
+    legacy = LegacyCryptHelper(KEY)
+    helper = CryptHelper(KEY)
+    texts = ['message-{}'.format(100000 + i) for i in range(N_MESSAGES)]
+    tokens = [helper.encrypt(text) for text in texts]
+    assert tokens == [legacy.encrypt(text) for text in texts]
+
+    rows = [
+        ('legacy encrypt', lambda: [legacy.encrypt(text) for text in texts]),
+        ('encrypt', lambda: [helper.encrypt(text) for text in texts]),
+        ('legacy decrypt', lambda: [legacy.decrypt(token) for token in tokens]),
+        ('decrypt', lambda: [helper.decrypt(token) for token in tokens]),
+        ('legacy hex encode', lambda: [legacy.encode(text.encode()) for text in texts]),
+        ('hex encode', lambda: [helper.encode(text.encode()) for text in texts]),
+        ('legacy hex decode', lambda: [legacy.decode(token) for token in tokens]),
+        ('hex decode', lambda: [helper.decode(token) for token in tokens]),
+    ]
+    print('{} messages of {} characters'.format(N_MESSAGES, len(texts[0])))
+    for name, func in rows:
+        print('{:18} {:12,.0f} messages/s'.format(name, messages_per_second(func)))
@@ -0,0 +1,102 @@
+"""Top paths from the page view rollups against from page_views itself
+
+Records a month of views, rolls them up, and times the top paths and
+a funnel both ways.
+
+    python -m benchmarks.page_view_rollups
+"""
+import datetime
+import random
+import time
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.analytics import (
+    PageView,
+    PathViews,
+    TransitionViews,
+    roll_up_page_views,
+)
+
+N_VIEWS = 300000
+N_PATHS = 200
+N_USERS = 500
+FIRST_DAY = datetime.date(2016, 10, 1)
+LAST_DAY = datetime.date(2016, 10, 30)
+
+
+def record_views(session):
+    random.seed(0)
+    paths = ['/page/{}'.format(n) for n in range(N_PATHS)]
+    start = datetime.datetime.combine(FIRST_DAY, datetime.time())
+    seconds = ((LAST_DAY - FIRST_DAY).days + 1) * 86400
+    session.execute(PageView.__table__.insert(), [
+        {
+            'user_id': random.randrange(N_USERS),
+            'viewed_at': start + datetime.timedelta(seconds=seconds * n // N_VIEWS),
+            'prev_path': random.choice(paths),
+            'next_path': random.choice(paths),
+        } for n in range(N_VIEWS)
+    ])
+    session.commit()
+
+
+def legacy_top_paths(session, first_date, last_date, number):
+    first = datetime.datetime.combine(first_date, datetime.time())
+    last = datetime.datetime.combine(last_date + datetime.timedelta(days=1), datetime.time())
+    n_views = func.count(PageView.id)
+    query = session.query(PageView.next_path, n_views)
+    query = query.filter(PageView.viewed_at >= first, PageView.viewed_at < last)
+    query = query.group_by(PageView.next_path).order_by(n_views.desc(), PageView.next_path)
+    return query.limit(number).all()
+
+
+def legacy_funnel(session, paths, first_date, last_date):
+    first = datetime.datetime.combine(first_date, datetime.time())
+    last = datetime.datetime.combine(last_date + datetime.timedelta(days=1), datetime.time())
+    counts = []
+    for prev_path, next_path in zip(paths, paths[1:]):
+        query = session.query(func.count(PageView.id))
+        query = query.filter(PageView.viewed_at >= first, PageView.viewed_at < last)
+        query = query.filter(PageView.prev_path == prev_path, PageView.next_path == next_path)
+        counts.append(query.scalar())
+    return counts
+
+
+def milliseconds(func):
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return result, best * 1000
+
+
+if __name__ == '__main__':
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    record_views(session)
+
+    start = time.perf_counter()
+    roll_up_page_views(session)
+    roll_up_page_views(session)
+    print('rolled up {} views in {:.1f} s'.format(N_VIEWS, time.perf_counter() - start))
+
+    funnel = ['/page/1', '/page/2', '/page/3', '/page/4']
+    rows = [
+        ('legacy top paths', lambda: legacy_top_paths(session, FIRST_DAY, LAST_DAY, 10)),
+        ('top paths', lambda: PathViews.top(session, FIRST_DAY, LAST_DAY, 10)),
+        ('legacy funnel', lambda: legacy_funnel(session, funnel, FIRST_DAY, LAST_DAY)),
+        ('funnel', lambda: TransitionViews.funnel(session, funnel, FIRST_DAY, LAST_DAY)),
+    ]
+    results = {}
+    for name, query in rows:
+        results[name], ms = milliseconds(query)
+        print('{:17} {:8.1f} ms'.format(name, ms))
+    assert [tuple(row) for row in results['legacy top paths']] == results['top paths']
+    assert results['legacy funnel'] == results['funnel']
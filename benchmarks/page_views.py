@@ -0,0 +1,65 @@
+"""Cost of recording page views
+
+Compares recording each view in its own transaction, as before, with
+buffering them and writing each batch in one transaction, on a file
+database so that every commit is synced to disk.
+
+    python -m benchmarks.page_views
+"""
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.api.analytics.views.buffer import FLUSH_SIZE, PageViewBuffer
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.analytics import PageView
+
+N_VIEWS = 2000
+
+
+class Store(object):
+    def __init__(self, path):
+        self.engine = create_engine('sqlite:///' + path)
+        self.Session = sessionmaker(bind=self.engine)
+        self.session = self.Session()
+        self.n_commits = 0
+        event.listen(self.engine, 'commit', self._count_commit)
+        Base.metadata.create_all(self.engine)
+        self.n_commits = 0
+
+    def _count_commit(self, connection):
+        self.n_commits += 1
+
+
+def legacy_record(store, user_id, next_path, prev_path):
+    store.session.add(PageView(user_id, next_path, prev_path))
+    store.session.commit()
+
+
+def buffered_record(buffer, user_id, next_path, prev_path):
+    buffer.add(user_id, next_path, prev_path)
+
+
+def measure(name, store, record, target):
+    start = time.perf_counter()
+    for i in range(N_VIEWS):
+        record(target, i % 50, '/page/{}'.format(i % 20), '/page/{}'.format((i + 1) % 20))
+    if isinstance(target, PageViewBuffer):
+        target.stop()
+    seconds = time.perf_counter() - start
+    assert store.session.query(PageView).count() == N_VIEWS
+    print('{:10} {:10,.0f} views/s {:6} commits'.format(name, N_VIEWS / seconds, store.n_commits))
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = Store(os.path.join(directory, 'legacy.db'))
+        measure('legacy', legacy, legacy_record, legacy)
+        buffered = Store(os.path.join(directory, 'buffered.db'))
+        buffer = PageViewBuffer(store=buffered, flush_interval=60)
+        measure('buffered', buffered, buffered_record, buffer)
+    print('{} views, flushed every {}'.format(N_VIEWS, FLUSH_SIZE))
@@ -0,0 +1,118 @@
+"""Cost of a reminder sweep as the number of events grows
+
+Runs `reminder.send_reminders` over tables holding more and more
+events, a tenth of them starting within the next day, and counts the
+queries it makes.  Mail is queued in the outbox as it is in
+production.
+
+    python -m benchmarks.reminders
+"""
+import datetime
+import random
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base, config, mail, mail_actions, reminder
+from community_share.models import share, survey  # noqa: F401, registers Answer for Event
+from community_share.models.conversation import Conversation
+from community_share.models.outbox import OutboxMail
+from community_share.models.share import Event, EventReminder, Share
+from community_share.models.user import User
+
+SCALES = [1000, 4000, 16000]
+SOON_FRACTION = 0.1
+USERS_PER_EVENT = 0.5
+
+CONFIG = {
+    'MAILER_TYPE': 'MAILGUN',
+    'BASEURL': 'https://communityshare.example.org',
+    'DONOTREPLY_EMAIL_ADDRESS': 'CommunityShare <donotreply@example.org>',
+}
+
+
+class Store(object):
+    def __init__(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.session = sessionmaker(bind=self.engine)()
+
+
+def populate(store, n_events):
+    rng = random.Random(0)
+    now = datetime.datetime.utcnow()
+    n_users = int(n_events * USERS_PER_EVENT)
+    Base.metadata.create_all(store.engine)
+    connection = store.session.connection()
+    connection.execute(User.__table__.insert(), [
+        {
+            'id': i,
+            'name': 'User {}'.format(i),
+            'email': 'user{}@example.org'.format(i),
+            'email_confirmed': True,
+            'active': True,
+        } for i in range(1, n_users + 1)
+    ])
+    connection.execute(Conversation.__table__.insert(), [
+        {
+            'id': i,
+            'title': 'Conversation',
+            'userA_id': rng.randint(1, n_users),
+            'userB_id': rng.randint(1, n_users),
+            'active': True,
+        } for i in range(1, n_events + 1)
+    ])
+    connection.execute(Share.__table__.insert(), [
+        {
+            'id': i,
+            'conversation_id': i,
+            'educator_user_id': rng.randint(1, n_users),
+            'community_partner_user_id': rng.randint(1, n_users),
+            'title': 'Share {}'.format(i),
+            'description': 'Share',
+        } for i in range(1, n_events + 1)
+    ])
+    events = []
+    for i in range(1, n_events + 1):
+        if rng.random() < SOON_FRACTION:
+            start = now + datetime.timedelta(minutes=rng.randint(10, 23 * 60))
+        else:
+            start = now + datetime.timedelta(days=rng.randint(2, 60))
+        events.append({
+            'id': i,
+            'share_id': i,
+            'location': 'School',
+            'datetime_start': start,
+            'datetime_stop': start + datetime.timedelta(hours=1),
+            'active': rng.random() < 0.9,
+        })
+    connection.execute(Event.__table__.insert(), events)
+    store.session.commit()
+
+
+def sweep(n_events):
+    store = Store()
+    for module in (share, reminder, mail, mail_actions):
+        module.store = store
+    populate(store, n_events)
+
+    n_queries = []
+    event.listen(store.engine, 'before_cursor_execute', lambda *args: n_queries.append(1))
+    started = time.monotonic()
+    reminder.send_reminders()
+    seconds = time.monotonic() - started
+
+    n_reminders = store.session.query(EventReminder).count()
+    n_mails = store.session.query(OutboxMail).count()
+    return n_reminders, n_mails, len(n_queries), seconds
+
+
+if __name__ == '__main__':
+    for name, value in CONFIG.items():
+        setattr(config, name, value)
+    print('{:>8} {:>10} {:>8} {:>8} {:>10}'.format(
+        'events', 'reminded', 'mails', 'queries', 'time (s)'))
+    for n_events in SCALES:
+        n_reminders, n_mails, n_queries, seconds = sweep(n_events)
+        print('{:8} {:10} {:8} {:8} {:10.2f}'.format(
+            n_events, n_reminders, n_mails, n_queries, seconds))
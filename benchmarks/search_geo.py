@@ -0,0 +1,100 @@
+"""Effect of a searcher's distance on label-overlap matching
+
+Fills a search index with searches scattered around a few metro areas
+and reports, for each distance, how many searches the grid offers as
+candidates, how many of those are within the distance, and the time
+taken to rank the matches.
+
+    python -m benchmarks.search_geo
+"""
+import random
+import timeit
+
+from community_share import geo
+from community_share.search_index import RANK_BY_COMBINED, RANK_BY_LABELS, SearchIndex
+
+N_SEARCHES = 100000
+N_LABELS = 300
+LABELS_PER_SEARCH = 6
+N_QUERIES = 50
+DISTANCES = [5, 10, 25, 50, 100, 250, None]
+
+METROS = [
+    (32.22, -110.97),  # Tucson
+    (33.45, -112.07),  # Phoenix
+    (35.20, -111.65),  # Flagstaff
+    (36.17, -115.14),  # Las Vegas
+    (34.05, -118.24),  # Los Angeles
+]
+
+ROLES = ('partner', 'educator')
+
+
+def random_location(rng):
+    latitude, longitude = rng.choice(METROS)
+    return (latitude + rng.gauss(0, 0.3), longitude + rng.gauss(0, 0.3))
+
+
+def build_index(rng):
+    index = SearchIndex(rebuild_interval=None)
+    labelnames = ['label {}'.format(i) for i in range(N_LABELS)]
+    for search_id in range(N_SEARCHES):
+        index.update_search(
+            search_id,
+            True,
+            ROLES,
+            rng.sample(labelnames, LABELS_PER_SEARCH),
+            search_id,
+            random_location(rng),
+        )
+        index.update_user(search_id, True)
+    queries = [
+        (rng.sample(labelnames, LABELS_PER_SEARCH), random_location(rng))
+        for _ in range(N_QUERIES)
+    ]
+    return index, queries
+
+
+def grid_candidates(index, location, distance):
+    cells = index._cells[ROLES]
+    return sum(len(cells.get(cell, ())) for cell in geo.cells_within(location, distance))
+
+
+def measure(index, queries, distance, rank_by):
+    def rank_all():
+        for labelnames, location in queries:
+            index.ranked_matches(
+                labelnames, *ROLES, near=location, within=distance, rank_by=rank_by)
+
+    seconds = min(timeit.repeat(rank_all, number=1, repeat=3))
+    return seconds / len(queries) * 1e3
+
+
+if __name__ == '__main__':
+    index, queries = build_index(random.Random(0))
+    print('searches: {}, labels per search: {}'.format(N_SEARCHES, LABELS_PER_SEARCH))
+    print('{:>9} {:>11} {:>10} {:>9} {:>13} {:>13}'.format(
+        'distance', 'candidates', 'in range', 'matches', 'labels ms', 'combined ms'))
+    for distance in DISTANCES:
+        if distance is None:
+            candidates = in_range = N_SEARCHES
+        else:
+            candidates = sum(
+                grid_candidates(index, location, distance) for _, location in queries
+            ) / N_QUERIES
+            in_range = sum(
+                len(index.searches_near(*ROLES, location=location, distance=distance))
+                for _, location in queries
+            ) / N_QUERIES
+        matches = sum(
+            len(index.count_matches(labelnames, *ROLES, near=location, within=distance))
+            for labelnames, location in queries
+        ) / N_QUERIES
+        print('{:>9} {:>11.0f} {:>10.0f} {:>9.0f} {:>13.2f} {:>13.2f}'.format(
+            'any' if distance is None else distance,
+            candidates,
+            in_range,
+            matches,
+            measure(index, queries, distance, RANK_BY_LABELS),
+            measure(index, queries, distance, RANK_BY_COMBINED),
+        ))
@@ -0,0 +1,108 @@
+"""Cost of ranking searches by label overlap
+
+Compares the grouped join over `search_label` with the in-memory
+search index on a synthetic table of searches, and checks that both
+rank the same searches.
+
+    python -m benchmarks.search_matching
+"""
+import random
+import time
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base, search_utils
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.search import Label, Search, search_label_table
+from community_share.models.user import User
+from community_share.search_index import SearchIndex
+
+N_SEARCHES = 100000
+N_USERS = 10000
+N_LABELS = 300
+LABELS_PER_SEARCH = 6
+N_QUERIES = 20
+
+ROLES = [('educator', 'partner'), ('partner', 'educator')]
+
+
+class Store(object):
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+def populate(store):
+    rng = random.Random(0)
+    Base.metadata.create_all(store.engine)
+    connection = store.session.connection()
+    connection.execute(User.__table__.insert(), [
+        {
+            'id': i,
+            'name': 'User {}'.format(i),
+            'email': 'user{}@example.com'.format(i),
+            'active': True,
+            'email_confirmed': rng.random() < 0.9,
+        } for i in range(1, N_USERS + 1)
+    ])
+    connection.execute(Label.__table__.insert(), [
+        {'id': i, 'name': 'Label {}'.format(i), 'active': True}
+        for i in range(1, N_LABELS + 1)
+    ])
+    connection.execute(Search.__table__.insert(), [
+        {
+            'id': i,
+            'searcher_user_id': rng.randint(1, N_USERS),
+            'searcher_role': ROLES[i % 2][0],
+            'searching_for_role': ROLES[i % 2][1],
+            'active': True,
+        } for i in range(1, N_SEARCHES + 1)
+    ])
+    connection.execute(search_label_table.insert(), [
+        {'search_id': search_id, 'label_id': label_id}
+        for search_id in range(1, N_SEARCHES + 1)
+        for label_id in rng.sample(range(1, N_LABELS + 1), LABELS_PER_SEARCH)
+    ])
+    store.session.commit()
+
+
+def sample_queries(store):
+    rng = random.Random(1)
+    labels = store.session.query(Label).all()
+    return [rng.sample(labels, LABELS_PER_SEARCH) for _ in range(N_QUERIES)]
+
+
+def time_per_query(find, queries):
+    seconds = min(timeit.repeat(lambda: [find(labels) for labels in queries], number=1, repeat=3))
+    return seconds / len(queries) * 1e3
+
+
+if __name__ == '__main__':
+    store = Store()
+    populate(store)
+    index = SearchIndex(rebuild_interval=None)
+    search_utils.store = store
+    search_utils.search_index = index
+
+    started = time.monotonic()
+    index.rebuild(store.session)
+    build = time.monotonic() - started
+
+    queries = sample_queries(store)
+    query_database = lambda labels: search_utils.query_searches_ordered_by_label_matches(
+        labels, 'partner', 'educator')
+    query_index = lambda labels: search_utils.get_searches_ordered_by_label_matches(
+        labels, 'partner', 'educator')
+
+    for labels in queries:
+        assert query_database(labels) == query_index(labels)
+
+    database = time_per_query(query_database, queries)
+    indexed = time_per_query(query_index, queries)
+    print('searches: {}, labels per search: {}'.format(N_SEARCHES, LABELS_PER_SEARCH))
+    print('index build:      {:8.2f} s'.format(build))
+    print('database ranking: {:8.2f} ms/query'.format(database))
+    print('index ranking:    {:8.2f} ms/query'.format(indexed))
+    print('speedup:          {:8.2f}x'.format(database / indexed))
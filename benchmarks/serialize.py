@@ -0,0 +1,80 @@
+"""Per-object cost of Serializable.serialize
+
+Compares the precompiled field plans against the previous
+implementation, which rebuilt the field set on every call.
+
+    python -m benchmarks.serialize
+"""
+import timeit
+
+from community_share.models.base import Serializable
+
+N_OBJECTS = 20000
+
+FIELDS = ['field_{}'.format(i) for i in range(20)]
+
+
+def legacy_serialize(self, requester, exclude=[]):
+    if self.has_admin_rights(requester):
+        fieldnames = self.ADMIN_READABLE_FIELDS
+    elif self.has_standard_rights(requester):
+        fieldnames = self.STANDARD_READABLE_FIELDS
+    else:
+        return None
+
+    return {
+        key: (
+            self.custom_serializers[key](self, requester)
+            if key in self.custom_serializers else getattr(self, key)
+        )
+        for key in (set(fieldnames) - set(exclude)) | ({'id'} if hasattr(self, 'id') else set())
+    }
+
+
+class Child(Serializable):
+    STANDARD_READABLE_FIELDS = ['id'] + FIELDS
+    ADMIN_READABLE_FIELDS = STANDARD_READABLE_FIELDS
+
+    id = None
+
+    def __init__(self):
+        self.id = 1
+        for fieldname in FIELDS:
+            setattr(self, fieldname, fieldname)
+
+
+class Parent(Child):
+    STANDARD_READABLE_FIELDS = Child.STANDARD_READABLE_FIELDS + ['child', 'parent_name']
+    ADMIN_READABLE_FIELDS = STANDARD_READABLE_FIELDS
+
+    def __init__(self, serialize_child):
+        super().__init__()
+        self.child = Child()
+        self.serialize_child = serialize_child
+
+    custom_serializers = {
+        'child': lambda self, requester: self.serialize_child(self.child, requester, ['field_0']),
+        'parent_name': lambda self, requester: 'parent',
+    }
+
+
+class Requester(object):
+    is_administrator = False
+
+
+def time_per_object(serialize, n_objects=N_OBJECTS):
+    item = Parent(serialize)
+    requester = Requester()
+    seconds = min(
+        timeit.repeat(lambda: serialize(item, requester), number=n_objects, repeat=7),
+    )
+    return seconds / n_objects * 1e6
+
+
+if __name__ == '__main__':
+    legacy = time_per_object(legacy_serialize)
+    planned = time_per_object(Serializable.serialize)
+    print('objects: 1 parent with 1 nested child, {} fields each'.format(len(FIELDS)))
+    print('legacy serialize:  {:8.2f} us/object'.format(legacy))
+    print('planned serialize: {:8.2f} us/object'.format(planned))
+    print('speedup:           {:8.2f}x'.format(legacy / planned))
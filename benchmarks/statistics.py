@@ -0,0 +1,114 @@
+"""Cost of backfilling a year of daily statistics from the counters
+
+    python -m benchmarks.statistics
+"""
+import datetime
+import random
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models import statistics, survey  # noqa: F401, registers Answer for Event
+from community_share.models.conversation import Conversation
+from community_share.models.share import Event, Share
+from community_share.models.statistics import Statistic, StatisticCounter
+from community_share.models.user import User, UserReview
+
+N_USERS = 20000
+N_SHARES = 5000
+EVENTS_PER_SHARE = 3
+N_DAYS = 365
+
+
+class Store(object):
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+def populate(store, last_date):
+    rng = random.Random(0)
+    start = datetime.datetime.combine(last_date, datetime.time()) - datetime.timedelta(days=N_DAYS)
+
+    def some_time():
+        return start + datetime.timedelta(seconds=rng.randint(0, N_DAYS * 24 * 3600))
+
+    Base.metadata.create_all(store.engine)
+    connection = store.session.connection()
+    connection.execute(User.__table__.insert(), [
+        {
+            'id': i,
+            'name': 'User {}'.format(i),
+            'email': 'user{}@example.com'.format(i),
+            'active': True,
+            'date_created': some_time(),
+            'date_inactivated': some_time() if rng.random() < 0.1 else None,
+        } for i in range(1, N_USERS + 1)
+    ])
+    connection.execute(Conversation.__table__.insert(), [
+        {
+            'id': i,
+            'title': 'Conversation',
+            'userA_id': rng.randint(1, N_USERS),
+            'userB_id': rng.randint(1, N_USERS),
+            'date_created': some_time(),
+            'active': True,
+        } for i in range(1, N_SHARES + 1)
+    ])
+    connection.execute(Share.__table__.insert(), [
+        {
+            'id': i,
+            'conversation_id': i,
+            'educator_user_id': rng.randint(1, N_USERS),
+            'community_partner_user_id': rng.randint(1, N_USERS),
+            'description': 'Share',
+        } for i in range(1, N_SHARES + 1)
+    ])
+    events = []
+    for share_id in range(1, N_SHARES + 1):
+        for _ in range(EVENTS_PER_SHARE):
+            created = some_time()
+            stop = created + datetime.timedelta(days=rng.randint(1, 60))
+            events.append({
+                'share_id': share_id,
+                'location': 'School',
+                'date_created': created,
+                'datetime_start': stop - datetime.timedelta(hours=1),
+                'datetime_stop': stop,
+                'active': rng.random() < 0.9,
+            })
+    connection.execute(Event.__table__.insert(), events)
+    connection.execute(UserReview.__table__.insert(), [
+        {
+            'user_id': rng.randint(1, N_USERS),
+            'creator_user_id': rng.randint(1, N_USERS),
+            'event_id': rng.randint(1, len(events)),
+            'rating': 5,
+            'date_created': some_time(),
+        } for _ in range(N_SHARES)
+    ])
+    store.session.commit()
+
+
+if __name__ == '__main__':
+    store = Store()
+    statistics.store = store
+    last_date = Statistic.date_yesterday()
+    populate(store, last_date)
+    # The rows were inserted without going through the session, so count them.
+    StatisticCounter.reconcile()
+
+    n_queries = []
+    event.listen(store.engine, 'before_cursor_execute', lambda *args: n_queries.append(1))
+    started = time.monotonic()
+    Statistic.update_statistics_for_range(
+        last_date - datetime.timedelta(days=N_DAYS - 1), last_date)
+    seconds = time.monotonic() - started
+
+    n_stats = store.session.query(Statistic).count()
+    print('users: {}, events: {}'.format(N_USERS, N_SHARES * EVENTS_PER_SHARE))
+    print('backfilled {} days, {} statistics'.format(N_DAYS, n_stats))
+    print('queries: {}'.format(len(n_queries)))
+    print('time:    {:.2f} s'.format(seconds))
@@ -1,5 +1,6 @@
-from . import views
+from . import rollups, views
 
 
 def register_routes(app):
+    rollups.register_routes(app)
     views.register_routes(app)
@@ -0,0 +1,31 @@
+from . import get_funnel, get_paths, get_transitions, get_users
+
+
+def register_routes(app):
+    app.route(
+        '/rest/analytics/paths',
+        endpoint='analyticsPaths',
+        methods=['GET'],
+        strict_slashes=False,
+    )(get_paths.endpoint)
+
+    app.route(
+        '/rest/analytics/transitions',
+        endpoint='analyticsTransitions',
+        methods=['GET'],
+        strict_slashes=False,
+    )(get_transitions.endpoint)
+
+    app.route(
+        '/rest/analytics/funnel',
+        endpoint='analyticsFunnel',
+        methods=['GET'],
+        strict_slashes=False,
+    )(get_funnel.endpoint)
+
+    app.route(
+        '/rest/analytics/users',
+        endpoint='analyticsUsers',
+        methods=['GET'],
+        strict_slashes=False,
+    )(get_users.endpoint)
@@ -0,0 +1,89 @@
+import datetime
+from typing import List
+
+from flask import jsonify, request, Response
+
+from community_share import Store, with_store
+from community_share.api.analytics.rollups.params import parse_date_range
+from community_share.app_exceptions import BadRequest
+from community_share.flask_helpers import needs_admin_auth
+from community_share.models.analytics import TransitionViews
+from community_share.models.user import User
+
+MAX_FUNNEL_STEPS = 20
+
+
+@needs_admin_auth()
+def endpoint(requester: User) -> Response:
+    """ Funnel Endpoint
+
+    http:get:: /rest/analytics/funnel
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /rest/analytics/funnel?path=/search&path=/profile&path=/messages HTTP/1.1
+       Host: app.communityshare.us
+       Accept: application/json
+       Authorization: Basic:username:password
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+          "steps": [ {
+             "prev_path": "/search",
+             "next_path": "/profile",
+             "n_views": 312
+          }, {
+             "prev_path": "/profile",
+             "next_path": "/messages",
+             "n_views": 41
+          } ],
+          "links": [ {
+             "rel": "self",
+             "href": "https://app.communityshare.us/rest/analytics/funnel?path=/search&path=/profile&path=/messages"
+          } ]
+       }
+
+    Each step counts the views of a path straight after the path
+    before it, whoever viewed it.
+
+    :query list string path: the paths of the funnel in order, at least two
+    :query date start: first day counted, default is 30 days before `end`
+    :query date end: last day counted, default is today
+
+    :statuscode 200: funnel fetched
+    :statuscode 400: invalid arguments passed in
+    :statuscode 401: needs administrator authentication
+
+    """
+    paths = request.args.getlist('path')
+    if not 2 <= len(paths) <= MAX_FUNNEL_STEPS:
+        raise BadRequest('Pass in between 2 and {} paths, as `path=/first&path=/second`'.format(
+            MAX_FUNNEL_STEPS))
+    start, end = parse_date_range(request.args)
+    counts = get_funnel(paths, start, end)
+
+    return jsonify({
+        'steps': [
+            {'prev_path': prev_path, 'next_path': next_path, 'n_views': n_views}
+            for prev_path, next_path, n_views in zip(paths, paths[1:], counts)
+        ],
+        'links': [{'rel': 'self', 'href': request.url}],
+    })
+
+
+@with_store
+def get_funnel(
+    paths: List[str],
+    start: datetime.date,
+    end: datetime.date,
+    store: Store=None,
+) -> List[int]:
+    return TransitionViews.funnel(store.session, paths, start, end)
@@ -0,0 +1,74 @@
+import datetime
+from typing import List, Tuple
+
+from flask import jsonify, request, Response
+
+from community_share import Store, with_store
+from community_share.api.analytics.rollups.params import parse_date_range, parse_number
+from community_share.flask_helpers import needs_admin_auth
+from community_share.models.analytics import PathViews
+from community_share.models.user import User
+
+
+@needs_admin_auth()
+def endpoint(requester: User) -> Response:
+    """ Top Paths Endpoint
+
+    http:get:: /rest/analytics/paths
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /rest/analytics/paths?start=2016-10-01&end=2016-10-31&number=2 HTTP/1.1
+       Host: app.communityshare.us
+       Accept: application/json
+       Authorization: Basic:username:password
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+          "paths": [ {
+             "path": "/search",
+             "n_views": 5120
+          }, {
+             "path": "/messages",
+             "n_views": 2048
+          } ],
+          "links": [ {
+             "rel": "self",
+             "href": "https://app.communityshare.us/rest/analytics/paths?start=2016-10-01&end=2016-10-31&number=2"
+          } ]
+       }
+
+    :query date start: first day counted, default is 30 days before `end`
+    :query date end: last day counted, default is today
+    :query int number: maximum number of returned paths, default is 10, max is 100
+
+    :statuscode 200: paths fetched
+    :statuscode 400: invalid arguments passed in
+    :statuscode 401: needs administrator authentication
+
+    """
+    start, end = parse_date_range(request.args)
+    paths = get_paths(start, end, parse_number(request.args))
+
+    return jsonify({
+        'paths': [{'path': path, 'n_views': n_views} for path, n_views in paths],
+        'links': [{'rel': 'self', 'href': request.url}],
+    })
+
+
+@with_store
+def get_paths(
+    start: datetime.date,
+    end: datetime.date,
+    number: int,
+    store: Store=None,
+) -> List[Tuple[str, int]]:
+    return PathViews.top(store.session, start, end, number)
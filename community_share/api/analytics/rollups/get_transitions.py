@@ -0,0 +1,90 @@
+import datetime
+from typing import List, Optional, Tuple
+
+from flask import jsonify, request, Response
+
+from community_share import Store, with_store
+from community_share.api.analytics.rollups.params import parse_date_range, parse_number
+from community_share.flask_helpers import needs_admin_auth
+from community_share.models.analytics import TransitionViews
+from community_share.models.user import User
+
+
+@needs_admin_auth()
+def endpoint(requester: User) -> Response:
+    """ Top Transitions Endpoint
+
+    http:get:: /rest/analytics/transitions
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /rest/analytics/transitions?prev_path=/search&number=2 HTTP/1.1
+       Host: app.communityshare.us
+       Accept: application/json
+       Authorization: Basic:username:password
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+          "transitions": [ {
+             "prev_path": "/search",
+             "next_path": "/profile/23",
+             "n_views": 312
+          }, {
+             "prev_path": "/search",
+             "next_path": "/messages",
+             "n_views": 97
+          } ],
+          "links": [ {
+             "rel": "self",
+             "href": "https://app.communityshare.us/rest/analytics/transitions?prev_path=/search&number=2"
+          } ]
+       }
+
+    :query date start: first day counted, default is 30 days before `end`
+    :query date end: last day counted, default is today
+    :query int number: maximum number of returned transitions, default is 10, max is 100
+    :query string prev_path: only count transitions from this path
+    :query string next_path: only count transitions to this path
+
+    :statuscode 200: transitions fetched
+    :statuscode 400: invalid arguments passed in
+    :statuscode 401: needs administrator authentication
+
+    """
+    start, end = parse_date_range(request.args)
+    transitions = get_transitions(
+        start,
+        end,
+        parse_number(request.args),
+        prev_path=request.args.get('prev_path'),
+        next_path=request.args.get('next_path'),
+    )
+
+    return jsonify({
+        'transitions': [
+            {'prev_path': prev_path, 'next_path': next_path, 'n_views': n_views}
+            for prev_path, next_path, n_views in transitions
+        ],
+        'links': [{'rel': 'self', 'href': request.url}],
+    })
+
+
+@with_store
+def get_transitions(
+    start: datetime.date,
+    end: datetime.date,
+    number: int,
+    prev_path: Optional[str]=None,
+    next_path: Optional[str]=None,
+    store: Store=None,
+) -> List[Tuple[str, str, int]]:
+    return TransitionViews.top(
+        store.session, start, end, number, prev_path=prev_path, next_path=next_path)
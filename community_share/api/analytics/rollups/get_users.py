@@ -0,0 +1,84 @@
+import datetime
+from typing import Dict, Optional
+
+from flask import jsonify, request, Response
+
+from community_share import Store, with_store
+from community_share.api.analytics.rollups.params import parse_date_range
+from community_share.flask_helpers import needs_admin_auth
+from community_share.models.analytics import UserDayViews
+from community_share.models.user import User
+from community_share.utils import int_or
+
+
+@needs_admin_auth()
+def endpoint(requester: User) -> Response:
+    """ Daily Viewers Endpoint
+
+    http:get:: /rest/analytics/users
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /rest/analytics/users?start=2016-10-01&end=2016-10-02 HTTP/1.1
+       Host: app.communityshare.us
+       Accept: application/json
+       Authorization: Basic:username:password
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+          "data": {
+             "2016-10-01": {
+                "n_users": 83,
+                "n_views": 1204
+             },
+             "2016-10-02": {
+                "n_users": 61,
+                "n_views": 877
+             }
+          },
+          "links": [ {
+             "rel": "self",
+             "href": "https://app.communityshare.us/rest/analytics/users?start=2016-10-01&end=2016-10-02"
+          } ]
+       }
+
+    Days without any views are left out.
+
+    :query date start: first day counted, default is 30 days before `end`
+    :query date end: last day counted, default is today
+    :query int user_id: only count the views of this user
+
+    :statuscode 200: daily counts fetched
+    :statuscode 400: invalid arguments passed in
+    :statuscode 401: needs administrator authentication
+
+    """
+    start, end = parse_date_range(request.args)
+    days = get_daily_views(
+        start,
+        end,
+        user_id=int_or(request.args.get('user_id'), None),
+    )
+
+    return jsonify({
+        'data': {day.isoformat(): counts for day, counts in days.items()},
+        'links': [{'rel': 'self', 'href': request.url}],
+    })
+
+
+@with_store
+def get_daily_views(
+    start: datetime.date,
+    end: datetime.date,
+    user_id: Optional[int]=None,
+    store: Store=None,
+) -> Dict[datetime.date, Dict[str, int]]:
+    return UserDayViews.daily(store.session, start, end, user_id=user_id)
@@ -0,0 +1,39 @@
+import datetime
+from typing import Tuple
+
+from werkzeug.datastructures import MultiDict
+
+from community_share.app_exceptions import BadRequest
+from community_share.models.statistics import MAX_REPORT_DAYS
+from community_share.utils import clamped, int_or
+
+DEFAULT_DAYS = 30
+
+
+def parse_date(value: str, name: str) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise BadRequest('{} must be a date formatted as YYYY-MM-DD, not {}'.format(name, value))
+
+
+def parse_date_range(args: MultiDict) -> Tuple[datetime.date, datetime.date]:
+    """
+    Days from `start` to `end`, inclusive, by default the
+    `DEFAULT_DAYS` up to today (UTC)
+    """
+    end = args.get('end')
+    end = parse_date(end, 'end') if end else datetime.datetime.utcnow().date()
+    start = args.get('start')
+    if start:
+        start = parse_date(start, 'start')
+    else:
+        start = end - datetime.timedelta(days=DEFAULT_DAYS - 1)
+    if not (0 <= (end - start).days < MAX_REPORT_DAYS):
+        raise BadRequest('start must be before end and at most {} days earlier'.format(
+            MAX_REPORT_DAYS - 1))
+    return start, end
+
+
+def parse_number(args: MultiDict) -> int:
+    return clamped(1, 100, int_or(args.get('number'), 10))
@@ -0,0 +1,149 @@
+"""Batched writing of page views
+
+Requests only append their page view to the process's
+`page_view_buffer`.  Its thread writes the buffered views with one
+multi-row insert in one transaction when `FLUSH_SIZE` of them have
+built up, at least every `FLUSH_INTERVAL` seconds, and when the
+process exits.  Views buffered by a process that is killed outright
+are lost, which is acceptable for analytics.
+
+A process forked from one using the buffer, like a gunicorn worker
+from a preloading master, starts a thread of its own and leaves the
+views buffered before the fork to its parent.  Views added once the
+buffer is stopped are written straight away.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from community_share import store as default_store
+from community_share.models.analytics import PageView
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 5  # seconds
+# Views kept while the database cannot be written to; older ones are
+# dropped beyond this.
+MAX_BUFFERED = 50000
+
+
+class PageViewBuffer(object):
+    def __init__(
+            self,
+            store=None,
+            flush_size: int=FLUSH_SIZE,
+            flush_interval: float=FLUSH_INTERVAL,
+    ) -> None:
+        self.store = store if store is not None else default_store
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.n_flushes = 0
+        self.n_dropped = 0
+        self._stopping = False
+        self._reset()
+
+    def _reset(self):
+        # Threads do not survive a fork, and neither can the locks they
+        # might have held, so the process owning these is kept.
+        self._pid = os.getpid()
+        self._rows = []
+        self._lock = threading.Lock()
+        # Only one flush writes at a time, so views keep their order.
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(
+            self,
+            user_id: int,
+            next_path: str,
+            prev_path: str,
+            viewed_at: Optional[datetime.datetime]=None,
+    ) -> None:
+        """Buffer a page view, to be written by the buffer's thread"""
+        if self._pid != os.getpid():
+            self._reset()
+        if viewed_at is None:
+            viewed_at = datetime.datetime.utcnow()
+        row = {
+            'user_id': user_id,
+            'viewed_at': viewed_at,
+            'next_path': next_path,
+            'prev_path': prev_path,
+        }
+        with self._lock:
+            self._rows.append(row)
+            stopped = self._stopping
+            full = len(self._rows) >= self.flush_size
+            if self._thread is None and not stopped:
+                self._thread = threading.Thread(
+                    target=self._run, name='page-view-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        if stopped:
+            # No thread is left to write it, e.g. for a view recorded
+            # by another exit handler.
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Write every buffered view in one transaction
+
+        If that fails the views are kept for the next flush.
+
+        :return: number of views written
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            try:
+                with self.store.engine.begin() as connection:
+                    connection.execute(PageView.__table__.insert(), rows)
+            except SQLAlchemyError:
+                logger.exception('Could not write {} page views'.format(len(rows)))
+                self._put_back(rows)
+                return 0
+            self.n_flushes += 1
+            return len(rows)
+
+    def _put_back(self, rows):
+        with self._lock:
+            self._rows = rows + self._rows
+            excess = len(self._rows) - MAX_BUFFERED
+            if excess > 0:
+                del self._rows[:excess]
+                self.n_dropped += excess
+                logger.warning('Dropped {} page views'.format(excess))
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self) -> None:
+        """Stop the thread and write what is left"""
+        self._stopping = True
+        if self._pid != os.getpid():
+            self._reset()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+
+page_view_buffer = PageViewBuffer()
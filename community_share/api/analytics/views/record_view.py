@@ -2,9 +2,8 @@ from http import HTTPStatus
 
 from flask import request
 
-from community_share import with_store
+from community_share.api.analytics.views.buffer import page_view_buffer
 from community_share.flask_helpers import needs_auth
-from community_share.models.analytics import PageView
 from community_share.routes.base_routes import make_bad_request_response
 
 
@@ -24,13 +23,13 @@ def endpoint(requester):
     return make_bad_request_response('Please provide non-empty `next_path` and `prev_path` to track')
 
 
-@with_store
-def record_view(user_id, next_path, prev_path, store=None):
+def record_view(user_id, next_path, prev_path, buffer=None):
     if not is_valid_path(next_path) or not is_valid_path(prev_path):
         return False
 
-    store.session.add(PageView(user_id, next_path, prev_path))
-    store.session.commit()
+    if buffer is None:
+        buffer = page_view_buffer
+    buffer.add(user_id, next_path, prev_path)
 
     return True
 
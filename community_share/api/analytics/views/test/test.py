@@ -1,15 +1,27 @@
+import os
+import time
 import unittest
+from unittest import mock
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from community_share import Base
+from community_share.api.analytics.views import buffer as buffer_module
+from community_share.api.analytics.views.buffer import PageViewBuffer
 from community_share.api.analytics.views.record_view import record_view
 from community_share.models.analytics import PageView
+from community_share.models import survey  # noqa: F401, registers Answer for Event
 
 
 class Store:
-    engine = create_engine('sqlite:///:memory:')
+    # The buffer writes from its own thread, so that must see the same database.
+    engine = create_engine(
+        'sqlite://',
+        connect_args={'check_same_thread': False},
+        poolclass=StaticPool,
+    )
     Session = sessionmaker(bind=engine)
     session = Session()
 
@@ -17,28 +29,117 @@ class Store:
 store = Store()
 
 
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
 class PageViewTest(unittest.TestCase):
     def setUp(self):
         Base.metadata.drop_all(store.engine)
         Base.metadata.create_all(store.engine)
+        self.buffer = PageViewBuffer(store=store, flush_interval=60)
+
+    def tearDown(self):
+        self.buffer.stop()
+        store.session.rollback()
+
+    def count(self):
+        store.session.rollback()
+        return store.session.query(PageView).count()
 
     def test_rejects_short_next_path(self):
-        self.assertFalse(record_view(1, '', '/some/valid/path', store=store))
+        self.assertFalse(record_view(1, '', '/some/valid/path', buffer=self.buffer))
 
     def test_rejects_short_prev_path(self):
-        self.assertFalse(record_view(1, '/some/valid/path', '', store=store))
+        self.assertFalse(record_view(1, '/some/valid/path', '', buffer=self.buffer))
 
     def test_rejects_non_strings(self):
-        self.assertFalse(record_view(1, 1, '', store=store))
+        self.assertFalse(record_view(1, 1, '', buffer=self.buffer))
+        self.assertEqual(0, len(self.buffer))
 
     def test_stores_page_view(self):
-        record_view(1, '/next/path', '/prev/path', store=store)
-        self.assertEqual(1, store.session.query(PageView).count())
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.buffer.flush()
+        self.assertEqual(1, self.count())
+        view = store.session.query(PageView).one()
+        self.assertEqual((1, '/next/path', '/prev/path'),
+                         (view.user_id, view.next_path, view.prev_path))
+        self.assertIsNotNone(view.viewed_at)
 
     def test_stores_duplicates(self):
-        record_view(1, '/next/path', '/prev/path', store=store)
-        record_view(1, '/next/path', '/prev/path', store=store)
-        self.assertEqual(2, store.session.query(PageView).count())
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.buffer.flush()
+        self.assertEqual(2, self.count())
+
+    def test_buffers_views_until_flushed(self):
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.assertEqual(1, len(self.buffer))
+        self.assertEqual(0, self.count())
+        self.assertEqual(1, self.buffer.flush())
+        self.assertEqual(0, self.buffer.flush())
+        self.assertEqual(1, self.buffer.n_flushes)
+
+    def test_flushes_when_full(self):
+        self.buffer.flush_size = 3
+        for _ in range(3):
+            record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.assertTrue(wait_for(lambda: self.buffer.n_flushes == 1))
+        self.assertEqual(3, self.count())
+
+    def test_flushes_after_interval(self):
+        self.buffer.flush_interval = 0.05
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.assertTrue(wait_for(lambda: self.buffer.n_flushes == 1))
+        self.assertEqual(1, self.count())
+
+    def test_keeps_views_when_write_fails(self):
+        PageView.__table__.drop(store.engine)
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.assertEqual(0, self.buffer.flush())
+        self.assertEqual(1, len(self.buffer))
+
+        PageView.__table__.create(store.engine)
+        record_view(2, '/next/path', '/prev/path', buffer=self.buffer)
+        self.assertEqual(2, self.buffer.flush())
+        user_ids = [user_id for (user_id, ) in store.session.query(PageView.user_id).order_by(PageView.id)]
+        self.assertEqual([1, 2], user_ids)
+
+    def test_stop_writes_remaining_views(self):
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        self.buffer.stop()
+        self.assertEqual(1, self.count())
+
+    def test_views_added_after_stop_are_written(self):
+        self.buffer.stop()
+
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+
+        self.assertEqual(0, len(self.buffer))
+        self.assertEqual(1, self.count())
+
+    def test_forked_process_starts_its_own_thread(self):
+        record_view(1, '/next/path', '/prev/path', buffer=self.buffer)
+        parent_thread, parent_wakeup = self.buffer._thread, self.buffer._wakeup
+
+        with mock.patch.object(buffer_module.os, 'getpid', return_value=os.getpid() + 1):
+            record_view(2, '/next/path', '/prev/path', buffer=self.buffer)
+            child_thread = self.buffer._thread
+
+            # Views buffered before the fork are the parent's to write.
+            self.assertEqual(1, len(self.buffer))
+            self.assertIsNot(parent_thread, child_thread)
+            self.assertTrue(child_thread.is_alive())
+            self.buffer.stop()
+
+        self.assertEqual([2], [user_id for (user_id, ) in store.session.query(PageView.user_id)])
+        # A real fork would not have copied the parent's thread.
+        parent_wakeup.set()
+        parent_thread.join(5)
+        self.assertFalse(parent_thread.is_alive())
 
 
 if __name__ == '__main__':
@@ -1,11 +1,26 @@
+import hashlib
+import hmac
+import os
 from typing import Optional
 
 from flask import request
 
 from community_share import Store, with_store
-from community_share.models.secret import lookup_secret
+from community_share.cache import TTLCache
+from community_share.models.secret import resolve_secret
 from community_share.models.user import User
 
+LOGIN_CACHE_SIZE = 1024
+LOGIN_CACHE_TTL = 300  # seconds
+
+# Maps a keyed digest of verified `Basic:email:password` credentials
+# to (user id, password hash) so repeat requests skip the KDF.
+login_cache = TTLCache(max_size=LOGIN_CACHE_SIZE, ttl=LOGIN_CACHE_TTL)
+
+# Per-process key so the digests held in memory cannot be
+# brute-forced offline back into passwords.
+_login_cache_key = os.urandom(32)
+
 
 def get_requesting_user() -> Optional[User]:
     """Fetch User given Flask request
@@ -37,18 +52,18 @@ def user_from_api_key(key: str, store: Store=None) -> Optional[User]:
     :param store: connection to database
     :return: found user or None
     """
-    secret = lookup_secret(key, store=store)
+    resolved = resolve_secret(key, store=store)
 
-    if secret is None:
+    if resolved is None:
         return None
 
-    info = secret.get_info()
+    user_id, _, action = resolved
 
-    if info.get('action') != 'api_key':
+    if action != 'api_key':
         return None
 
     query = store.session.query(User)
-    query = query.filter(User.id == info.get('userId'))
+    query = query.filter(User.id == user_id)
     query = query.filter(User.active == True)
 
     return query.first()
@@ -63,6 +78,24 @@ def user_from_login(email: str, password: str, store: Store=None) -> Optional[Us
     :param store: connection to database
     :return: found user or None
     """
+    digest = login_digest(email, password)
+    cached = login_cache.get(digest)
+
+    if cached is not None:
+        user_id, password_hash = cached
+
+        user = store.session.query(User)
+        user = user.filter(User.id == user_id)
+        user = user.filter(User.active == True)
+        user = user.first()
+
+        # The password may have been changed by another process,
+        # so only trust the entry if the stored hash still matches.
+        if user is not None and user.email == email and user.password_hash == password_hash:
+            return user
+
+        login_cache.discard(digest)
+
     user = store.session.query(User)
     user = user.filter(User.email == email)
     user = user.filter(User.active == True)
@@ -74,4 +107,28 @@ def user_from_login(email: str, password: str, store: Store=None) -> Optional[Us
     if not user.is_password_correct(password):
         return None
 
+    login_cache.set(digest, (user.id, user.password_hash))
+
     return user
+
+
+def login_digest(email: str, password: str) -> str:
+    """Keyed digest of the credentials in an Authorization header
+
+    :param email: given email
+    :param password: given password
+    :return: hex digest usable as a `login_cache` key
+    """
+    header = 'Basic:{}:{}'.format(email, password)
+
+    return hmac.new(_login_cache_key, header.encode('utf8'), hashlib.sha256).hexdigest()
+
+
+def invalidate_login_cache(user_id: int) -> None:
+    """Forget every cached login for a user
+
+    Call whenever a user's password or active state changes.
+
+    :param user_id: id of user whose logins to forget
+    """
+    login_cache.discard_where(lambda _, value: value[0] == user_id)
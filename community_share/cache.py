@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """Bounded, thread-safe in-process cache
+
+    Entries are evicted least-recently-used first once `max_size`
+    is reached and are treated as missing once they are older
+    than `ttl` seconds. A `ttl` of None keeps entries until they
+    are evicted or discarded.
+
+    Each process (gunicorn worker, clock process) holds its own
+    copy, so anything cached here must either be safe to serve
+    slightly stale or be re-validated by the caller.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float]=None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any=None, count: bool=True) -> Any:
+        """Fetch a live entry, marking it as recently used
+
+        :param key: cache key
+        :param default: returned when the key is missing or expired
+        :param count: whether to record the lookup in the hit/miss counters
+        :return: cached value or `default`
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and self._is_expired(entry):
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Drop every entry for which `predicate(key, value)` is true
+
+        :return: number of entries dropped
+        """
+        with self._lock:
+            doomed = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+            for key in doomed:
+                del self._entries[key]
+        return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
+
+    def _is_expired(self, entry) -> bool:
+        if self.ttl is None:
+            return False
+        stored_at, _ = entry
+        return time.monotonic() - stored_at > self.ttl
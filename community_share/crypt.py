@@ -1,3 +1,8 @@
+"""Encryption of the tokens in reply-to email addresses
+
+Messages are encrypted with AES in CBC mode under a fixed key and IV,
+so that the same text always gives the same token.
+"""
 from Crypto import Random
 from Crypto.Cipher import AES
 
@@ -5,42 +10,41 @@ from Crypto.Cipher import AES
 class CryptHelper(object):
     @classmethod
     def encode(cls, bytestring):
-        encoded = ''.join(["%02X" % x for x in bytestring])
-        return encoded
+        return bytestring.hex().upper()
 
     @classmethod
     def decode(cls, hexstring):
-        bs = []
-        for i in range(0, len(hexstring), 2):
-            bs.append(int(hexstring[i:i + 2], 16))
-        return bytes(bs)
+        return bytes.fromhex(hexstring)
 
     def __init__(self, combined_key):
         combined = self.decode(combined_key)
-        key = combined[0:AES.block_size]
-        iv = combined[AES.block_size:2 * AES.block_size]
-        self.params = (key, AES.MODE_CBC, iv)
+        self.key = combined[0:AES.block_size]
+        self.iv = combined[AES.block_size:2 * AES.block_size]
 
     def make_aes(self):
-        return AES.new(*self.params)
+        # A CBC cipher carries its chaining from one call to the next,
+        # so every message needs a new one.
+        return AES.new(self.key, AES.MODE_CBC, self.iv)
 
-    def encrypt(self, message):
+    @classmethod
+    def pad(cls, message):
         message = message.encode('utf8')
-        aes = self.make_aes()
         offset = len(message) % AES.block_size
         if offset == 0:
             padding_required = 0
         else:
             padding_required = AES.block_size - offset
-        message += padding_required * b' '
-        encrypted = aes.encrypt(message)
-        encoded = self.encode(encrypted)
-        return encoded
+        return message + padding_required * b' '
+
+    def encrypt(self, message):
+        encrypted = self.make_aes().encrypt(self.pad(message))
+        return self.encode(encrypted)
 
     def decrypt(self, message):
-        aes = self.make_aes()
         decoded = self.decode(message)
-        decrypted = aes.decrypt(decoded)
+        if len(decoded) % AES.block_size != 0:
+            raise ValueError('Encrypted message is not a whole number of blocks')
+        decrypted = self.make_aes().decrypt(decoded)
         stripped = decrypted.decode('utf8').strip()
         return stripped
 
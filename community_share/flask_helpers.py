@@ -60,6 +60,11 @@ def serialize(user, raw_item, fields=None):
 
 
 def serialize_many(user, raw_items, fields=None):
+    raw_items = list(raw_items)
+
+    if raw_items:
+        type(raw_items[0]).eager_load(raw_items)
+
     items = [serialize(user, item, fields) for item in raw_items]
 
     return [item for item in items if item is not None]
@@ -0,0 +1,93 @@
+"""Distances between searches and a coarse grid for finding nearby ones
+
+Distances are in miles, matching the `distance` a searcher enters.
+"""
+import math
+from typing import Iterator, Optional, Sequence, Tuple
+
+EARTH_RADIUS = 3958.8  # miles
+MILES_PER_DEGREE_LATITUDE = 69.05
+# Every location on earth is within half its circumference.
+MAX_DISTANCE = math.pi * EARTH_RADIUS
+
+# A cell spans a fifth of a degree of latitude, about 14 miles.
+GRID_CELL_DEGREES = 0.2
+N_LONGITUDE_CELLS = int(360 / GRID_CELL_DEGREES)
+
+Location = Tuple[float, float]
+Cell = Tuple[int, int]
+
+
+def location_of(latitude: Optional[float], longitude: Optional[float]) -> Optional[Location]:
+    if latitude is None or longitude is None:
+        return None
+    return (latitude, longitude)
+
+
+def distance_between(a: Location, b: Location) -> float:
+    """Great-circle distance in miles"""
+    latitude_a, longitude_a = map(math.radians, a)
+    latitude_b, longitude_b = map(math.radians, b)
+    h = (
+        math.sin((latitude_b - latitude_a) / 2) ** 2 +
+        math.cos(latitude_a) * math.cos(latitude_b) * math.sin((longitude_b - longitude_a) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def cell_of(location: Location) -> Cell:
+    latitude, longitude = location
+    return (
+        math.floor(latitude / GRID_CELL_DEGREES),
+        math.floor(longitude / GRID_CELL_DEGREES) % N_LONGITUDE_CELLS,
+    )
+
+
+def _cell_ranges_within(location: Location, distance: float) -> Tuple[range, Sequence[int]]:
+    latitude, longitude = location
+    distance = min(distance, MAX_DISTANCE)
+    latitude_span = distance / MILES_PER_DEGREE_LATITUDE
+    lowest = max(latitude - latitude_span, -90.0)
+    highest = min(latitude + latitude_span, 90.0)
+
+    # Degrees of longitude shrink towards the poles, so the box is
+    # as wide as it is at whichever edge is closest to one.
+    widest = max(abs(lowest), abs(highest))
+    miles_per_degree_longitude = MILES_PER_DEGREE_LATITUDE * math.cos(math.radians(widest))
+    if miles_per_degree_longitude * 180 <= distance:
+        longitude_cells = range(N_LONGITUDE_CELLS)
+    else:
+        longitude_span = distance / miles_per_degree_longitude
+        first = math.floor((longitude - longitude_span) / GRID_CELL_DEGREES)
+        last = math.floor((longitude + longitude_span) / GRID_CELL_DEGREES)
+        longitude_cells = [
+            cell % N_LONGITUDE_CELLS
+            for cell in range(first, min(last, first + N_LONGITUDE_CELLS - 1) + 1)
+        ]
+
+    latitude_cells = range(
+        math.floor(lowest / GRID_CELL_DEGREES),
+        math.floor(highest / GRID_CELL_DEGREES) + 1,
+    )
+    return latitude_cells, longitude_cells
+
+
+def n_cells_within(location: Location, distance: float) -> int:
+    """Number of cells `cells_within` would return, without listing them"""
+    latitude_cells, longitude_cells = _cell_ranges_within(location, distance)
+    return len(latitude_cells) * len(longitude_cells)
+
+
+def cells_within(location: Location, distance: float) -> Iterator[Cell]:
+    """
+    Every grid cell that may hold a location within `distance` miles
+
+    Cells are taken from the bounding box around `location`, so some
+    of the locations they hold will be further away than `distance`.
+    Distances beyond `MAX_DISTANCE` cover the whole globe and are
+    treated as `MAX_DISTANCE`.
+    """
+    latitude_cells, longitude_cells = _cell_ranges_within(location, distance)
+    for latitude_cell in latitude_cells:
+        for longitude_cell in longitude_cells:
+            yield (latitude_cell, longitude_cell)
@@ -1,14 +1,38 @@
 import re
+import json
 import logging
+import threading
 import hmac, hashlib
+from contextlib import contextmanager
 
 import html2text
+import jinja2
 import requests
+from requests.adapters import HTTPAdapter
 
-from community_share import config
+from community_share import config, store
+from community_share.models.outbox import OutboxMail
 
 logger = logging.getLogger(__name__)
 
+MAILGUN_API_URL = 'https://api.mailgun.net/v2'
+MAILGUN_TIMEOUT = 30  # seconds
+# Mailgun takes at most this many recipients in one call.
+MAX_BATCH_RECIPIENTS = 1000
+# Mailgun answers these when the account, rather than a mail, is at fault.
+ACCOUNT_ERROR_CODES = {401, 402, 403}
+# Connections kept open to Mailgun, one for each thread sending mail.
+MAILGUN_CONNECTIONS = 4
+
+RECIPIENT_VARIABLE_PATTERN = re.compile(r'%recipient\.(\w+)%')
+# Mailgun fills the same variables into the text and html parts, so
+# each variable is also sent unescaped under this suffix for the
+# subject and the text part.
+TEXT_VARIABLE_SUFFIX = '_text'
+
+# Mail queued by this thread inside `deferred_commit`, or None outside it.
+_commit_state = threading.local()
+
 dummy_template = '''
 ----------------------------
 SENDING AN EMAIL
@@ -28,13 +52,61 @@ def verify_email(api_key, token, timestamp, signature):
     ).hexdigest()
 
 
+def recipient_variable(name):
+    """Placeholder that Mailgun replaces with a recipient's own value"""
+    return '%recipient.{}%'.format(name)
+
+
+def escape_recipient_variables(variables):
+    return {name: str(jinja2.escape(value)) for name, value in variables.items()}
+
+
+def text_recipient_variables(text):
+    """`text` with its placeholders swapped for their unescaped variables"""
+    return RECIPIENT_VARIABLE_PATTERN.sub(
+        lambda match: recipient_variable(match.group(1) + TEXT_VARIABLE_SUFFIX),
+        text,
+    )
+
+
+def fill_recipient_variables(text, variables):
+    if text is None or not variables:
+        return text
+    return RECIPIENT_VARIABLE_PATTERN.sub(
+        lambda match: str(variables.get(match.group(1), match.group(0))),
+        text,
+    )
+
+
 class Email(object):
-    def __init__(self, from_address, to_address, subject, content, new_content):
+    def __init__(self, from_address, to_address, subject, content, new_content,
+                 recipient_variables=None):
+        """
+        :param recipient_variables: values for the `recipient_variable`
+            placeholders in `subject` and `content`.  Mails that differ
+            only in these values can be sent in one call to Mailgun.
+            They are escaped where they are filled into `content`.
+        """
         self.from_address = from_address
         self.to_address = to_address
         self.subject = subject
         self.new_content = new_content
         self.content = content
+        self.recipient_variables = recipient_variables
+
+    def personalized(self):
+        """This mail with its recipient variables filled in"""
+        if not self.recipient_variables:
+            return self
+        variables = self.recipient_variables
+        escaped_variables = escape_recipient_variables(variables)
+        return Email(
+            self.from_address,
+            self.to_address,
+            fill_recipient_variables(self.subject, variables),
+            fill_recipient_variables(self.content, escaped_variables),
+            fill_recipient_variables(self.new_content, escaped_variables),
+        )
 
     def make_reply(self, new_content):
         new_from_address = self.to_address
@@ -97,44 +169,150 @@ class QueueMailer(object):
     def __init__(self):
         self.queue = []
 
-    def send(self, email):
-        self.queue.append(email)
+    def send(self, email, idempotency_key=None):
+        self.queue.append(email.personalized())
 
     def pop(self):
         return self.queue.pop(0)
 
 
 class DummyMailer(object):
-    def send(email):
-        text = dummy_template.format(email=email)
+    def send(email, idempotency_key=None):
+        text = dummy_template.format(email=email.personalized())
         logger.info(text)
 
 
+class DeliveryError(Exception):
+    """The mail service did not accept a mail
+
+    A permanent error will not go away by sending the mail again.
+    """
+    def __init__(self, message, permanent=False, status_code=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.status_code = status_code
+
+
+def make_mailgun_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=MAILGUN_CONNECTIONS,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared by the sending threads so that connections to Mailgun are
+# kept alive between calls.
+mailgun_session = make_mailgun_session()
+
+
+def deliver_with_mailgun(emails, idempotency_keys):
+    """
+    Hand `emails` to Mailgun in one call, blocking until it answers
+
+    The mails must share their sender, subject and content, and go to
+    different addresses; they may differ in their recipient variables.
+    Only the worker calls this, through `community_share.mail_sender`.
+
+    :raises DeliveryError: if Mailgun rejects the mails
+    :raises requests.RequestException: if Mailgun cannot be reached
+    """
+    first = emails[0]
+    # Mailgun sends each address in `to` its own copy only when
+    # recipient variables are given, so they always are.
+    recipient_variables = {}
+    for email, idempotency_key in zip(emails, idempotency_keys):
+        text_variables = email.recipient_variables or {}
+        variables = escape_recipient_variables(text_variables)
+        for name, value in text_variables.items():
+            variables[name + TEXT_VARIABLE_SUFFIX] = value
+        variables['idempotency_key'] = idempotency_key
+        recipient_variables[email.to_address] = variables
+    payload = {
+        'from': first.from_address,
+        'to': [email.to_address for email in emails],
+        'subject': text_recipient_variables(first.subject),
+        'text': text_recipient_variables(html2text.html2text(first.content)),
+        'html': first.content,
+        'recipient-variables': json.dumps(recipient_variables),
+    }
+    logger.info('Sending mail request to mailgun - {}'.format(payload))
+    r = mailgun_session.post(
+        '{0}/{1}/messages'.format(MAILGUN_API_URL, config.MAILGUN_DOMAIN),
+        auth=('api', config.MAILGUN_API_KEY),
+        data=payload,
+        timeout=MAILGUN_TIMEOUT,
+    )
+    if not r.ok:
+        try:
+            message = r.json()['message']
+        except (ValueError, KeyError):
+            message = r.text
+        logger.error('Mailgun API failed with message: {0}'.format(message))
+        # Mailgun asks for a retry with 429 and may recover from a 5xx.
+        permanent = r.status_code != 429 and r.status_code < 500
+        raise DeliveryError(
+            '{0} {1}'.format(r.status_code, message),
+            permanent=permanent,
+            status_code=r.status_code,
+        )
+    for email in emails:
+        text = dummy_template.format(email=email.personalized())
+        logger.debug(text)
+
+
+@contextmanager
+def deferred_commit():
+    """
+    Queue mail without committing until the end of the block
+
+    The mail queued in the block is added to the outbox in one
+    statement at its end and committed together with everything else
+    done in the block, so objects loaded for the mails are not expired
+    after each one.  If the block raises, nothing is queued or
+    committed.  A block within another one leaves queueing and
+    committing to the outer one.
+    """
+    if getattr(_commit_state, 'deferred', None) is not None:
+        yield
+        return
+    _commit_state.deferred = []
+    try:
+        yield
+        deferred = _commit_state.deferred
+    finally:
+        _commit_state.deferred = None
+    n_queued = OutboxMail.enqueue_many(store.session, deferred)
+    if deferred:
+        logger.debug('Queued {} of {} mails'.format(n_queued, len(deferred)))
+    store.session.commit()
+
+
 class MailgunMailer(object):
-    def send(email):
+    def send(email, idempotency_key=None):
+        """
+        Queue `email` to be sent by the worker
+
+        The mail is added to the outbox in the session's transaction,
+        so it is only sent if the caller commits, and is dropped with
+        everything else if the caller rolls back.  Within
+        `deferred_commit` it is queued at the end of the block instead.
+        """
         error_message = ''
-        if not (email.to_address.endswith('@example.com')):
-            payload = {
-                'from': email.from_address,
-                'to': email.to_address,
-                'subject': email.subject,
-                'text': html2text.html2text(email.content),
-                'html': email.content,
-            }
-            logger.info('Sending mail request to mailgun - {}'.format(payload))
-            r = requests.post(
-                'https://api.mailgun.net/v2/{0}/messages'.format(config.MAILGUN_DOMAIN),
-                auth=('api', config.MAILGUN_API_KEY),
-                data=payload,
-            )
-            if not r.ok:
-                logger.error('Mailgun API failed with message: {0}'.format(r.json()['message']))
-                error_message = 'Server failed to connect to email service.'
-            text = dummy_template.format(email=email)
-            logger.debug(text)
-        else:
-            text = dummy_template.format(email=email)
+        deferred = getattr(_commit_state, 'deferred', None)
+        if email.to_address.endswith('@example.com'):
+            text = dummy_template.format(email=email.personalized())
             logger.info(text)
+        elif deferred is not None:
+            deferred.append((email, idempotency_key))
+        else:
+            if OutboxMail.enqueue(store.session, email, idempotency_key):
+                logger.debug('Queued mail to {}'.format(email.to_address))
+            else:
+                logger.info('Mail {} was already queued'.format(idempotency_key))
         return error_message
 
 
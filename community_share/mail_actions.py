@@ -4,13 +4,13 @@ import jinja2
 
 from community_share.models.user import User
 from community_share.models.secret import create_secret, lookup_secret
-from community_share import mail, config, store, time_format
+from community_share import mail, config, store
 
 logger = logging.getLogger(__name__)
 
 
-def append_conversation_link(content, conversation):
-    conversation_url = '{0}/#/conversation/{1}'.format(config.BASEURL, conversation.id)
+def append_conversation_link(content, conversation_id):
+    conversation_url = '{0}/#/conversation/{1}'.format(config.BASEURL, conversation_id)
     content = content.replace('\n', '<br/>\n')
     content = '{content}<br/><br/>\nThe email is part of a Community Share Conversation.  Simply reply to this email to continue the conversation.  If you are ready to schedule an event or to view the entire conversation go to <a href={url}>{url}</a>'.format(
         content=content,
@@ -29,21 +29,41 @@ You recently signed up for an account with CommunityShare, a network connecting
 
 '''
 
+# Rendered once with Mailgun recipient variables in place of the
+# details, so that every reminder has the same content and a sweep's
+# reminders can be sent together.  The details are escaped as they
+# are filled into the html part.
+EVENT_REMINDER_VARIABLES = [
+    'other_user_name',
+    'title',
+    'description',
+    'educator_name',
+    'community_partner_name',
+    'location',
+    'starting',
+    'stopping',
+    'url',
+]
+
 EVENT_REMINDER_TEMPLATE = jinja2.Template(
-    '''<p>You have a share soon with {{other_user.name | e}}.  The share details are:</p>
+    '''<p>You have a share soon with {{other_user_name}}.  The share details are:</p>
 
-Title: {{share.title | e}}<br/>
-Description: {{share.description | e}}<br/>
+Title: {{title}}<br/>
+Description: {{description}}<br/>
 <br/>
-Educator: {{share.educator.name | e}}<br/>
-Community Partner: {{share.community_partner.name | e}}<br/>
+Educator: {{educator_name}}<br/>
+Community Partner: {{community_partner_name}}<br/>
 <p>
-{{eventdetails}}
+Location: {{location}}<br/>
+Starting: {{starting}}<br/>
+Stopping: {{stopping}}<br/>
 </p>
 Go to <a href={{url}}>{{url}}</a> for more details.
 ''',
 )
 
+EVENT_REMINDER_SUBJECT = 'Reminder for Share on {}'
+
 ACCOUNT_DELETION_TEMPLATE = jinja2.Template(
     '''You have requested to delete your Community Share account.
 If you did not make this request, or it was done accidentally please contact an administrator
@@ -213,17 +233,24 @@ def send_event_reminder_message(event):
     receivers = [share.educator, share.community_partner]
     other_users = [share.community_partner, share.educator]
     from_address = config.DONOTREPLY_EMAIL_ADDRESS
-    event_details = EVENT_EDIT_TEMPLATE.render(event=event)
     url = share.conversation.get_url()
-    subject = 'Reminder for Share on {}'.format(time_format.to_pretty(event.datetime_start))
+    placeholders = {name: mail.recipient_variable(name) for name in EVENT_REMINDER_VARIABLES}
+    subject = EVENT_REMINDER_SUBJECT.format(placeholders['starting'])
+    content = EVENT_REMINDER_TEMPLATE.render(**placeholders)
+    details = {
+        'title': share.title,
+        'description': share.description,
+        'educator_name': share.educator.name,
+        'community_partner_name': share.community_partner.name,
+        'location': event.location,
+        'starting': event.formatted_datetime_start,
+        'stopping': event.formatted_datetime_stop,
+    }
     error_messages = []
     for receiver, other_user in zip(receivers, other_users):
-        content = EVENT_REMINDER_TEMPLATE.render(
-            share=share,
-            eventdetails=event_details,
-            url=url,
-            other_user=other_user,
-        )
+        recipient_variables = dict(details)
+        recipient_variables['other_user_name'] = other_user.name
+        recipient_variables['url'] = url
         to_address = receiver.confirmed_email
         if not to_address:
             logger.warning('Will not send event reminder to unconfirmed email address.')
@@ -234,9 +261,11 @@ def send_event_reminder_message(event):
                 to_address=to_address,
                 subject=subject,
                 content=content,
-                new_content=content
+                new_content=content,
+                recipient_variables=recipient_variables,
             )
-            error_message = mail.get_mailer().send(email)
+            idempotency_key = 'event-reminder-{}-{}'.format(event.id, receiver.id)
+            error_message = mail.get_mailer().send(email, idempotency_key=idempotency_key)
         error_messages.append(error_message)
     combined_error_message = ', '.join([e for e in error_messages if e is not None])
     return combined_error_message
@@ -340,7 +369,7 @@ def send_conversation_message(message):
     from_address = message.generate_from_address()
     to_address = message.receiver_user().confirmed_email
     conversation_url = '{0}/api/conversation/{1}'.format(config.BASEURL, conversation.id)
-    content = append_conversation_link(message.content, conversation)
+    content = append_conversation_link(message.content, conversation.id)
     logger.info('Sending conversation message with content - {}'.format(content))
     if not to_address:
         error_message = 'Recipient has not confirmed their email address'
@@ -352,7 +381,8 @@ def send_conversation_message(message):
             content=content,
             new_content=content,
         )
-        error_message = mail.get_mailer().send(email)
+        idempotency_key = 'message-{}'.format(message.id)
+        error_message = mail.get_mailer().send(email, idempotency_key=idempotency_key)
     return error_message
 
 
@@ -388,6 +418,7 @@ def request_signup_email_confirmation(user, template=None, subject=None):
         new_content=content
     )
     error_message = mail.get_mailer().send(email)
+    store.session.commit()
     return error_message
 
 
@@ -419,10 +450,13 @@ def request_password_reset(user):
         new_content=content,
     )
     error_message = mail.get_mailer().send(email)
+    store.session.commit()
     return error_message
 
 
 def process_password_reset(secret_key, new_password):
+    # Importing here to prevent circular reference
+    from community_share.authorization import invalidate_login_cache
     user = None
     error_messages = User.is_password_valid(new_password)
     if not error_messages:
@@ -437,10 +471,11 @@ def process_password_reset(secret_key, new_password):
                 if user is not None:
                     error_messages += user.set_password(new_password)
                     if not error_messages:
-                        secret.used = True
+                        secret.mark_used()
                         store.session.add(user)
                         store.session.add(secret)
                         store.session.commit()
+                        invalidate_login_cache(user.id)
         else:
             error_messages.append('Authorization for this action is invalid or expired.')
     return (user, error_messages)
@@ -458,7 +493,7 @@ def process_confirm_email(secret_key):
             user = store.session.query(User).filter_by(id=userId).first()
             if user is not None:
                 user.email_confirmed = True
-                secret.used = True
+                secret.mark_used()
                 store.session.add(user)
                 store.session.add(secret)
                 store.session.commit()
@@ -0,0 +1,163 @@
+"""Delivery of the mail queued in the outbox
+
+Each worker process runs `MailSender.send_all_due` every
+`POLL_INTERVAL` seconds.  It claims the mail that is due from the
+outbox, groups mails that only differ in their recipient into
+batches, and hands each batch to the mail service in one call from a
+small thread pool, so that one slow call does not hold up the rest.
+Only the job's own thread touches the database; the pool threads just
+make HTTP calls.
+"""
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import requests
+
+from community_share import mail, store
+from community_share.models.lease import make_holder_id
+from community_share.models.outbox import OutboxMail
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = mail.MAILGUN_CONNECTIONS
+MAX_MAILS_PER_PASS = 1000
+POLL_INTERVAL = 5  # seconds
+
+
+def make_batches(outbox_mails: List[OutboxMail], max_recipients: int) -> List[List[OutboxMail]]:
+    """
+    Split mails into batches that can each be sent in one call
+
+    A batch holds mails with the same `batch_key`, each to a different
+    address, and no more than `max_recipients` of them.  Batches keep
+    the order of `outbox_mails`.
+    """
+    batches = []
+    # batch key -> (batch being filled, its addresses)
+    filling = {}
+    for outbox_mail in outbox_mails:
+        batch, addresses = filling.get(outbox_mail.batch_key, (None, None))
+        if (batch is None or len(batch) >= max_recipients or
+                outbox_mail.to_address in addresses):
+            batch, addresses = [], set()
+            batches.append(batch)
+            filling[outbox_mail.batch_key] = (batch, addresses)
+        batch.append(outbox_mail)
+        addresses.add(outbox_mail.to_address)
+    return batches
+
+
+class MailSender(object):
+    def __init__(
+            self,
+            deliver: Callable=mail.deliver_with_mailgun,
+            pool_size: int=POOL_SIZE,
+            max_mails: int=MAX_MAILS_PER_PASS,
+            holder: Optional[str]=None,
+    ) -> None:
+        """
+        :param deliver: called with a batch of `Email`s and their
+            idempotency keys; raises `mail.DeliveryError` or
+            `requests.RequestException` if the batch was not accepted
+        :param holder: identifies this sender when claiming mail
+        """
+        self.deliver = deliver
+        self.max_mails = max_mails
+        self.holder = holder if holder is not None else make_holder_id()
+        self._pool = ThreadPoolExecutor(max_workers=pool_size)
+
+    def send_due(self, now: Optional[datetime.datetime]=None) -> int:
+        """
+        Attempt every mail that is due and not claimed by another
+        sender, up to `max_mails` of them
+
+        :return: number of mails sent
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        outbox_mails = OutboxMail.claim_due(store.session, self.holder, now, self.max_mails)
+        if not outbox_mails:
+            return 0
+        batches = make_batches(outbox_mails, mail.MAX_BATCH_RECIPIENTS)
+        futures = [
+            self._pool.submit(
+                self.deliver_batch,
+                [outbox_mail.to_email() for outbox_mail in batch],
+                [outbox_mail.idempotency_key for outbox_mail in batch],
+            )
+            for batch in batches
+        ]
+        n_sent = 0
+        try:
+            for batch, future in zip(batches, futures):
+                try:
+                    errors = future.result()
+                except Exception as e:
+                    logger.exception('Delivering a batch of {} mails failed'.format(len(batch)))
+                    errors = [e] * len(batch)
+                for outbox_mail, error in zip(batch, errors):
+                    if error is None:
+                        outbox_mail.record_sent(now)
+                        n_sent += 1
+                    elif isinstance(error, mail.DeliveryError):
+                        outbox_mail.record_failure(str(error), now, permanent=error.permanent)
+                    else:
+                        outbox_mail.record_failure(str(error), now)
+        finally:
+            # Mails already delivered must be recorded as sent whatever
+            # happens to the rest, or they would be sent again.
+            store.session.commit()
+        logger.info(
+            'Sent {} of {} queued mails in {} calls'
+            .format(n_sent, len(outbox_mails), len(batches))
+        )
+        return n_sent
+
+    def deliver_batch(
+            self,
+            emails: List[mail.Email],
+            idempotency_keys: List[str],
+    ) -> List[Optional[Exception]]:
+        """
+        Deliver a batch, halving it while it is rejected outright, so
+        that one bad address only fails its own mail
+
+        Runs on a pool thread.
+
+        :return: for each mail, None if it was sent, else the error it
+            failed with
+        """
+        try:
+            self.deliver(emails, idempotency_keys)
+        except mail.DeliveryError as e:
+            if (not e.permanent or len(emails) == 1 or
+                    e.status_code in mail.ACCOUNT_ERROR_CODES):
+                return [e] * len(emails)
+            middle = len(emails) // 2
+            return (
+                self.deliver_batch(emails[:middle], idempotency_keys[:middle]) +
+                self.deliver_batch(emails[middle:], idempotency_keys[middle:])
+            )
+        except requests.RequestException as e:
+            logger.warning('Could not reach the mail service: {}'.format(e))
+            return [e] * len(emails)
+        return [None] * len(emails)
+
+    def send_all_due(self) -> int:
+        """
+        Send due mail until a pass takes less than it could
+
+        :return: number of mails sent
+        """
+        n_sent = 0
+        while True:
+            n_sent_in_pass = self.send_due()
+            n_sent += n_sent_in_pass
+            # A pass that took as many as it could may have left some.
+            if n_sent_in_pass < self.max_mails:
+                return n_sent
+
+    def stop(self) -> None:
+        self._pool.shutdown()
@@ -1,23 +1,42 @@
-from datetime import datetime
+"""Page views, and the rollups they are queried through
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+The rollups count views by path, by transition from one path to the
+next, and by user, for each day.  `roll_up_page_views` adds the views
+recorded since it last ran, so `page_views` itself is only ever read
+once.
+"""
+from collections import OrderedDict
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy import and_, func
+from sqlalchemy.sql.expression import bindparam, text
 
 from community_share import Base
+from community_share.models.base import day_of
 from community_share.models.user import User
 
+# Views are rolled up this many ids at a time, each batch committed
+# with the mark, so a large backlog is worked through in steps.
+ROLLUP_BATCH_SIZE = 50000
+ROLLUP_MARK = 'page_views'
+
+UPSERT_VIEWS_DIALECTS = {'postgresql', 'sqlite'}
+
 
 class PageView(Base):
     __tablename__ = 'page_views'
 
     id = Column('id', Integer, primary_key=True)
     user_id = Column('user_id', Integer, ForeignKey(User.id))
-    viewed_at = Column('viewed_at', DateTime, default=datetime.utcnow)
+    viewed_at = Column('viewed_at', DateTime, default=datetime.datetime.utcnow)
     next_path = Column('next_path', String(255))
     prev_path = Column('prev_path', String(255))
 
     def __init__(self, user_id, next_path, prev_path):
         self.user_id = user_id
-        self.viewed_at = datetime.utcnow()
+        self.viewed_at = datetime.datetime.utcnow()
         self.next_path = next_path
         self.prev_path = prev_path
 
@@ -28,3 +47,231 @@ class PageView(Base):
             self.next_path,
             self.prev_path,
         )
+
+
+class PageViewRollupMark(Base):
+    """
+    How far the rollups have got through `page_views`
+
+    Ids are handed out before views are committed, and several web
+    processes write views at once, so a view can turn up after one
+    with a higher id.  Each run therefore only rolls up to
+    `seen_id`, the highest id when the run before it started, by
+    when every view up to that has been committed.
+    """
+    __tablename__ = 'page_view_rollup_mark'
+
+    name = Column(String(50), primary_key=True)
+    rolled_up_id = Column(Integer, nullable=False)
+    seen_id = Column(Integer, nullable=False)
+
+
+class PathViews(Base):
+    """Views of each path on each day"""
+    __tablename__ = 'page_view_path_day'
+
+    date = Column(Date, primary_key=True)
+    path = Column(String(255), primary_key=True)
+    n_views = Column(Integer, nullable=False)
+
+    @classmethod
+    def top(
+            cls,
+            session,
+            first_date: datetime.date,
+            last_date: datetime.date,
+            number: int,
+    ) -> List[Tuple[str, int]]:
+        """The `number` most viewed paths from `first_date` to `last_date`"""
+        n_views = func.sum(cls.n_views)
+        query = session.query(cls.path, n_views)
+        query = query.filter(cls.date >= first_date, cls.date <= last_date)
+        query = query.group_by(cls.path).order_by(n_views.desc(), cls.path).limit(number)
+        return [(path, int(n)) for path, n in query]
+
+
+class TransitionViews(Base):
+    """Views of each path on each day, by the path viewed before it"""
+    __tablename__ = 'page_view_transition_day'
+    __table_args__ = (
+        Index('ix_page_view_transition_day_prev_path', 'prev_path', 'date'),
+    )
+
+    date = Column(Date, primary_key=True)
+    prev_path = Column(String(255), primary_key=True)
+    next_path = Column(String(255), primary_key=True)
+    n_views = Column(Integer, nullable=False)
+
+    @classmethod
+    def top(
+            cls,
+            session,
+            first_date: datetime.date,
+            last_date: datetime.date,
+            number: int,
+            prev_path: Optional[str]=None,
+            next_path: Optional[str]=None,
+    ) -> List[Tuple[str, str, int]]:
+        """
+        The `number` most taken transitions from `first_date` to
+        `last_date`, from `prev_path` or to `next_path` if given
+        """
+        n_views = func.sum(cls.n_views)
+        query = session.query(cls.prev_path, cls.next_path, n_views)
+        query = query.filter(cls.date >= first_date, cls.date <= last_date)
+        if prev_path is not None:
+            query = query.filter(cls.prev_path == prev_path)
+        if next_path is not None:
+            query = query.filter(cls.next_path == next_path)
+        query = query.group_by(cls.prev_path, cls.next_path)
+        query = query.order_by(n_views.desc(), cls.prev_path, cls.next_path).limit(number)
+        return [(prev, next_, int(n)) for prev, next_, n in query]
+
+    @classmethod
+    def funnel(
+            cls,
+            session,
+            paths: List[str],
+            first_date: datetime.date,
+            last_date: datetime.date,
+    ) -> List[int]:
+        """
+        Views of each of `paths` after the one before it, from
+        `first_date` to `last_date`, in one query
+
+        :return: a count for each step after the first
+        """
+        steps = list(zip(paths, paths[1:]))
+        query = session.query(cls.prev_path, cls.next_path, func.sum(cls.n_views))
+        query = query.filter(cls.date >= first_date, cls.date <= last_date)
+        query = query.filter(cls.prev_path.in_(paths[:-1]), cls.next_path.in_(paths[1:]))
+        counts = {
+            (prev, next_): int(n)
+            for prev, next_, n in query.group_by(cls.prev_path, cls.next_path)
+        }
+        return [counts.get(step, 0) for step in steps]
+
+
+class UserDayViews(Base):
+    """Views by each user on each day"""
+    __tablename__ = 'page_view_user_day'
+
+    date = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey(User.id), primary_key=True)
+    n_views = Column(Integer, nullable=False)
+
+    @classmethod
+    def daily(
+            cls,
+            session,
+            first_date: datetime.date,
+            last_date: datetime.date,
+            user_id: Optional[int]=None,
+    ) -> Dict[datetime.date, Dict[str, int]]:
+        """
+        Number of users viewing pages, and of views, on each day from
+        `first_date` to `last_date`, of just `user_id` if given
+        """
+        query = session.query(cls.date, func.count(cls.user_id), func.sum(cls.n_views))
+        query = query.filter(cls.date >= first_date, cls.date <= last_date)
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+        days = OrderedDict()
+        for day, n_users, n_views in query.group_by(cls.date).order_by(cls.date):
+            days[day] = {'n_users': n_users, 'n_views': int(n_views)}
+        return days
+
+
+# Table -> the columns a row is keyed by, and the page view columns
+# they are counted from.
+ROLLUPS = [
+    (PathViews, [('path', PageView.next_path)]),
+    (TransitionViews, [('prev_path', PageView.prev_path), ('next_path', PageView.next_path)]),
+    (UserDayViews, [('user_id', PageView.user_id)]),
+]
+
+
+def upsert_views(table) -> text:
+    keys = [column.name for column in table.primary_key]
+    return text('''
+        INSERT INTO {table} ({keys}, n_views) VALUES ({values}, :n_views)
+        ON CONFLICT ({keys}) DO UPDATE SET n_views = {table}.n_views + excluded.n_views
+    '''.format(
+        table=table.name,
+        keys=', '.join(keys),
+        values=', '.join(':' + key for key in keys),
+    )).bindparams(bindparam('date', type_=Date))
+
+
+def update_views(table) -> text:
+    keys = [column.name for column in table.primary_key]
+    return text('''
+        UPDATE {table} SET n_views = n_views + :n_views WHERE {where}
+    '''.format(
+        table=table.name,
+        where=' AND '.join('{0} = :{0}'.format(key) for key in keys),
+    )).bindparams(bindparam('date', type_=Date))
+
+
+def add_views(session, rollup, rows: List[Dict]) -> None:
+    """Add the counts in `rows` to `rollup` within the session's transaction"""
+    if not rows:
+        return
+    table = rollup.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in UPSERT_VIEWS_DIALECTS:
+        session.execute(upsert_views(table), rows)
+    else:
+        for row in rows:
+            result = session.execute(update_views(table), row)
+            if result.rowcount == 0:
+                session.execute(table.insert(), row)
+
+
+def add_to_rollups(session, after_id: int, last_id: int) -> int:
+    """
+    Count the views with ids after `after_id` up to `last_id`
+
+    :return: number of views counted
+    """
+    day = day_of(PageView.viewed_at)
+    in_batch = and_(PageView.id > after_id, PageView.id <= last_id)
+    n_views = 0
+    for rollup, keys in ROLLUPS:
+        columns = [column for _, column in keys]
+        query = session.query(day, *columns + [func.count(PageView.id)])
+        query = query.filter(in_batch)
+        query = query.filter(*[column != None for column in columns])
+        rows = [
+            dict(zip(['date'] + [name for name, _ in keys] + ['n_views'], row))
+            for row in query.group_by(day, *columns)
+        ]
+        add_views(session, rollup, rows)
+        if rollup is PathViews:
+            n_views = sum(row['n_views'] for row in rows)
+    return n_views
+
+
+def roll_up_page_views(session, batch_size: int=ROLLUP_BATCH_SIZE) -> int:
+    """
+    Add the views recorded since the last run to the rollups,
+    committing
+
+    Only one process must run this at a time.
+
+    :return: number of views rolled up
+    """
+    mark = session.query(PageViewRollupMark).get(ROLLUP_MARK)
+    if mark is None:
+        mark = PageViewRollupMark(name=ROLLUP_MARK, rolled_up_id=0, seen_id=0)
+        session.add(mark)
+    newest_id = session.query(func.max(PageView.id)).scalar() or 0
+    n_views = 0
+    while mark.rolled_up_id < mark.seen_id:
+        last_id = min(mark.seen_id, mark.rolled_up_id + batch_size)
+        n_views += add_to_rollups(session, mark.rolled_up_id, last_id)
+        mark.rolled_up_id = last_id
+        session.commit()
+    mark.seen_id = max(mark.seen_id, newest_id)
+    session.commit()
+    return n_views
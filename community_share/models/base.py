@@ -1,20 +1,47 @@
 import logging
 import datetime
 import dateutil
+from collections import OrderedDict, namedtuple
 from dateutil import parser
-from typing import Any, Dict, List, Optional
+from operator import attrgetter
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from sqlalchemy import Column, String, DateTime, Boolean
+from sqlalchemy import Column, String, Date, DateTime, Boolean, func, inspect
+from sqlalchemy.orm import class_mapper, object_session, subqueryload_all
 
 from community_share import Base, store
 
 logger = logging.getLogger(__name__)
 
+# Guards against misconfigured SERIALIZED_RELATIONSHIPS looping forever.
+MAX_EAGER_LOAD_DEPTH = 4
+
 
 class ValidationException(Exception):
     pass
 
 
+FieldPlan = namedtuple('FieldPlan', ['fieldnames', 'getter', 'custom_serializers'])
+
+
+def make_getter(fieldnames: Tuple[str, ...]) -> Callable[[Any], Tuple[Any, ...]]:
+    """
+    Single callable fetching all the named attributes as a tuple
+    """
+    if len(fieldnames) == 0:
+        return lambda item: ()
+    elif len(fieldnames) == 1:
+        getter = attrgetter(fieldnames[0])
+        return lambda item: (getter(item), )
+    else:
+        return attrgetter(*fieldnames)
+
+
+def day_of(column):
+    """The date part of the datetime `column`, in SQL"""
+    return func.date(column, type_=Date)
+
+
 class Serializable(object):
     """
     Doesn't implement a necessary 'get' method.
@@ -56,6 +83,85 @@ class Serializable(object):
 
     custom_serializers = {}
 
+    # Readable fields whose serializers walk the relationship of the
+    # same name, mapped to the fields they exclude when serializing the
+    # related items in turn.  Used to load many items in bulk.
+    SERIALIZED_RELATIONSHIPS = {}
+
+    _eager_load_paths = {}
+
+    @classmethod
+    def eager_load_paths(cls, exclude: List[str] = [], depth: int = 0) -> List[str]:
+        """
+        Dotted relationship paths walked when serializing this class
+
+        :param exclude: optional list of fields by name to exclude
+        :return: paths suitable for `subqueryload_all`
+        """
+        key = (cls, frozenset(exclude), depth)
+        if key in Serializable._eager_load_paths:
+            return Serializable._eager_load_paths[key]
+
+        fieldnames = set(cls.STANDARD_READABLE_FIELDS) | set(cls.ADMIN_READABLE_FIELDS)
+        fieldnames = (fieldnames - set(exclude)) & set(cls.SERIALIZED_RELATIONSHIPS)
+        paths = []
+        for fieldname in sorted(fieldnames):
+            paths.append(fieldname)
+            related_cls = class_mapper(cls).get_property(fieldname).mapper.class_
+            if depth < MAX_EAGER_LOAD_DEPTH and issubclass(related_cls, Serializable):
+                nested_exclude = cls.SERIALIZED_RELATIONSHIPS[fieldname]
+                paths += [
+                    '{0}.{1}'.format(fieldname, path)
+                    for path in related_cls.eager_load_paths(nested_exclude, depth + 1)
+                ]
+
+        Serializable._eager_load_paths[key] = paths
+        return paths
+
+    @classmethod
+    def eager_load_options(cls, exclude: List[str] = []) -> List[Any]:
+        return [subqueryload_all(path) for path in cls.eager_load_paths(exclude)]
+
+    @classmethod
+    def eager_load(cls, items, exclude: List[str] = []) -> List[Any]:
+        """
+        Loads the relationships needed for serialization of many items
+
+        Issues one query per relationship for the whole batch rather
+        than lazy loading them item by item.
+
+        :param items: iterable of items of this class
+        :param exclude: optional list of fields by name to exclude
+        :return: the items as a list, in their original order
+        """
+        items = list(items)
+        top_level = set(path for path in cls.eager_load_paths(exclude) if '.' not in path)
+        ids = [item.id for item in items if top_level & inspect(item).unloaded]
+        if ids:
+            session = object_session(items[0]) or store.session
+            query = session.query(cls).filter(cls.id.in_(ids))
+            query.options(*cls.eager_load_options(exclude)).all()
+        return items
+
+    @classmethod
+    def serialize_many(
+            cls,
+            items,
+            requester,
+            exclude: List[str] = [],
+    ) -> List[Dict[str, Any]]:
+        """
+        Serializes many items at once, skipping those not readable
+
+        :param items: iterable of items of this class
+        :param requester: user requesting data
+        :param exclude: optional list of fields by name to exclude
+        :return: readable fields for each item the user may read
+        """
+        items = cls.eager_load(items, exclude)
+        serialized = [item.serialize(requester, exclude) for item in items]
+        return [s for s in serialized if s is not None]
+
     def serialize(self, requester, exclude: List[str] = []) -> Optional[Dict[str, Any]]:
         """
         Serializes readable fields by user role
@@ -65,19 +171,54 @@ class Serializable(object):
         :return: readable fields for user or None if no permission
         """
         if self.has_admin_rights(requester):
-            fieldnames = self.ADMIN_READABLE_FIELDS
+            role = 'admin'
         elif self.has_standard_rights(requester):
-            fieldnames = self.STANDARD_READABLE_FIELDS
+            role = 'standard'
         else:
             return None
 
-        return {
-            key: (
-                self.custom_serializers[key](self, requester)
-                if key in self.custom_serializers else getattr(self, key)
+        plan = self.field_plan(role, tuple(exclude))
+        serialized = dict(zip(plan.fieldnames, plan.getter(self)))
+        for fieldname, serializer in plan.custom_serializers:
+            serialized[fieldname] = serializer(self, requester)
+        return serialized
+
+    _field_plans = {}
+
+    @classmethod
+    def field_plan(cls, role: str, exclude: Tuple[str, ...] = ()) -> 'FieldPlan':
+        """
+        Fields serialized for a role, with prebound accessors
+
+        Plans are compiled the first time a class is serialized for a
+        given role and exclude list and reused from then on.
+
+        :param role: 'admin' or 'standard'
+        :param exclude: optional fields by name to exclude
+        :return: plan for `serialize` to execute
+        """
+        key = (cls, role, exclude)
+        plan = Serializable._field_plans.get(key, None)
+        if plan is None:
+            if role == 'admin':
+                fieldnames = cls.ADMIN_READABLE_FIELDS
+            else:
+                fieldnames = cls.STANDARD_READABLE_FIELDS
+            fieldnames = [f for f in fieldnames if f not in exclude]
+            if hasattr(cls, 'id'):
+                fieldnames.append('id')
+            fieldnames = list(OrderedDict.fromkeys(fieldnames))
+            plain_fieldnames = tuple(f for f in fieldnames if f not in cls.custom_serializers)
+            plan = FieldPlan(
+                fieldnames=plain_fieldnames,
+                getter=make_getter(plain_fieldnames),
+                custom_serializers=tuple(
+                    (f, cls.custom_serializers[f])
+                    for f in fieldnames if f in cls.custom_serializers
+                ),
             )
-            for key in (set(fieldnames) - set(exclude)) | ({'id'} if hasattr(self, 'id') else set())
-        }
+            Serializable._field_plans[key] = plan
+        return plan
 
     def delete(self, requester):
         previously_deleted = not self.active
@@ -1,12 +1,15 @@
 import logging
+from collections import namedtuple
 from datetime import datetime
 import re
+from typing import Optional, Tuple
 
 from sqlalchemy import Column, Integer, Boolean, DateTime, Table, ForeignKey
-from sqlalchemy import String, or_, and_
-from sqlalchemy.orm import relationship, validates
+from sqlalchemy import String, or_, and_, event
+from sqlalchemy.orm import Session, relationship, validates
 
 from community_share import store, Base, mail_actions, config
+from community_share.cache import TTLCache
 from community_share.models.base import Serializable
 from community_share.models.user import User
 from community_share.models.base import ValidationException
@@ -20,6 +23,48 @@ conversation_user_table = Table(
 
 logger = logging.getLogger(__name__)
 
+REPLY_TOKEN_CACHE_SIZE = 4096
+
+# A user taking part in a conversation, as needed to forward mail to them.
+Participant = namedtuple('Participant', ['id', 'name', 'email'])
+# Where a reply to a message goes.  Users can change their name or email
+# address in any process, so only their ids are kept.
+ReplyTarget = namedtuple(
+    'ReplyTarget',
+    ['message_id', 'conversation_id', 'sender_id', 'receiver_id'],
+)
+
+# Maps the tokens in reply-to addresses to ReplyTargets.  A message never
+# changes conversation or sender, so entries do not go stale.
+reply_targets = TTLCache(max_size=REPLY_TOKEN_CACHE_SIZE)
+# Key in `Session.info` of the reply targets made in a transaction,
+# cached once it commits so a rolled back message is never cached.
+PENDING_REPLY_TARGETS = 'pending_reply_targets'
+
+
+def cache_reply_target_on_commit(token: str, target: ReplyTarget) -> None:
+    store.session.info.setdefault(PENDING_REPLY_TARGETS, {})[token] = target
+
+
+@event.listens_for(Session, 'after_commit')
+def _cache_reply_targets(session):
+    for token, target in session.info.pop(PENDING_REPLY_TARGETS, {}).items():
+        reply_targets.set(token, target)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_reply_targets(session):
+    session.info.pop(PENDING_REPLY_TARGETS, None)
+
+
+def load_participants(target: ReplyTarget) -> Tuple[Participant, Participant]:
+    """The sender and receiver of `target` as they are now"""
+    query = store.session.query(User.id, User.name, User.email).filter(
+        User.id.in_([target.sender_id, target.receiver_id]),
+    )
+    participants = {user_id: Participant(user_id, name, email) for user_id, name, email in query}
+    return participants[target.sender_id], participants[target.receiver_id]
+
 
 class Conversation(Base, Serializable):
     __tablename__ = 'conversation'
@@ -121,6 +166,12 @@ class Conversation(Base, Serializable):
         'messages': serialize_messages,
     }
 
+    SERIALIZED_RELATIONSHIPS = {
+        'userA': [],
+        'userB': [],
+        'messages': [],
+    }
+
     @classmethod
     def args_to_query(cls, args, requester):
         user_id = args.get('user_id', None)
@@ -258,18 +309,63 @@ class Message(Base, Serializable):
         conversation = store.session.query(Conversation).filter_by(id=self.conversation_id).first()
         return conversation
 
-    def generate_from_address(self):
-        text = 'message-{}'.format(self.id)
-        encodedtext = config.crypt_helper.encrypt(text)
+    @staticmethod
+    def make_from_address(message_id: int, sender_name: str) -> Tuple[str, str]:
+        """
+        Reply-to address for mail about a message
+
+        :return: the token identifying the message, and the address
+        """
+        token = config.crypt_helper.encrypt('message-{}'.format(message_id))
         from_address = '{} (via CommunityShare)<{}@{}>'.format(
-            self.sender_user.name,
-            encodedtext,
+            sender_name,
+            token,
             config.MAILGUN_DOMAIN,
         )
+        return token, from_address
+
+    def reply_target(self) -> ReplyTarget:
+        conversation = self.conversation
+        if self.sender_user_id == conversation.userA_id:
+            receiver_id = conversation.userB_id
+        else:
+            receiver_id = conversation.userA_id
+        return ReplyTarget(
+            message_id=self.id,
+            conversation_id=self.conversation_id,
+            sender_id=self.sender_user_id,
+            receiver_id=receiver_id,
+        )
+
+    def generate_from_address(self):
+        token, from_address = self.make_from_address(self.id, self.sender_user.name)
+        cache_reply_target_on_commit(token, self.reply_target())
         return from_address
 
     @classmethod
-    def process_from_address(cls, from_address):
+    def generate_reply_from_address(
+            cls,
+            target: ReplyTarget,
+            message_id: int,
+            sender_name: str,
+    ) -> str:
+        """
+        `generate_from_address` for the message `message_id`, sent by
+        `sender_name`, answering the message of `target`, without
+        loading either message
+        """
+        reply = ReplyTarget(
+            message_id=message_id,
+            conversation_id=target.conversation_id,
+            sender_id=target.receiver_id,
+            receiver_id=target.sender_id,
+        )
+        token, from_address = cls.make_from_address(message_id, sender_name)
+        cache_reply_target_on_commit(token, reply)
+        return from_address
+
+    @classmethod
+    def reply_token(cls, from_address):
         pattern1 = '.*<(.*)@.*>'
         pattern2 = '(.*)@.*'
         matches1 = re.match(pattern1, from_address)
@@ -280,6 +376,12 @@ class Message(Base, Serializable):
             encrypted = matches2.groups()[0]
         else:
             encrypted = ''
+        # Tokens are made upper case, but may not come back that way.
+        return encrypted.upper()
+
+    @classmethod
+    def process_from_address(cls, from_address):
+        encrypted = cls.reply_token(from_address)
         text = ''
         if encrypted:
             try:
@@ -295,3 +397,24 @@ class Message(Base, Serializable):
             except ValueError:
                 pass
         return message_id
+
+    @classmethod
+    def find_reply_target(cls, from_address) -> Optional[ReplyTarget]:
+        """
+        Where a reply sent to `from_address` should go
+
+        Addresses made by `generate_from_address` in this process are
+        found without touching the database once they are committed.
+        """
+        token = cls.reply_token(from_address)
+        target = reply_targets.get(token) if token else None
+        if target is None:
+            message_id = cls.process_from_address(from_address)
+            if message_id is None:
+                return None
+            message = store.session.query(Message).filter_by(id=message_id).first()
+            if message is None:
+                return None
+            target = message.reply_target()
+            reply_targets.set(token, target)
+        return target
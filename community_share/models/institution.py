@@ -50,6 +50,8 @@ class InstitutionAssociation(Base, Serializable):
 
     custom_serializers = {'institution': serialize_institution}
 
+    SERIALIZED_RELATIONSHIPS = {'institution': []}
+
 
 INSTITUTION_NAME_LENGTH = 50
 
@@ -0,0 +1,101 @@
+"""Named leases that let several worker processes share jobs
+
+A lease is held by one worker at a time until it is released or
+expires, so a worker that dies cannot block a job for longer than the
+lease duration.  Leases are rows of the `lease` table and are taken
+with a conditional UPDATE, which works the same way on Postgres and
+SQLite.
+"""
+import datetime
+import os
+import socket
+import uuid
+
+from sqlalchemy import Column, DateTime, String
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import bindparam, or_, text
+
+from community_share import Base
+
+INSERT_LEASE = '''
+    INSERT INTO lease (name, holder, expires_at) VALUES (:name, NULL, :expires_at)
+    {on_conflict}
+'''
+
+IGNORE_CONFLICT_DIALECTS = {'postgresql', 'sqlite'}
+
+
+def make_holder_id() -> str:
+    """Identifies this process among the workers"""
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class Lease(Base):
+    __tablename__ = 'lease'
+
+    name = Column(String(50), primary_key=True)
+    holder = Column(String(100))
+    expires_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    def acquire(
+            cls,
+            session,
+            name: str,
+            holder: str,
+            duration: datetime.timedelta,
+            now: datetime.datetime=None,
+    ) -> bool:
+        """
+        Take or renew the lease `name` for `duration`, committing
+
+        :return: whether `holder` now holds the lease
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        cls._ensure_exists(session, name, now)
+        table = cls.__table__
+        result = session.execute(
+            table.update()
+            .where(table.c.name == name)
+            .where(or_(table.c.holder == holder, table.c.holder == None,
+                       table.c.expires_at < now))
+            .values(holder=holder, expires_at=now + duration)
+        )
+        session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    def release(cls, session, name: str, holder: str) -> None:
+        """Give up the lease `name` if `holder` holds it, committing"""
+        table = cls.__table__
+        session.execute(
+            table.update()
+            .where(table.c.name == name)
+            .where(table.c.holder == holder)
+            .values(holder=None, expires_at=datetime.datetime.utcnow())
+        )
+        session.commit()
+
+    @classmethod
+    def _ensure_exists(cls, session, name, now):
+        row = {'name': name, 'expires_at': now}
+        bindparams = [bindparam('expires_at', type_=DateTime)]
+        dialect = session.get_bind().dialect.name
+        if dialect in IGNORE_CONFLICT_DIALECTS:
+            statement = INSERT_LEASE.format(on_conflict='ON CONFLICT (name) DO NOTHING')
+            session.execute(text(statement).bindparams(*bindparams), row)
+            return
+        savepoint = session.begin_nested()
+        try:
+            session.execute(text(INSERT_LEASE.format(on_conflict='')).bindparams(*bindparams), row)
+            savepoint.commit()
+        except IntegrityError:
+            savepoint.rollback()
+
+    def __repr__(self):
+        return '<Lease(name={},holder={},expires_at={})>'.format(
+            self.name,
+            self.holder,
+            self.expires_at,
+        )
@@ -0,0 +1,219 @@
+"""Outgoing mail waiting to be handed to the mail service
+
+Request handlers only add rows here; `community_share.mail_sender`
+delivers them from the worker processes, retrying failures with an
+exponential backoff.  A worker claims the mail it is about to send for
+`CLAIM_DURATION`, so that several workers can send without sending
+the same mail twice.
+"""
+import datetime
+import json
+import logging
+import uuid
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import bindparam, or_, text
+
+from community_share import Base
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+# The first retry waits FIRST_RETRY_DELAY, each one after that twice as
+# long as the last, up to MAX_RETRY_DELAY.  A mail that has failed
+# MAX_ATTEMPTS times is given up on.
+FIRST_RETRY_DELAY = datetime.timedelta(seconds=30)
+MAX_RETRY_DELAY = datetime.timedelta(hours=1)
+MAX_ATTEMPTS = 10
+
+# Long enough to send a pass of mail; if the worker dies, its claimed
+# mail is sent by another one after this.
+CLAIM_DURATION = datetime.timedelta(minutes=5)
+
+INSERT_MAIL = '''
+    INSERT INTO outbox_mail (
+        idempotency_key, from_address, to_address, subject, content,
+        recipient_variables, status, attempts, created_at, next_attempt_at
+    ) VALUES (
+        :idempotency_key, :from_address, :to_address, :subject, :content,
+        :recipient_variables, :status, 0, :created_at, :created_at
+    )
+    {on_conflict}
+'''
+
+IGNORE_CONFLICT_DIALECTS = {'postgresql', 'sqlite'}
+
+
+def retry_delay(attempts: int) -> datetime.timedelta:
+    """How long to wait after the `attempts`th failed attempt"""
+    return min(FIRST_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+class OutboxMail(Base):
+    __tablename__ = 'outbox_mail'
+
+    KEY_LENGTH = 100
+
+    id = Column(Integer, primary_key=True)
+    # Enqueuing a second mail with the same key is a no-op, so a
+    # retried request cannot send the same mail twice.
+    idempotency_key = Column(String(KEY_LENGTH), nullable=False, unique=True)
+    from_address = Column(String(200), nullable=False)
+    to_address = Column(String(200), nullable=False)
+    subject = Column(String(200))
+    content = Column(Text)
+    # JSON object of the values for placeholders in the subject and
+    # content, see `community_share.mail.recipient_variable`.
+    recipient_variables = Column(Text)
+    status = Column(String(10), nullable=False, default=STATUS_PENDING, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    sent_at = Column(DateTime)
+    last_error = Column(String(200))
+    claimed_by = Column(String(100))
+    claimed_until = Column(DateTime)
+
+    @classmethod
+    def enqueue(cls, session, email, idempotency_key: Optional[str]=None) -> bool:
+        """
+        Add `email` to the outbox within the session's transaction
+
+        :param idempotency_key: identifies the mail, e.g. 'message-12';
+            a random key is used if none is given
+        :return: False if a mail with the same key was already queued
+        """
+        return cls.enqueue_many(session, [(email, idempotency_key)]) == 1
+
+    @classmethod
+    def enqueue_many(cls, session, mails: List[Tuple[Any, Optional[str]]]) -> int:
+        """
+        Add several mails to the outbox in one statement
+
+        :param mails: (email, idempotency key) pairs, as for `enqueue`
+        :return: number of mails that were not already queued
+        """
+        now = datetime.datetime.utcnow()
+        rows = [cls._make_row(email, idempotency_key, now) for email, idempotency_key in mails]
+        if not rows:
+            return 0
+        bindparams = [bindparam('created_at', type_=DateTime)]
+        dialect = session.get_bind().dialect.name
+        if dialect in IGNORE_CONFLICT_DIALECTS:
+            statement = INSERT_MAIL.format(on_conflict='ON CONFLICT (idempotency_key) DO NOTHING')
+            result = session.execute(text(statement).bindparams(*bindparams), rows)
+            return result.rowcount
+        statement = text(INSERT_MAIL.format(on_conflict='')).bindparams(*bindparams)
+        n_queued = 0
+        for row in rows:
+            savepoint = session.begin_nested()
+            try:
+                session.execute(statement, row)
+                savepoint.commit()
+                n_queued += 1
+            except IntegrityError:
+                savepoint.rollback()
+        return n_queued
+
+    @classmethod
+    def _make_row(cls, email, idempotency_key, now):
+        if idempotency_key is None:
+            idempotency_key = uuid.uuid4().hex
+        return {
+            'idempotency_key': idempotency_key[:cls.KEY_LENGTH],
+            'from_address': email.from_address,
+            'to_address': email.to_address,
+            'subject': email.subject,
+            'content': email.content,
+            'recipient_variables': (
+                json.dumps(email.recipient_variables) if email.recipient_variables else None),
+            'status': STATUS_PENDING,
+            'created_at': now,
+        }
+
+    @classmethod
+    def claim_due(
+            cls,
+            session,
+            holder: str,
+            now: datetime.datetime,
+            limit: int,
+            duration: datetime.timedelta=CLAIM_DURATION,
+    ) -> List['OutboxMail']:
+        """
+        Claim pending mail whose next attempt is due, oldest first
+
+        Mail claimed by another holder is skipped until its claim runs
+        out.  The claim is committed before returning.
+
+        :return: the mail now claimed by `holder`
+        """
+        unclaimed = or_(cls.claimed_until == None, cls.claimed_until < now)
+        query = session.query(cls.id)
+        query = query.filter(cls.status == STATUS_PENDING, cls.next_attempt_at <= now, unclaimed)
+        query = query.order_by(cls.next_attempt_at, cls.id)
+        ids = [mail_id for (mail_id, ) in query.limit(limit)]
+        if not ids:
+            return []
+        # Only one of several workers racing for a row can update it
+        # while it is still unclaimed.
+        query = session.query(cls).filter(cls.id.in_(ids), unclaimed)
+        query.update(
+            {cls.claimed_by: holder, cls.claimed_until: now + duration},
+            synchronize_session=False,
+        )
+        session.commit()
+        query = session.query(cls).filter(cls.id.in_(ids), cls.claimed_by == holder)
+        return query.order_by(cls.next_attempt_at, cls.id).all()
+
+    def to_email(self):
+        # Importing here to prevent circular reference
+        from community_share.mail import Email
+        return Email(
+            from_address=self.from_address,
+            to_address=self.to_address,
+            subject=self.subject,
+            content=self.content,
+            new_content=self.content,
+            recipient_variables=(
+                json.loads(self.recipient_variables) if self.recipient_variables else None),
+        )
+
+    @property
+    def batch_key(self):
+        """Mails with the same key can be sent in one call"""
+        return (self.from_address, self.subject, self.content)
+
+    def record_sent(self, now: datetime.datetime) -> None:
+        self.attempts += 1
+        self.status = STATUS_SENT
+        self.sent_at = now
+        self.last_error = None
+        self.claimed_until = None
+
+    def record_failure(self, error: str, now: datetime.datetime, permanent: bool=False) -> None:
+        """Schedule the next attempt, or give up if there should be none"""
+        self.attempts += 1
+        self.last_error = error[:200]
+        self.claimed_until = None
+        if permanent or self.attempts >= MAX_ATTEMPTS:
+            self.status = STATUS_FAILED
+            logger.error(
+                'Giving up on mail {} to {} after {} attempts: {}'
+                .format(self.id, self.to_address, self.attempts, error)
+            )
+        else:
+            self.next_attempt_at = now + retry_delay(self.attempts)
+
+    def __repr__(self):
+        return '<OutboxMail(id={},to={},status={},attempts={})>'.format(
+            self.id,
+            self.to_address,
+            self.status,
+            self.attempts,
+        )
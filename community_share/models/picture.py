@@ -0,0 +1,241 @@
+"""Manifest of the pictures uploaded to S3
+
+Pictures are named after the hash of their content, so a picture that
+is already in the manifest does not have to be uploaded again.  Once
+no user refers to a picture any more it is removed from the manifest
+and its objects can be deleted from S3.
+
+Until a picture is uploaded the manifest keeps where it is staged on
+the host that took it, so that an upload which fails, or is lost with
+the process making it, is made by a worker on that host instead.
+"""
+import datetime
+from typing import FrozenSet, List, Tuple
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import and_, bindparam, exists, text
+
+from community_share import Base
+
+# An upload that has not finished in this long is taken to have failed
+# or been lost with its process, and is made again by the worker.  Longer
+# than the uploader takes to give up on a picture and its thumbnails.
+STALE_UPLOAD = datetime.timedelta(minutes=15)
+
+INSERT_PICTURE = '''
+    INSERT INTO picture_object (sha1, filename, size, claimed_at, staged_path)
+    VALUES (:sha1, :filename, :size, :claimed_at, :staged_path)
+    {on_conflict}
+'''
+
+IGNORE_CONFLICT_DIALECTS = {'postgresql', 'sqlite'}
+
+
+class PictureObject(Base):
+    __tablename__ = 'picture_object'
+
+    sha1 = Column(String(40), primary_key=True)
+    # Name of the original in the bucket; its thumbnails are named after it.
+    filename = Column(String(100), nullable=False)
+    size = Column(Integer, nullable=False)
+    # When its upload started, or it was last found to be uploaded already.
+    claimed_at = Column(DateTime, nullable=False)
+    # None until the original and its thumbnails are all in the bucket.
+    uploaded_at = Column(DateTime)
+    # Local file the picture is staged in, until it is uploaded.
+    staged_path = Column(String(255))
+    # Whether its thumbnails are uploaded too.  Only pictures that have
+    # them are shown with them.
+    has_thumbnails = Column(Boolean)
+
+    @classmethod
+    def claim(
+            cls,
+            session,
+            sha1: str,
+            filename: str,
+            size: int,
+            staged_path: str,
+            now: datetime.datetime=None,
+    ) -> bool:
+        """
+        Record that the picture `filename`, staged in `staged_path`, is
+        wanted, committing
+
+        :return: whether the caller has to upload it, because it is
+            neither uploaded nor being uploaded
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        table = cls.__table__
+        row = {'sha1': sha1, 'filename': filename, 'size': size, 'claimed_at': now,
+               'staged_path': staged_path}
+        if cls._insert(session, row):
+            session.commit()
+            return True
+        if cls.claim_stale(session, sha1, now, staged_path=staged_path):
+            session.commit()
+            return True
+        # Keep it from being collected while the claimer starts using it.
+        # An upload in progress keeps the time it started, so that it
+        # goes stale even if the picture is claimed again meanwhile.
+        session.execute(
+            table.update()
+            .where(table.c.sha1 == sha1)
+            .where(table.c.uploaded_at != None)
+            .values(claimed_at=now)
+        )
+        session.commit()
+        return False
+
+    @classmethod
+    def stale_uploads(cls, session, now: datetime.datetime=None) -> List[Tuple[str, str, str]]:
+        """
+        Pictures whose upload has failed or been lost
+
+        :return: the sha1, filename and staged path of each
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        return (
+            session.query(cls.sha1, cls.filename, cls.staged_path)
+            .filter(cls.uploaded_at == None)
+            .filter(cls.claimed_at < now - STALE_UPLOAD)
+            .filter(cls.staged_path != None)
+            .order_by(cls.claimed_at)
+            .all()
+        )
+
+    @classmethod
+    def claim_stale(cls, session, sha1: str, now: datetime.datetime=None, **values) -> bool:
+        """
+        Claim a picture whose upload has gone stale, to upload it again
+
+        The caller must commit.
+
+        :param values: other columns to set if it is claimed
+        :return: whether it was claimed, rather than by someone else
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        table = cls.__table__
+        result = session.execute(
+            table.update()
+            .where(table.c.sha1 == sha1)
+            .where(table.c.uploaded_at == None)
+            .where(table.c.claimed_at < now - STALE_UPLOAD)
+            .values(claimed_at=now, **values)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def _insert(cls, session, row):
+        bindparams = [bindparam('claimed_at', type_=DateTime)]
+        dialect = session.get_bind().dialect.name
+        if dialect in IGNORE_CONFLICT_DIALECTS:
+            statement = INSERT_PICTURE.format(on_conflict='ON CONFLICT (sha1) DO NOTHING')
+            result = session.execute(text(statement).bindparams(*bindparams), row)
+            return result.rowcount == 1
+        savepoint = session.begin_nested()
+        try:
+            statement = INSERT_PICTURE.format(on_conflict='')
+            session.execute(text(statement).bindparams(*bindparams), row)
+            savepoint.commit()
+            return True
+        except IntegrityError:
+            savepoint.rollback()
+            return False
+
+    @classmethod
+    def record_uploaded(
+            cls,
+            session,
+            sha1: str,
+            has_thumbnails: bool=True,
+            now: datetime.datetime=None,
+    ) -> None:
+        if now is None:
+            now = datetime.datetime.utcnow()
+        table = cls.__table__
+        session.execute(
+            table.update()
+            .where(table.c.sha1 == sha1)
+            .values(uploaded_at=now, has_thumbnails=has_thumbnails, staged_path=None)
+        )
+        session.commit()
+
+    @classmethod
+    def with_thumbnails(cls, session) -> FrozenSet[str]:
+        """Filenames of the uploaded pictures that have thumbnails"""
+        query = (
+            session.query(cls.filename)
+            .filter(cls.uploaded_at != None)
+            .filter(cls.has_thumbnails == True)
+        )
+        return frozenset(filename for (filename, ) in query)
+
+    @classmethod
+    def record_existing(
+            cls,
+            session,
+            sha1: str,
+            filename: str,
+            size: int,
+            has_thumbnails: bool,
+            now: datetime.datetime=None,
+    ) -> bool:
+        """
+        Add a picture uploaded before there was a manifest, committing
+
+        :return: whether it was added, rather than the same content
+            being there under another name
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        cls._insert(session, {'sha1': sha1, 'filename': filename, 'size': size,
+                              'claimed_at': now, 'staged_path': None})
+        table = cls.__table__
+        result = session.execute(
+            table.update()
+            .where(table.c.sha1 == sha1)
+            .where(table.c.filename == filename)
+            .values(uploaded_at=now, has_thumbnails=has_thumbnails)
+        )
+        session.commit()
+        return result.rowcount == 1
+
+    @classmethod
+    def remove_unreferenced(cls, session, claimed_before: datetime.datetime) -> List[str]:
+        """
+        Take the pictures no user refers to out of the manifest,
+        committing
+
+        Only pictures last claimed before `claimed_before` are taken,
+        so that a picture being uploaded for a user is not.
+
+        :return: the filenames of the pictures taken out
+        """
+        # Importing here to prevent circular reference
+        from community_share.models.user import User
+        table = cls.__table__
+        unreferenced = and_(
+            ~exists().where(User.picture_filename == table.c.filename),
+            table.c.claimed_at < claimed_before,
+        )
+        candidates = dict(session.query(cls.sha1, cls.filename).filter(unreferenced))
+        if not candidates:
+            return []
+        session.execute(table.delete().where(and_(table.c.sha1.in_(list(candidates)), unreferenced)))
+        # Any still there were claimed again since they were selected.
+        kept = session.query(cls.sha1).filter(cls.sha1.in_(list(candidates))).all()
+        session.commit()
+        for (sha1, ) in kept:
+            del candidates[sha1]
+        return sorted(candidates.values())
+
+    def __repr__(self):
+        return '<PictureObject(filename={},uploaded_at={})>'.format(
+            self.filename,
+            self.uploaded_at,
+        )
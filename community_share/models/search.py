@@ -1,15 +1,96 @@
+import hashlib
 import logging
+import threading
+from collections import OrderedDict, namedtuple
 from datetime import datetime
+from typing import Dict, Iterable
 
 from sqlalchemy import Table, ForeignKey, DateTime, Column
-from sqlalchemy import Integer, String, Boolean, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Index, Integer, String, Boolean, Float, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, relationship
+from sqlalchemy.sql.expression import func, text
 
 from community_share import Base, store
+from community_share.cache import TTLCache
 from community_share.models.base import Serializable
 
 logger = logging.getLogger(__name__)
 
+# Labels created by other processes show up after at most this long.
+LABEL_CATALOGUE_TTL = 300  # seconds
+
+LabelCatalogue = namedtuple('LabelCatalogue', ['names', 'etag'])
+
+label_catalogue = TTLCache(max_size=1, ttl=LABEL_CATALOGUE_TTL)
+# Key in `Session.info` marking a transaction that created labels, so
+# that the catalogue is rebuilt once they are committed.  Clearing it
+# any earlier lets another request cache it again without them.
+LABELS_CREATED = 'labels_created'
+
+# Creates a label unless one with the same name, ignoring case, exists.
+INSERT_LABEL = '''
+    INSERT {or_ignore} INTO label (name, active)
+    SELECT :name, :active
+    WHERE NOT EXISTS (SELECT 1 FROM label WHERE lower(name) = :normalized_name)
+    {on_conflict}
+'''
+
+INSERT_LABEL_IGNORING_CONFLICTS = {
+    'postgresql': INSERT_LABEL.format(or_ignore='', on_conflict='ON CONFLICT (name) DO NOTHING'),
+    'sqlite': INSERT_LABEL.format(or_ignore='OR IGNORE', on_conflict=''),
+}
+
+
+def normalize_label_name(name: str) -> str:
+    return name.lower()
+
+
+class LabelRegistry(object):
+    """Ids of labels by normalized name
+
+    Loaded in full on first use and extended as labels are created.
+    Labels are never deleted, so an entry can only be wrong if the
+    transaction that created its label was rolled back.  Its id may
+    then be missing or, as SQLite reuses ids, belong to another label.
+    `Label.name_list_to_object_list` notices either when it loads the
+    labels and forgets the entry.
+    """
+
+    def __init__(self) -> None:
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids = None
+
+    def lookup(self, session, normalized_names: Iterable[str]) -> Dict[str, int]:
+        with self._lock:
+            ids = self._ids
+        if ids is None:
+            ids = {}
+            for label_id, name in session.query(Label.id, Label.name).order_by(Label.id):
+                ids.setdefault(normalize_label_name(name), label_id)
+            with self._lock:
+                self._ids = ids
+        return {name: ids[name] for name in normalized_names if name in ids}
+
+    def learn(self, ids: Dict[str, int]) -> None:
+        with self._lock:
+            if self._ids is not None:
+                for name, label_id in ids.items():
+                    self._ids.setdefault(name, label_id)
+
+    def forget(self, normalized_names: Iterable[str]) -> None:
+        with self._lock:
+            if self._ids is not None:
+                for name in normalized_names:
+                    self._ids.pop(name, None)
+
+
+label_registry = LabelRegistry()
+
 search_label_table = Table(
     'search_label',
     Base.metadata,
@@ -125,6 +206,11 @@ class Search(Base, Serializable):
         'searcher_user': serialize_searcher_user,
     }
 
+    SERIALIZED_RELATIONSHIPS = {
+        'labels': [],
+        'searcher_user': [],
+    }
+
     def deserialize_labels(self, labelnames):
         if labelnames is None:
             labelnames = []
@@ -142,13 +228,109 @@ class Label(Base, Serializable):
     active = Column(Boolean, default=True)
     description = Column(String)
 
+    # Labels are looked up by name ignoring case, as in `INSERT_LABEL`.
+    __table_args__ = (
+        Index('ix_label_lower_name', func.lower(name)),
+    )
+
     @classmethod
-    def name_list_to_object_list(cls, names):
-        labels = store.session.query(Label).filter(Label.name.in_(names)).all()
-        missing_labelnames = set(names)
-        for label in labels:
-            missing_labelnames.remove(label.name)
-        for labelname in missing_labelnames:
-            new_label = Label(name=labelname)
-            labels.append(new_label)
-        return labels
+    def name_list_to_object_list(cls, names, retry=True):
+        """
+        Labels called `names`, ignoring case, creating any that are missing
+
+        Labels already known to this process cost a single query.
+        """
+        ids = cls.get_or_create_ids(names)
+        label_ids = list(OrderedDict.fromkeys(ids.values()))
+        if not label_ids:
+            return []
+        labels = store.session.query(Label).filter(Label.id.in_(label_ids)).all()
+        labels_by_name = {normalize_label_name(label.name): label for label in labels}
+        wrong = [
+            name for name, label_id in ids.items()
+            if name not in labels_by_name or labels_by_name[name].id != label_id
+        ]
+        if wrong and retry:
+            logger.warning('Forgetting labels from a rolled back transaction')
+            label_registry.forget(wrong)
+            return cls.name_list_to_object_list(names, retry=False)
+        found = OrderedDict(
+            (labels_by_name[name].id, labels_by_name[name]) for name in ids if name not in wrong
+        )
+        return list(found.values())
+
+    @classmethod
+    def get_or_create_ids(cls, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Ids of the labels called `names`, ignoring case
+
+        Missing labels are inserted in bulk within the current
+        transaction.  Labels inserted concurrently by another
+        transaction are used rather than duplicated.
+
+        :return: label ids by normalized name, in the order of `names`
+        """
+        given_names = OrderedDict()
+        for name in names:
+            given_names.setdefault(normalize_label_name(name), name)
+        ids = label_registry.lookup(store.session, given_names)
+        missing = [name for name in given_names if name not in ids]
+        if missing:
+            cls._insert_missing([given_names[name] for name in missing])
+            query = store.session.query(Label.id, func.lower(Label.name))
+            query = query.filter(func.lower(Label.name).in_(missing)).order_by(Label.id)
+            created = {}
+            for label_id, name in query:
+                created.setdefault(name, label_id)
+            label_registry.learn(created)
+            store.session.info[LABELS_CREATED] = True
+            ids.update(created)
+        return OrderedDict((name, ids[name]) for name in given_names if name in ids)
+
+    @classmethod
+    def _insert_missing(cls, names):
+        rows = [
+            {'name': name, 'active': True, 'normalized_name': normalize_label_name(name)}
+            for name in names
+        ]
+        dialect = store.session.get_bind().dialect.name
+        statement = INSERT_LABEL_IGNORING_CONFLICTS.get(dialect)
+        if statement is not None:
+            store.session.execute(text(statement), rows)
+        else:
+            statement = INSERT_LABEL.format(or_ignore='', on_conflict='')
+            for row in rows:
+                savepoint = store.session.begin_nested()
+                try:
+                    store.session.execute(text(statement), row)
+                    savepoint.commit()
+                except IntegrityError:
+                    savepoint.rollback()
+
+    @classmethod
+    def get_catalogue(cls) -> LabelCatalogue:
+        """
+        Names of all active labels, with an ETag identifying them
+
+        The catalogue is cached for the process and rebuilt once labels
+        created by `name_list_to_object_list` are committed.
+        """
+        catalogue = label_catalogue.get('active')
+        if catalogue is None:
+            query = store.session.query(Label.name).filter(Label.active == True).order_by(Label.id)
+            names = tuple(name for (name, ) in query)
+            etag = hashlib.sha1('\n'.join(names).encode('utf8')).hexdigest()
+            catalogue = LabelCatalogue(names, etag)
+            label_catalogue.set('active', catalogue)
+        return catalogue
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_label_catalogue(session):
+    if session.info.pop(LABELS_CREATED, False):
+        label_catalogue.clear()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_created_labels(session):
+    session.info.pop(LABELS_CREATED, None)
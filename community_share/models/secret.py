@@ -1,11 +1,23 @@
 from datetime import datetime, timedelta
+import logging
 import string, random, json
 
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 from sqlalchemy import Column, String, DateTime, Boolean
 
 from community_share import Base, Store, with_store
+from community_share.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SECRET_CACHE_SIZE = 4096
+# Other processes can mark a secret used without us hearing
+# about it, so never trust a resolution for longer than this.
+SECRET_CACHE_TTL = 60  # seconds
+
+# Maps secret keys to (user id, expiration, action).
+secret_cache = TTLCache(max_size=SECRET_CACHE_SIZE, ttl=SECRET_CACHE_TTL)
 
 
 class Secret(Base):
@@ -39,6 +51,10 @@ class Secret(Base):
             logger.error("Invalid JSON data in secret.info")
         return info
 
+    def mark_used(self):
+        self.used = True
+        secret_cache.discard(self.key)
+
 
 @with_store
 def create_secret(info: Dict[str, Any], hours_duration: int, store: Store=None) -> Secret:
@@ -55,3 +71,31 @@ def lookup_secret(key: str, store: Store=None) -> Optional[Secret]:
     secret = secret.filter(Secret.used == False)
     secret = secret.filter(Secret.expiration > datetime.utcnow())
     return secret.first()
+
+
+@with_store
+def resolve_secret(key: str,
+                   store: Store=None) -> Optional[Tuple[Optional[int], datetime, Optional[str]]]:
+    """Resolve a secret key without touching the database when possible
+
+    :param key: secret key
+    :param store: connection to database
+    :return: (user id, expiration, action) for a live secret or None
+    """
+    resolved = secret_cache.get(key)
+
+    if resolved is None:
+        secret = lookup_secret(key, store=store)
+
+        if secret is None:
+            return None
+
+        info = secret.get_info() or {}
+        resolved = (info.get('userId'), secret.expiration, info.get('action'))
+        secret_cache.set(key, resolved)
+
+    if resolved[1] <= datetime.utcnow():
+        secret_cache.discard(key)
+        return None
+
+    return resolved
@@ -3,8 +3,8 @@ from datetime import datetime, timedelta
 
 from sqlalchemy import ForeignKey, DateTime, Column
 from sqlalchemy import Integer, String, Boolean
-from sqlalchemy.orm import relationship, validates
-from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, relationship, validates
+from sqlalchemy import and_, exists, func, or_
 
 from community_share import time_format, mail_actions
 from community_share import store, Base, config
@@ -12,6 +12,9 @@ from community_share.models.base import Serializable, ValidationException
 
 logger = logging.getLogger(__name__)
 
+# Reminders go out once an event starts within this long.
+ONEDAY_REMINDER_LEAD = timedelta(hours=24)
+
 
 class Share(Base, Serializable):
     __tablename__ = 'share'
@@ -139,6 +142,12 @@ class Share(Base, Serializable):
         'events': serialize_events,
     }
 
+    SERIALIZED_RELATIONSHIPS = {
+        'educator': [],
+        'community_partner': [],
+        'events': ['share'],
+    }
+
     def on_delete(self, requester):
         for e in self.events:
             e.delete(requester)
@@ -338,7 +347,9 @@ class Event(Base, Serializable):
         if user.is_administrator:
             has_rights = True
         else:
-            share = store.session.query(Share).filter(Share.id == self.share_id).first()
+            share = self.share
+            if share is None:
+                share = store.session.query(Share).filter(Share.id == self.share_id).first()
             if share is not None:
                 if user.id == share.educator_user_id:
                     has_rights = True
@@ -365,6 +376,11 @@ class Event(Base, Serializable):
         'answers': serialize_answers,
     }
 
+    SERIALIZED_RELATIONSHIPS = {
+        'share': ['events'],
+        'answers': [],
+    }
+
     @classmethod
     def args_to_query(cls, args, requester):
         # user_id matches to educator_id or community_partner_id of Share
@@ -398,37 +414,73 @@ class EventReminder(Base):
     date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
     typ = Column(String(20), nullable=False)
 
+    @classmethod
+    def _is_reminded(cls, typ):
+        return exists().where(and_(cls.event_id == Event.id, cls.typ == typ))
+
+    @classmethod
+    def unreminded_events(cls, typ, *criteria):
+        """
+        Active events matching `criteria` without a reminder of type `typ`
+
+        The events are loaded with their share, its users and its
+        conversation, which is everything a reminder mail needs.
+        """
+        query = store.session.query(Event)
+        query = query.filter(Event.active == True, ~cls._is_reminded(typ), *criteria)
+        query = query.options(
+            joinedload(Event.share).joinedload(Share.educator),
+            joinedload(Event.share).joinedload(Share.community_partner),
+            joinedload(Event.share).joinedload(Share.conversation),
+        )
+        query = query.order_by(Event.datetime_start, Event.id)
+        return query.all()
+
     @classmethod
     def get_oneday_reminder_events(cls):
-        typ = 'oneday_before'
         # Get all events starting in the next day.
         now = datetime.utcnow()
-        one_day_in_future = now + timedelta(hours=24)
-        query = store.session.query(Event)
-        query = query.filter(Event.datetime_start < one_day_in_future)
-        query = query.filter(Event.datetime_start > now)
-        events = query.all()
-        unreminded_events = []
-        for event in events:
-            oneday_before_reminders = [r for r in event.reminders if r.typ == typ]
-            if not oneday_before_reminders:
-                unreminded_events.append(event)
-        return unreminded_events
+        one_day_in_future = now + ONEDAY_REMINDER_LEAD
+        return cls.unreminded_events(
+            'oneday_before',
+            Event.datetime_start < one_day_in_future,
+            Event.datetime_start > now,
+        )
+
+    @classmethod
+    def next_oneday_reminder_time(cls, now):
+        """
+        When the next unreminded event will start within a day
+
+        :return: None if no upcoming event is waiting for a reminder
+        """
+        query = store.session.query(func.min(Event.datetime_start))
+        query = query.filter(
+            Event.active == True,
+            Event.datetime_start > now,
+            ~cls._is_reminded('oneday_before'),
+        )
+        first_start = query.scalar()
+        if first_start is None:
+            return None
+        return first_start - ONEDAY_REMINDER_LEAD
 
     @classmethod
     def get_review_reminder_events(cls):
-        typ = 'review'
         # Get all events that finished more than a day ago.
         now = datetime.utcnow()
         one_day_in_past = now - timedelta(hours=24)
         two_days_in_past = now - timedelta(hours=48)
-        query = store.session.query(Event)
-        query = query.filter(Event.datetime_stop < one_day_in_past)
-        query = query.filter(Event.datetime_stop > two_days_in_past)
-        events = query.all()
-        unreminded_events = []
-        for event in events:
-            review_reminders = [r for r in event.reminders if r.typ == typ]
-            if not review_reminders:
-                unreminded_events.append(event)
-        return unreminded_events
+        return cls.unreminded_events(
+            'review',
+            Event.datetime_stop < one_day_in_past,
+            Event.datetime_stop > two_days_in_past,
+        )
+
+    @classmethod
+    def add_for_events(cls, events, typ):
+        """Record that reminders of type `typ` went out, in one statement"""
+        now = datetime.utcnow()
+        store.session.execute(cls.__table__.insert(), [
+            {'event_id': event.id, 'typ': typ, 'date_created': now} for event in events
+        ])
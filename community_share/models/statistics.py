@@ -1,16 +1,56 @@
 import datetime
 
 import logging
+import weakref
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import Column, Integer, String, Date, Float, or_
+from sqlalchemy import Column, Integer, String, Date, Float, UniqueConstraint
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import bindparam, text
 
 from community_share import Base, store
+from community_share.cache import TTLCache
+from community_share.models.base import day_of
 from community_share.models.user import User, UserReview
 from community_share.models.conversation import Conversation
 from community_share.models.share import Share, Event
 
 logger = logging.getLogger(__name__)
 
+# Number of days, up to yesterday, that check_statistics fills in.
+STATISTICS_WINDOW = 30
+
+# Reports are read from statistics the worker stores on each pass, so
+# they are cached for as long as a pass takes.
+STATISTICS_REPORT_TTL = 600  # seconds
+MAX_REPORT_DAYS = 366
+
+# (first date, last date) -> statistics by date
+statistics_reports = TTLCache(max_size=64, ttl=STATISTICS_REPORT_TTL)
+
+StatisticsByDate = Dict[datetime.date, Dict[str, Optional[float]]]
+
+# Counter name -> date -> number of rows counted on that date
+DailyCounts = Dict[str, Dict[datetime.date, int]]
+
+
+def running_totals(changes: Dict[datetime.date, int], dates: List[datetime.date]) -> List[int]:
+    """
+    Totals at the end of each of `dates`, given the change on each day
+
+    :param changes: change in the total by date, including dates
+        before the first of `dates`
+    :param dates: consecutive dates
+    """
+    total = sum(n for date, n in changes.items() if date is not None and date < dates[0])
+    totals = []
+    for date in dates:
+        total += changes.get(date, 0)
+        totals.append(total)
+    return totals
+
 
 class Statistic(Base):
     __tablename__ = 'statistic'
@@ -35,41 +75,86 @@ class Statistic(Base):
 
     @classmethod
     def get_statistics(cls, date):
-        stats = store.session.query(cls).filter(cls.date == date).all()
-        if len(stats) == 0:
-            cls.update_statistics(date)
-            stats = store.session.query(cls).filter(cls.date == date).all()
-        combined = {}
-        for stat in stats:
-            combined[stat.name] = stat.value
-        return combined
+        """
+        Statistics for `date`, read from the statistic counters
+        """
+        statistics = cls.calculate_statistics(date)
+        return {key: value for key, value in statistics.items() if value is not None}
+
+    @classmethod
+    def get_statistics_for_range(cls, first_date, last_date) -> StatisticsByDate:
+        """
+        Stored statistics for each day from `first_date` to
+        `last_date`, inclusive, in one query
+
+        Days with nothing stored yet have no statistics.
+        """
+        n_days = (last_date - first_date).days + 1
+        statistics = OrderedDict(
+            (first_date + datetime.timedelta(days=n), {}) for n in range(n_days)
+        )
+        query = store.session.query(cls.date, cls.name, cls.value)
+        query = query.filter(cls.date >= first_date, cls.date <= last_date)
+        for date, name, value in query:
+            statistics[date][name] = value
+        return statistics
+
+    @classmethod
+    def get_report(cls, first_date, last_date) -> StatisticsByDate:
+        """
+        `get_statistics_for_range`, cached until the statistics are
+        next updated
+        """
+        key = (first_date, last_date)
+        report = statistics_reports.get(key)
+        if report is None:
+            report = cls.get_statistics_for_range(first_date, last_date)
+            statistics_reports.set(key, report)
+        return report
 
     @classmethod
     def check_statistics(cls):
         yesterday = cls.date_yesterday()
-        for days_ago in range(30):
-            date = yesterday - datetime.timedelta(days=days_ago)
-            n_stats = store.session.query(cls).filter(cls.date == date).count()
-            if n_stats == 0:
-                cls.update_statistics(date)
+        first_date = yesterday - datetime.timedelta(days=STATISTICS_WINDOW - 1)
+        query = store.session.query(cls.date).distinct()
+        query = query.filter(cls.date >= first_date, cls.date <= yesterday)
+        dates_with_statistics = set(date for (date, ) in query)
+        missing_dates = [
+            yesterday - datetime.timedelta(days=days_ago)
+            for days_ago in range(STATISTICS_WINDOW)
+            if yesterday - datetime.timedelta(days=days_ago) not in dates_with_statistics
+        ]
+        if missing_dates:
+            cls.update_statistics_for_range(min(missing_dates), max(missing_dates))
 
     @classmethod
     def update_statistics(cls, date, force=False):
-        # Get existing statistics for that date.
-        stats = store.session.query(cls).filter(cls.date == date).all()
-        old_stats = {}
-        for stat in stats:
-            old_stats[stat.name] = stat
-        new_stats = cls.calculate_statistics(date)
-        for key, value in new_stats.items():
-            if value is not None:
-                if key not in old_stats:
-                    stat = Statistic(name=key, value=value, date=date)
-                    store.session.add(stat)
-                elif force:
-                    old_stats[key].value = value
-                    store.session.add(old_stats[key])
+        cls.update_statistics_for_range(date, date, force=force)
+
+    @classmethod
+    def update_statistics_for_range(cls, first_date, last_date, force=False):
+        """
+        Calculate and store the statistics for every day from
+        `first_date` to `last_date`, inclusive
+
+        :param force: overwrite statistics that are already stored
+        """
+        query = store.session.query(cls).filter(cls.date >= first_date, cls.date <= last_date)
+        old_stats = {(stat.date, stat.name): stat for stat in query}
+        new_stats = []
+        calculated = cls.calculate_statistics_for_range(first_date, last_date)
+        for date, statistics in calculated.items():
+            for key, value in statistics.items():
+                if value is not None:
+                    if (date, key) not in old_stats:
+                        new_stats.append({'name': key, 'value': value, 'date': date})
+                    elif force:
+                        old_stats[(date, key)].value = value
+                        store.session.add(old_stats[(date, key)])
+        if new_stats:
+            store.session.execute(cls.__table__.insert(), new_stats)
         store.session.commit()
+        statistics_reports.clear()
 
     active_statistics = [
         'n_new_users',
@@ -85,134 +170,362 @@ class Statistic(Base):
 
     @classmethod
     def calculate_statistics(cls, date):
-        statistics = {}
-        for stat_name in cls.active_statistics:
-            func_name = 'calculate_{}'.format(stat_name)
-            stat_func = getattr(cls, func_name, None)
-            if stat_func is None:
-                logger.error('Failed to find statistic function for {}'.format(stat_name))
-            else:
-                statistics[stat_name] = stat_func(date)
+        return cls.calculate_statistics_for_range(date, date)[date]
+
+    @classmethod
+    def calculate_statistics_for_range(cls, first_date, last_date) -> StatisticsByDate:
+        """
+        Calculate every statistic for each day from `first_date` to
+        `last_date`, inclusive, from the statistic counters
+
+        Runs the same two queries however many days are asked for, and
+        never goes back to the tables the statistics describe.
+        """
+        n_days = (last_date - first_date).days + 1
+        dates = [first_date + datetime.timedelta(days=n) for n in range(n_days)]
+        statistics = derive_statistics(StatisticCounter.load(first_date, last_date), dates)
+        yesterday = cls.date_yesterday()
+        if yesterday in statistics:
+            statistics[yesterday]['n_users_active_in_last_month'] = \
+                count_users_active_in_last_month()
         return statistics
 
-    @staticmethod
-    def calculate_n_new_users(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        # Users created in time period
-        n_new_users = store.session.query(User)
-        n_new_users = n_new_users.filter(
-            User.date_created > start_of_period,
-            User.date_created < end_of_period,
-        )
-        n_new_users = n_new_users.count()
-        return n_new_users
 
-    @staticmethod
-    def calculate_n_total_users(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        # Total number of users.
-        n_total_users = store.session.query(User).filter(
-            User.date_created < end_of_period,
-            or_(User.date_inactivated == None, User.date_inactivated > end_of_period)
-        ).count()
-        return n_total_users
+class StatisticCounter(Base):
+    """
+    Number of rows counted towards a statistic on one day
 
-    @staticmethod
-    def calculate_n_users_active_in_last_month(date):
-        # Total users active in the last 30 days.
-        # We can only do this if we're processing the results for yesterday.
-        now = datetime.datetime.utcnow()
-        today = now.date()
-        n_active_users_in_last_month = None
-        if date + datetime.timedelta(days=1) == today:
-            one_month_ago = today - datetime.timedelta(days=30)
-            n_active_users_in_last_month = store.session.query(User)
-            n_active_users_in_last_month = n_active_users_in_last_month.filter(
-                User.last_active > one_month_ago,
-                User.active == True,
-            )
-            n_active_users_in_last_month = n_active_users_in_last_month.count()
-        return n_active_users_in_last_month
+    The counters are kept up to date as users, conversations, events
+    and reviews are flushed, so statistics can be read without going
+    back to those tables.  `reconcile` checks them against a full
+    recount.
+    """
+    __tablename__ = 'statistic_counter'
+    __table_args__ = (UniqueConstraint('name', 'date'), )
 
-    @staticmethod
-    def calculate_n_users_started_conversation(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        # Number of users who have started a conversation
-        query = store.session.query(User)
-        query = query.join(Conversation, Conversation.userA_id == User.id)
-        query = query.filter(
-            Conversation.date_created > start_of_period,
-            Conversation.date_created < end_of_period,
-        )
-        n_users_started_conversation = query.count()
-        return n_users_started_conversation
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)
+    date = Column(Date, nullable=False)
+    value = Column(Integer, nullable=False)
 
-    @staticmethod
-    def calculate_n_users_did_event(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        # Number of users who did an event
-        query = store.session.query(User)
-        query = query.join(
-            Share,
-            or_(Share.educator_user_id == User.id, Share.community_partner_user_id == User.id),
-        )
-        query = query.join(Event)
-        query = query.filter(
-            Event.datetime_stop > start_of_period,
-            Event.datetime_stop < end_of_period,
-        )
-        n_users_did_event = query.count()
-        return n_users_did_event
+    @classmethod
+    def load(cls, first_date, last_date) -> DailyCounts:
+        """
+        Counters from `first_date` to `last_date`
 
-    @staticmethod
-    def calculate_n_users_reviewed_event(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        # Number of users who reviewed an event
-        query = store.session.query(User)
-        query = query.join(UserReview, UserReview.creator_user_id == User.id)
-        query = query.filter(
-            UserReview.date_created > start_of_period,
-            UserReview.date_created < end_of_period,
-        )
-        n_users_reviewed_event = query.count()
-        return n_users_reviewed_event
+        Counters before `first_date` are summed into the day before it
+        so that running totals can be taken.
+        """
+        counts = defaultdict(Counter)
+        query = store.session.query(cls.name, cls.date, cls.value)
+        query = query.filter(cls.date >= first_date, cls.date <= last_date)
+        for name, date, value in query:
+            counts[name][date] += value
+        day_before = first_date - datetime.timedelta(days=1)
+        query = store.session.query(cls.name, func.sum(cls.value))
+        query = query.filter(cls.date < first_date).group_by(cls.name)
+        for name, total in query:
+            counts[name][day_before] += total
+        return counts
 
-    @staticmethod
-    def calculate_n_events_done(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        query = store.session.query(Event)
-        query = query.filter(
-            Event.datetime_stop > start_of_period,
-            Event.datetime_stop < end_of_period,
-            Event.active == True,
-        )
-        n_events_done = query.count()
-        return n_events_done
+    @classmethod
+    def increment(cls, session, changes: Dict[Tuple[str, datetime.date], int]) -> None:
+        """
+        Add `changes` to the counters within the session's transaction
 
-    @staticmethod
-    def calculate_n_total_events_done(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        query = store.session.query(Event)
-        query = query.filter(Event.datetime_stop < end_of_period, Event.active == True)
-        n_total_events_done = query.count()
-        return n_total_events_done
+        :param changes: change in value by (name, date)
+        """
+        rows = [
+            {'name': name, 'date': date, 'value': value}
+            for (name, date), value in changes.items() if value != 0
+        ]
+        if not rows:
+            return
+        dialect = session.get_bind().dialect.name
+        if dialect in UPSERT_COUNTER_DIALECTS:
+            session.execute(UPSERT_COUNTER, rows)
+        else:
+            for row in rows:
+                result = session.execute(UPDATE_COUNTER, row)
+                if result.rowcount == 0:
+                    session.execute(cls.__table__.insert(), row)
 
-    @staticmethod
-    def calculate_n_upcoming_events(date):
-        start_of_period = datetime.datetime.combine(date, datetime.time())
-        end_of_period = start_of_period + datetime.timedelta(days=1)
-        query = store.session.query(Event)
-        query = query.filter(
-            Event.date_created < end_of_period,
-            Event.datetime_stop > end_of_period,
-            Event.active == True,
+    @classmethod
+    def reconcile(cls) -> int:
+        """
+        Recount every statistic from its table and correct the counters
+
+        The counters are locked first, so that the recount and the
+        counters are read as of the same commits.  Rows flushed
+        meanwhile wait for the lock to count themselves.
+
+        :return: number of counters that were wrong
+        """
+        lock_counters(store.session)
+        expected = count_daily_changes()
+        actual = defaultdict(Counter)
+        for name, date, value in store.session.query(cls.name, cls.date, cls.value):
+            actual[name][date] += value
+        changes = {}
+        for name in COUNTERS:
+            for date in set(expected[name]) | set(actual[name]):
+                difference = expected[name][date] - actual[name][date]
+                if difference != 0:
+                    changes[(name, date)] = difference
+        if changes:
+            logger.warning('Correcting {} statistic counters'.format(len(changes)))
+            cls.increment(store.session, changes)
+        store.session.commit()
+        return len(changes)
+
+
+COUNTERS = [
+    'n_new_users',
+    'n_users_inactivated',
+    'n_users_started_conversation',
+    'n_users_reviewed_event',
+    'n_users_did_event',
+    'n_events_done',
+    'n_events_became_upcoming',
+    'n_events_stopped_upcoming',
+]
+
+UPSERT_COUNTER_DIALECTS = {'postgresql', 'sqlite'}
+
+UPSERT_COUNTER = text('''
+    INSERT INTO statistic_counter (name, date, value) VALUES (:name, :date, :value)
+    ON CONFLICT (name, date) DO UPDATE SET value = statistic_counter.value + excluded.value
+''').bindparams(bindparam('date', type_=Date))
+
+LOCK_COUNTERS = {
+    'postgresql': 'LOCK TABLE statistic_counter IN SHARE ROW EXCLUSIVE MODE',
+    # Any write takes SQLite's lock on the whole database until commit.
+    'sqlite': 'UPDATE statistic_counter SET value = value WHERE 0',
+}
+
+UPDATE_COUNTER = text('''
+    UPDATE statistic_counter SET value = value + :value WHERE name = :name AND date = :date
+''').bindparams(bindparam('date', type_=Date))
+
+
+def lock_counters(session) -> None:
+    """
+    Keep other transactions from changing the counters until the
+    session's transaction ends
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect in LOCK_COUNTERS:
+        session.execute(LOCK_COUNTERS[dialect])
+    else:
+        session.connection(execution_options={'isolation_level': 'SERIALIZABLE'})
+
+
+def derive_statistics(counts: DailyCounts, dates: List[datetime.date]) -> StatisticsByDate:
+    """
+    Statistics for each of `dates` from the daily counters
+
+    :param counts: counters by name and date, including the dates
+        before `dates` for the running totals
+    :param dates: consecutive dates
+    """
+    counts = defaultdict(Counter, counts)
+    user_changes = Counter(counts['n_new_users'])
+    user_changes.subtract(counts['n_users_inactivated'])
+    upcoming_changes = Counter(counts['n_events_became_upcoming'])
+    upcoming_changes.subtract(counts['n_events_stopped_upcoming'])
+    n_total_users = running_totals(user_changes, dates)
+    n_total_events_done = running_totals(counts['n_events_done'], dates)
+    n_upcoming_events = running_totals(upcoming_changes, dates)
+
+    statistics = OrderedDict()
+    for i, date in enumerate(dates):
+        statistics[date] = {
+            'n_new_users': counts['n_new_users'][date],
+            'n_total_users': n_total_users[i],
+            'n_users_active_in_last_month': None,
+            'n_users_started_conversation': counts['n_users_started_conversation'][date],
+            'n_users_did_event': counts['n_users_did_event'][date],
+            'n_users_reviewed_event': counts['n_users_reviewed_event'][date],
+            'n_events_done': counts['n_events_done'][date],
+            'n_total_events_done': n_total_events_done[i],
+            'n_upcoming_events': n_upcoming_events[i],
+        }
+    return statistics
+
+
+def count_users_active_in_last_month():
+    # Total users active in the last 30 days.
+    today = datetime.datetime.utcnow().date()
+    one_month_ago = datetime.datetime.combine(today - datetime.timedelta(days=30), datetime.time())
+    query = store.session.query(User)
+    query = query.filter(User.last_active > one_month_ago, User.active == True)
+    return query.count()
+
+
+def count_daily_changes() -> DailyCounts:
+    """
+    Every statistic counter, counted from the tables
+
+    Runs one query grouped by day for each table.
+    """
+    counts = defaultdict(Counter)
+
+    created = day_of(User.date_created)
+    inactivated = day_of(User.date_inactivated)
+    query = store.session.query(created, inactivated, func.count(User.id))
+    for created_date, inactivated_date, n_users in query.group_by(created, inactivated):
+        add_user_counts(counts, created_date, inactivated_date, n_users)
+
+    # Conversations and reviews count the users who made them.
+    created = day_of(Conversation.date_created)
+    query = store.session.query(created, func.count(Conversation.id))
+    query = query.join(User, Conversation.userA_id == User.id)
+    for created_date, n_conversations in query.group_by(created):
+        counts['n_users_started_conversation'][created_date] += n_conversations
+
+    created = day_of(UserReview.date_created)
+    query = store.session.query(created, func.count(UserReview.id))
+    query = query.join(User, UserReview.creator_user_id == User.id)
+    for created_date, n_reviews in query.group_by(created):
+        counts['n_users_reviewed_event'][created_date] += n_reviews
+
+    created = day_of(Event.date_created)
+    stopped = day_of(Event.datetime_stop)
+    query = store.session.query(
+        created,
+        stopped,
+        Event.active,
+        func.count(Event.id),
+        func.sum(n_event_users(Share.educator_user_id, Share.community_partner_user_id)),
+    )
+    query = query.join(Share, Event.share_id == Share.id)
+    query = query.group_by(created, stopped, Event.active)
+    for created_date, stopped_date, active, n_events, n_users in query:
+        add_event_counts(counts, created_date, stopped_date, active, n_events, n_users)
+
+    return counts
+
+
+def n_event_users(educator_user_id, community_partner_user_id):
+    # An event is done by its educator and its partner, who may be the same user.
+    if isinstance(educator_user_id, int):
+        return 1 if educator_user_id == community_partner_user_id else 2
+    return case([(educator_user_id == community_partner_user_id, 1)], else_=2)
+
+
+def add_user_counts(counts, created_date, inactivated_date, n_users=1):
+    counts['n_new_users'][created_date] += n_users
+    # Users inactivated during a day are not counted in its total.
+    if inactivated_date is not None:
+        counts['n_users_inactivated'][inactivated_date] += n_users
+
+
+def add_event_counts(counts, created_date, stopped_date, active, n_events=1, n_users=None):
+    counts['n_users_did_event'][stopped_date] += n_users
+    if active:
+        counts['n_events_done'][stopped_date] += n_events
+        # Upcoming from the day it was created until the day it is done.
+        if stopped_date > created_date:
+            counts['n_events_became_upcoming'][created_date] += n_events
+            counts['n_events_stopped_upcoming'][stopped_date] += n_events
+
+
+def as_date(value):
+    return value.date() if value is not None else None
+
+
+def count_row(session, obj, values) -> DailyCounts:
+    """
+    Counters that a single user, conversation, review or event adds to
+
+    :param values: attribute values to count the row with
+    """
+    counts = defaultdict(Counter)
+    if isinstance(obj, User):
+        add_user_counts(counts, as_date(values['date_created']), as_date(values['date_inactivated']))
+    elif isinstance(obj, Conversation):
+        counts['n_users_started_conversation'][as_date(values['date_created'])] += 1
+    elif isinstance(obj, UserReview):
+        counts['n_users_reviewed_event'][as_date(values['date_created'])] += 1
+    elif isinstance(obj, Event):
+        user_ids = session.query(Share.educator_user_id, Share.community_partner_user_id)
+        user_ids = user_ids.filter(Share.id == values['share_id']).first()
+        n_users = n_event_users(*user_ids) if user_ids is not None else 0
+        add_event_counts(
+            counts,
+            as_date(values['date_created']),
+            as_date(values['datetime_stop']),
+            values['active'],
+            n_users=n_users,
         )
-        n_upcoming_events = query.count()
-        return n_upcoming_events
+    return counts
+
+
+COUNTED_ATTRIBUTES = {
+    User: ['date_created', 'date_inactivated'],
+    Conversation: ['date_created'],
+    UserReview: ['date_created'],
+    Event: ['date_created', 'datetime_stop', 'active', 'share_id'],
+}
+
+
+def current_values(obj, attributes):
+    return {attribute: getattr(obj, attribute) for attribute in attributes}
+
+
+def committed_values(session, obj, attributes):
+    """
+    Attribute values as they are in the database, before the
+    changes about to be flushed
+    """
+    state = inspect(obj)
+    values = {}
+    for attribute in attributes:
+        history = state.attrs[attribute].history
+        if history.deleted:
+            values[attribute] = history.deleted[0]
+        elif history.unchanged:
+            values[attribute] = history.unchanged[0]
+        else:
+            # Changed without having been loaded, so ask the database.
+            cls = type(obj)
+            columns = [getattr(cls, attribute) for attribute in attributes]
+            row = session.query(*columns).filter(cls.id == obj.id).one()
+            return dict(zip(attributes, row))
+    return values
+
+
+def add_row_counts(changes, session, obj, values, sign):
+    for name, dates in count_row(session, obj, values).items():
+        for date, value in dates.items():
+            changes[(name, date)] += sign * value
+
+
+def is_counted(obj):
+    return type(obj) in COUNTED_ATTRIBUTES
+
+
+# Rows about to be flushed by each session, and what they counted towards before.
+_flushing_rows = weakref.WeakKeyDictionary()
+
+
+@event.listens_for(Session, 'before_flush')
+def _uncount_changed_rows(session, flush_context, instances):
+    """Take changed and deleted rows off the counters they were counted in"""
+    changes = Counter()
+    dirty = [obj for obj in session.dirty if is_counted(obj) and session.is_modified(obj)]
+    for obj in dirty + [obj for obj in session.deleted if is_counted(obj)]:
+        values = committed_values(session, obj, COUNTED_ATTRIBUTES[type(obj)])
+        add_row_counts(changes, session, obj, values, -1)
+    new = [obj for obj in session.new if is_counted(obj)]
+    _flushing_rows[session] = (new + dirty, changes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_flushed_rows(session, flush_context):
+    """Count new and changed rows once they have been written"""
+    rows, changes = _flushing_rows.pop(session, ([], Counter()))
+    for obj in rows:
+        values = current_values(obj, COUNTED_ATTRIBUTES[type(obj)])
+        add_row_counts(changes, session, obj, values, 1)
+    StatisticCounter.increment(session, changes)
@@ -105,6 +105,11 @@ class Question(Base, Serializable):
         'creator': serialize_creator,
     }
 
+    SERIALIZED_RELATIONSHIPS = {
+        'suggested_answers': [],
+        'creator': [],
+    }
+
 
 class SuggestedAnswer(Base, Serializable):
     __tablename__ = 'suggested_answer'
@@ -52,6 +52,18 @@ class BaseSerializeTest(unittest.TestCase):
             'mundane_custom_data': 'mundane_value' * 2
         }, d)
 
+    def test_reuses_field_plan(self):
+        TestClass().serialize(Requester(), exclude=['mundane_data'])
+        plan = TestClass.field_plan('standard', ('mundane_data', ))
+
+        TestClass().serialize(Requester(), exclude=['mundane_data'])
+        self.assertIs(plan, TestClass.field_plan('standard', ('mundane_data', )))
+
+    def test_field_plan_skips_id_without_id_attribute(self):
+        plan = TestClass.field_plan('standard')
+        self.assertEqual(('mundane_data', ), plan.fieldnames)
+        self.assertEqual(['mundane_custom_data'], [f for f, _ in plan.custom_serializers])
+
     def test_admin_with_exclude(self):
         d = TestClass().serialize(
             Requester(is_administrator=True),
@@ -0,0 +1,129 @@
+import datetime
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models.user import User
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.conversation import Conversation
+from community_share.models.share import Event, EventReminder, Share
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+
+class EventReminderTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        patcher = mock.patch('community_share.models.share.store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.now = datetime.datetime.utcnow()
+        connection = store.session.connection()
+        connection.execute(User.__table__.insert(), [
+            {'id': i, 'name': 'User {}'.format(i), 'email': 'user{}@example.com'.format(i)}
+            for i in (1, 2)
+        ])
+        connection.execute(Conversation.__table__.insert(), [
+            {'id': 1, 'title': 'Conversation', 'userA_id': 1, 'userB_id': 2},
+        ])
+        connection.execute(Share.__table__.insert(), [
+            {
+                'id': 1,
+                'conversation_id': 1,
+                'educator_user_id': 1,
+                'community_partner_user_id': 2,
+                'description': 'Share',
+            },
+        ])
+        store.session.commit()
+
+    def add_event(self, event_id, hours_from_now, active=True):
+        start = self.now + datetime.timedelta(hours=hours_from_now)
+        store.session.execute(Event.__table__.insert(), {
+            'id': event_id,
+            'share_id': 1,
+            'location': 'School',
+            'datetime_start': start,
+            'datetime_stop': start + datetime.timedelta(hours=1),
+            'active': active,
+        })
+
+    def test_oneday_reminder_events(self):
+        self.add_event(1, 2)
+        self.add_event(2, 20)
+        self.add_event(3, 30)
+        self.add_event(4, 3, active=False)
+        self.add_event(5, 4)
+        store.session.add(EventReminder(event_id=5, typ='oneday_before'))
+        store.session.add(EventReminder(event_id=2, typ='review'))
+        store.session.commit()
+
+        events = EventReminder.get_oneday_reminder_events()
+
+        self.assertEqual([1, 2], [e.id for e in events])
+
+    def test_review_reminder_events(self):
+        self.add_event(1, -30)
+        self.add_event(2, -40)
+        self.add_event(3, -2)
+        store.session.add(EventReminder(event_id=2, typ='review'))
+        store.session.commit()
+
+        events = EventReminder.get_review_reminder_events()
+
+        self.assertEqual([1], [e.id for e in events])
+
+    def test_events_are_loaded_with_share(self):
+        for event_id in range(1, 6):
+            self.add_event(event_id, event_id)
+        store.session.commit()
+        n_queries = []
+        count_query = lambda *args: n_queries.append(1)
+        event.listen(store.engine, 'before_cursor_execute', count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', count_query)
+
+        for e in EventReminder.get_oneday_reminder_events():
+            (e.share.educator.name, e.share.community_partner.name, e.share.conversation.id)
+
+        self.assertEqual(1, len(n_queries))
+
+    def test_next_oneday_reminder_time(self):
+        self.assertIsNone(EventReminder.next_oneday_reminder_time(self.now))
+        self.add_event(1, 30, active=False)
+        self.add_event(2, 40)
+        self.add_event(3, 50)
+        self.add_event(4, 35)
+        store.session.add(EventReminder(event_id=4, typ='oneday_before'))
+        store.session.commit()
+
+        self.assertEqual(
+            self.now + datetime.timedelta(hours=40 - 24),
+            EventReminder.next_oneday_reminder_time(self.now),
+        )
+
+    def test_add_for_events(self):
+        self.add_event(1, 2)
+        self.add_event(2, 3)
+        store.session.commit()
+
+        EventReminder.add_for_events(EventReminder.get_oneday_reminder_events(), 'oneday_before')
+
+        self.assertEqual([], EventReminder.get_oneday_reminder_events())
+        self.assertEqual(2, store.session.query(EventReminder).count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.cache import TTLCache
+from community_share.models import search, survey, user  # noqa: F401, registers the mapped classes
+from community_share.models.search import Label, LabelRegistry
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+
+class LabelTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        self.registry = LabelRegistry()
+        for name, patched in [
+            ('store', store),
+            ('label_registry', self.registry),
+            ('label_catalogue', TTLCache(max_size=1)),
+        ]:
+            patcher = mock.patch.object(search, name, patched)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        store.session.add_all([Label(name='Math'), Label(name='Science')])
+        store.session.commit()
+
+        self.n_queries = 0
+        event.listen(store.engine, 'before_cursor_execute', self.count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', self.count_query)
+
+    def count_query(self, *args):
+        self.n_queries += 1
+
+    def names(self, labels):
+        return [label.name for label in labels]
+
+    def test_reuses_labels_ignoring_case(self):
+        labels = Label.name_list_to_object_list(['science', 'MATH', 'Math'])
+
+        self.assertEqual(['Science', 'Math'], self.names(labels))
+        self.assertEqual(2, store.session.query(Label).count())
+
+    def test_creates_missing_labels(self):
+        labels = Label.name_list_to_object_list(['Art', 'Math', 'Music'])
+        store.session.commit()
+
+        self.assertEqual(['Art', 'Math', 'Music'], self.names(labels))
+        self.assertEqual(4, store.session.query(Label).count())
+
+    def test_known_labels_cost_one_query(self):
+        Label.name_list_to_object_list(['Art'])
+        store.session.commit()
+        self.n_queries = 0
+
+        Label.name_list_to_object_list(['math', 'Art', 'Science'])
+
+        self.assertEqual(1, self.n_queries)
+
+    def test_uses_labels_created_elsewhere(self):
+        Label.name_list_to_object_list(['Math'])
+        other_session = store.Session()
+        other_session.add(Label(name='Art'))
+        other_session.commit()
+
+        labels = Label.name_list_to_object_list(['art'])
+        store.session.commit()
+
+        self.assertEqual(['Art'], self.names(labels))
+        self.assertEqual(3, store.session.query(Label).count())
+
+    def test_forgets_rolled_back_labels(self):
+        Label.name_list_to_object_list(['Art'])
+        store.session.rollback()
+
+        labels = Label.name_list_to_object_list(['Art'])
+        store.session.commit()
+
+        self.assertEqual(['Art'], self.names(labels))
+        self.assertEqual(3, store.session.query(Label).count())
+
+    def test_forgets_rolled_back_labels_whose_id_was_reused(self):
+        Label.name_list_to_object_list(['Art'])
+        store.session.rollback()
+        other_session = store.Session()
+        other_session.add(Label(name='Music'))
+        other_session.commit()
+
+        labels = Label.name_list_to_object_list(['Art', 'Math'])
+        store.session.commit()
+
+        self.assertEqual(['Art', 'Math'], self.names(labels))
+        self.assertEqual(
+            ['Math', 'Science', 'Music', 'Art'],
+            self.names(store.session.query(Label).order_by(Label.id)),
+        )
+
+    def test_names_are_looked_up_through_an_index(self):
+        plan = store.session.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM label WHERE lower(name) IN ('art', 'math')"
+        ).fetchall()
+
+        self.assertIn('ix_label_lower_name', ' '.join(str(row[3]) for row in plan))
+
+    def test_catalogue_is_rebuilt_once_labels_are_committed(self):
+        self.assertEqual(('Math', 'Science'), Label.get_catalogue().names)
+
+        Label.name_list_to_object_list(['Art'])
+        # Another request may read the catalogue before the commit.
+        self.assertEqual(('Math', 'Science'), Label.get_catalogue().names)
+        store.session.commit()
+
+        self.assertEqual(('Math', 'Science', 'Art'), Label.get_catalogue().names)
+
+    def test_catalogue_is_kept_when_labels_are_rolled_back(self):
+        Label.get_catalogue()
+        Label.name_list_to_object_list(['Art'])
+        store.session.rollback()
+        self.n_queries = 0
+
+        store.session.commit()
+
+        self.assertEqual(('Math', 'Science'), Label.get_catalogue().names)
+        self.assertEqual(0, self.n_queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models.lease import Lease, make_holder_id
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+DURATION = datetime.timedelta(minutes=10)
+
+
+class LeaseTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        self.now = datetime.datetime.utcnow()
+
+    def acquire(self, holder, minutes_from_now=0):
+        now = self.now + datetime.timedelta(minutes=minutes_from_now)
+        return Lease.acquire(store.session, 'job', holder, DURATION, now=now)
+
+    def test_held_by_one_holder(self):
+        self.assertTrue(self.acquire('a'))
+        self.assertFalse(self.acquire('b'))
+        # The holder can renew it.
+        self.assertTrue(self.acquire('a', 5))
+        self.assertEqual(1, store.session.query(Lease).count())
+
+    def test_expires(self):
+        self.assertTrue(self.acquire('a'))
+        self.assertFalse(self.acquire('b', 9))
+        self.assertTrue(self.acquire('b', 11))
+        self.assertFalse(self.acquire('a', 12))
+
+    def test_release(self):
+        self.assertTrue(self.acquire('a'))
+        Lease.release(store.session, 'job', 'b')
+        self.assertFalse(self.acquire('b'))
+
+        Lease.release(store.session, 'job', 'a')
+        self.assertTrue(self.acquire('b'))
+
+    def test_holder_ids_differ(self):
+        self.assertNotEqual(make_holder_id(), make_holder_id())
+
+
+if __name__ == '__main__':
+    unittest.main()
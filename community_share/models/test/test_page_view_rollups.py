@@ -0,0 +1,172 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.analytics import (
+    PageView,
+    PageViewRollupMark,
+    PathViews,
+    TransitionViews,
+    UserDayViews,
+    add_views,
+    roll_up_page_views,
+)
+from community_share.models.user import User
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+DAY_1 = datetime.date(2016, 10, 1)
+DAY_2 = datetime.date(2016, 10, 2)
+
+
+def at(date, hour):
+    return datetime.datetime.combine(date, datetime.time(hour))
+
+
+class PageViewRollupTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        store.session.add_all([
+            User(id=1, name='A', email='a@example.com'),
+            User(id=2, name='B', email='b@example.com'),
+        ])
+        store.session.commit()
+
+    def tearDown(self):
+        store.session.rollback()
+
+    def add_views(self, *views):
+        store.session.execute(PageView.__table__.insert(), [
+            {'user_id': user_id, 'viewed_at': viewed_at, 'prev_path': prev_path,
+             'next_path': next_path}
+            for user_id, viewed_at, prev_path, next_path in views
+        ])
+        store.session.commit()
+
+    def roll_up(self, **kwargs):
+        # The first run only notes the newest view, the second rolls up to it.
+        return roll_up_page_views(store.session, **kwargs) + \
+            roll_up_page_views(store.session, **kwargs)
+
+    def rows(self, rollup):
+        store.session.expire_all()
+        columns = [column.name for column in rollup.__table__.columns]
+        return sorted(
+            tuple(getattr(row, name) for name in columns)
+            for row in store.session.query(rollup)
+        )
+
+    def test_rolls_up_views_by_path_transition_and_user_day(self):
+        self.add_views(
+            (1, at(DAY_1, 9), '/search', '/profile'),
+            (1, at(DAY_1, 10), '/profile', '/messages'),
+            (2, at(DAY_1, 11), '/search', '/profile'),
+            (2, at(DAY_2, 9), '/search', '/profile'),
+        )
+        self.assertEqual(4, self.roll_up())
+
+        self.assertEqual([
+            (DAY_1, '/messages', 1),
+            (DAY_1, '/profile', 2),
+            (DAY_2, '/profile', 1),
+        ], self.rows(PathViews))
+        self.assertEqual([
+            (DAY_1, '/profile', '/messages', 1),
+            (DAY_1, '/search', '/profile', 2),
+            (DAY_2, '/search', '/profile', 1),
+        ], self.rows(TransitionViews))
+        self.assertEqual([
+            (DAY_1, 1, 2),
+            (DAY_1, 2, 1),
+            (DAY_2, 2, 1),
+        ], self.rows(UserDayViews))
+
+    def test_only_rolls_up_views_seen_by_the_run_before(self):
+        self.add_views((1, at(DAY_1, 9), '/search', '/profile'))
+        self.assertEqual(0, roll_up_page_views(store.session))
+        self.add_views((1, at(DAY_1, 10), '/search', '/profile'))
+        self.assertEqual(1, roll_up_page_views(store.session))
+        self.assertEqual(1, roll_up_page_views(store.session))
+        self.assertEqual(0, roll_up_page_views(store.session))
+        self.assertEqual([(DAY_1, '/profile', 2)], self.rows(PathViews))
+
+        mark = store.session.query(PageViewRollupMark).one()
+        self.assertEqual((2, 2), (mark.rolled_up_id, mark.seen_id))
+
+    def test_adds_to_existing_counts_in_batches(self):
+        self.add_views(*[(1, at(DAY_1, 9), '/search', '/profile')] * 5)
+        self.assertEqual(5, self.roll_up(batch_size=2))
+        self.add_views(*[(1, at(DAY_1, 10), '/search', '/profile')] * 3)
+        self.assertEqual(3, self.roll_up(batch_size=2))
+        self.assertEqual([(DAY_1, '/profile', 8)], self.rows(PathViews))
+        self.assertEqual([(DAY_1, 1, 8)], self.rows(UserDayViews))
+
+    def test_adds_views_without_upsert(self):
+        store.engine.dialect.name = 'other'
+        try:
+            add_views(store.session, PathViews, [{'date': DAY_1, 'path': '/a', 'n_views': 2}])
+            add_views(store.session, PathViews, [
+                {'date': DAY_1, 'path': '/a', 'n_views': 3},
+                {'date': DAY_1, 'path': '/b', 'n_views': 1},
+            ])
+        finally:
+            store.engine.dialect.name = 'sqlite'
+        self.assertEqual([(DAY_1, '/a', 5), (DAY_1, '/b', 1)], self.rows(PathViews))
+
+    def test_skips_views_without_a_user(self):
+        self.add_views((None, at(DAY_1, 9), '/search', '/profile'))
+        self.assertEqual(1, self.roll_up())
+        self.assertEqual([(DAY_1, '/profile', 1)], self.rows(PathViews))
+        self.assertEqual([], self.rows(UserDayViews))
+
+    def test_queries_rollups(self):
+        self.add_views(
+            (1, at(DAY_1, 9), '/search', '/profile'),
+            (1, at(DAY_1, 10), '/profile', '/messages'),
+            (2, at(DAY_1, 11), '/search', '/profile'),
+            (2, at(DAY_2, 9), '/search', '/messages'),
+        )
+        self.roll_up()
+
+        # Ties are broken by path.
+        self.assertEqual([('/messages', 2), ('/profile', 2)],
+                         PathViews.top(store.session, DAY_1, DAY_2, 10))
+        self.assertEqual([('/profile', 2)], PathViews.top(store.session, DAY_1, DAY_1, 1))
+        self.assertEqual(
+            [('/search', '/profile', 2), ('/search', '/messages', 1)],
+            TransitionViews.top(store.session, DAY_1, DAY_2, 10, prev_path='/search'),
+        )
+        self.assertEqual(
+            [('/profile', '/messages', 1), ('/search', '/messages', 1)],
+            TransitionViews.top(store.session, DAY_1, DAY_2, 10, next_path='/messages'),
+        )
+        self.assertEqual(
+            [2, 1, 0],
+            TransitionViews.funnel(
+                store.session, ['/search', '/profile', '/messages', '/search'], DAY_1, DAY_2),
+        )
+        self.assertEqual(
+            [(DAY_1, {'n_users': 2, 'n_views': 3}), (DAY_2, {'n_users': 1, 'n_views': 1})],
+            list(UserDayViews.daily(store.session, DAY_1, DAY_2).items()),
+        )
+        self.assertEqual(
+            [(DAY_2, {'n_users': 1, 'n_views': 1})],
+            list(UserDayViews.daily(store.session, DAY_2, DAY_2, user_id=2).items()),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models.user import User
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.picture import STALE_UPLOAD, PictureObject
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+SHA1 = 'a' * 40
+FILENAME = 'picture_{}.png'.format(SHA1)
+
+
+class PictureObjectTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        self.now = datetime.datetime.utcnow()
+
+    def claim(self, minutes_from_now=0):
+        now = self.now + datetime.timedelta(minutes=minutes_from_now)
+        return PictureObject.claim(store.session, SHA1, FILENAME, 100, '/tmp/staged', now=now)
+
+    def test_uploaded_once(self):
+        self.assertTrue(self.claim())
+        self.assertFalse(self.claim(1))
+        PictureObject.record_uploaded(store.session, SHA1)
+
+        self.assertFalse(self.claim(2))
+        self.assertFalse(self.claim(24 * 60))
+
+    def test_lost_upload_is_made_again(self):
+        self.assertTrue(self.claim())
+        minutes = STALE_UPLOAD.total_seconds() / 60
+
+        self.assertFalse(self.claim(minutes - 1))
+        self.assertTrue(self.claim(minutes + 1))
+        self.assertFalse(self.claim(minutes + 2))
+
+    def test_stale_upload_is_claimed_by_the_worker(self):
+        self.assertTrue(self.claim())
+        minutes = STALE_UPLOAD.total_seconds() / 60
+        later = self.now + datetime.timedelta(minutes=minutes + 1)
+
+        self.assertEqual([], PictureObject.stale_uploads(store.session, self.now))
+        self.assertEqual(
+            [(SHA1, FILENAME, '/tmp/staged')],
+            PictureObject.stale_uploads(store.session, later),
+        )
+        self.assertTrue(PictureObject.claim_stale(store.session, SHA1, later))
+        self.assertFalse(PictureObject.claim_stale(store.session, SHA1, later))
+        store.session.commit()
+        self.assertEqual([], PictureObject.stale_uploads(store.session, later))
+
+        PictureObject.record_uploaded(store.session, SHA1)
+        self.assertEqual([], PictureObject.stale_uploads(store.session, later + STALE_UPLOAD * 2))
+        self.assertIsNone(store.session.query(PictureObject.staged_path).scalar())
+
+    def test_remove_unreferenced(self):
+        self.assertTrue(self.claim())
+        PictureObject.record_uploaded(store.session, SHA1)
+        store.session.add(User(name='User', email='user@example.org', picture_filename=FILENAME))
+        store.session.commit()
+        later = self.now + datetime.timedelta(days=1)
+
+        self.assertEqual([], PictureObject.remove_unreferenced(store.session, later))
+
+        store.session.query(User).update({User.picture_filename: None})
+        store.session.commit()
+        # Claimed since the cut off, so maybe about to be used.
+        self.assertEqual([], PictureObject.remove_unreferenced(store.session, self.now))
+        self.assertEqual([FILENAME], PictureObject.remove_unreferenced(store.session, later))
+        self.assertEqual(0, store.session.query(PictureObject).count())
+
+
+if __name__ == '__main__':
+    unittest.main()
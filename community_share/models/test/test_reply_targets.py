@@ -0,0 +1,132 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base, config
+from community_share.crypt import CryptHelper
+from community_share.models.user import User
+from community_share.models import conversation, survey  # noqa: F401, registers Answer for Event
+from community_share.models.conversation import (
+    Conversation,
+    Message,
+    Participant,
+    ReplyTarget,
+    load_participants,
+    reply_targets,
+)
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+
+class ReplyTargetTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        reply_targets.clear()
+        key = CryptHelper.encode(b'This is a key123This is an IV456')
+        for target, name, value in [
+            (conversation, 'store', store),
+            (config, 'crypt_helper', CryptHelper(key)),
+            (config, 'MAILGUN_DOMAIN', 'mail.example.org'),
+        ]:
+            patcher = mock.patch.object(target, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        connection = store.session.connection()
+        connection.execute(User.__table__.insert(), [
+            {'id': i, 'name': 'User {}'.format(i), 'email': 'user{}@example.org'.format(i)}
+            for i in (1, 2)
+        ])
+        connection.execute(Conversation.__table__.insert(), [
+            {'id': 1, 'title': 'Conversation', 'userA_id': 1, 'userB_id': 2},
+        ])
+        connection.execute(Message.__table__.insert(), [
+            {'id': 7, 'conversation_id': 1, 'sender_user_id': 2, 'content': 'Hello'},
+        ])
+        store.session.commit()
+
+    def count_queries(self):
+        n_queries = []
+        count_query = lambda *args: n_queries.append(1)
+        event.listen(store.engine, 'before_cursor_execute', count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', count_query)
+        return n_queries
+
+    def test_generated_address_is_found_without_queries(self):
+        message = store.session.query(Message).get(7)
+        from_address = message.generate_from_address()
+        self.assertTrue(from_address.startswith('User 2 (via CommunityShare)<'))
+        store.session.commit()
+        n_queries = self.count_queries()
+
+        target = Message.find_reply_target(from_address.lower())
+
+        self.assertEqual(0, len(n_queries))
+        self.assertEqual(ReplyTarget(7, 1, sender_id=2, receiver_id=1), target)
+
+    def test_participants_are_loaded_as_they_are_now(self):
+        message = store.session.query(Message).get(7)
+        from_address = message.generate_from_address()
+        store.session.query(User).filter_by(id=2).update({'email': 'new2@example.org'})
+        store.session.commit()
+        n_queries = self.count_queries()
+
+        sender, receiver = load_participants(Message.find_reply_target(from_address))
+
+        self.assertEqual(1, len(n_queries))
+        self.assertEqual(Participant(2, 'User 2', 'new2@example.org'), sender)
+        self.assertEqual(Participant(1, 'User 1', 'user1@example.org'), receiver)
+
+    def test_address_from_another_process_is_looked_up(self):
+        _, from_address = Message.make_from_address(7, 'User 2')
+
+        target = Message.find_reply_target(from_address)
+        self.assertEqual(7, target.message_id)
+        self.assertEqual(1, target.receiver_id)
+
+        n_queries = self.count_queries()
+        self.assertEqual(target, Message.find_reply_target(from_address))
+        self.assertEqual(0, len(n_queries))
+
+    def test_reply_address(self):
+        message = store.session.query(Message).get(7)
+        target = Message.find_reply_target(message.generate_from_address())
+
+        reply_address = Message.generate_reply_from_address(target, 8, 'User 1')
+        store.session.commit()
+
+        self.assertTrue(reply_address.startswith('User 1 (via CommunityShare)<'))
+        reply = Message.find_reply_target(reply_address)
+        self.assertEqual(8, reply.message_id)
+        self.assertEqual((target.receiver_id, target.sender_id), (reply.sender_id, reply.receiver_id))
+        self.assertEqual(8, Message.process_from_address(reply_address))
+
+    def test_rolled_back_reply_is_not_cached(self):
+        target = Message.find_reply_target(Message.make_from_address(7, 'User 2')[1])
+
+        reply_address = Message.generate_reply_from_address(target, 8, 'User 1')
+        store.session.rollback()
+        store.session.commit()
+
+        self.assertEqual(1, len(reply_targets))
+        self.assertIsNone(Message.find_reply_target(reply_address))
+
+    def test_unknown_addresses(self):
+        _, from_address = Message.make_from_address(99, 'Nobody')
+        for address in ['user1@example.org', 'nothing', from_address]:
+            self.assertIsNone(Message.find_reply_target(address))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base, config
+from community_share.models.institution import Institution, InstitutionAssociation
+from community_share.models.search import Label, Search
+from community_share.models.user import User
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+
+def add_users(n_users):
+    labels = [Label(name='label{}'.format(i)) for i in range(3)]
+    institution = Institution(name='School')
+    for i in range(n_users):
+        user = User(name='User {}'.format(i), email='user{}@example.com'.format(i))
+        user.institution_associations = [
+            InstitutionAssociation(role='teacher', institution=institution),
+        ]
+        user.educator_profile_search = Search(
+            searcher_role='educator',
+            searching_for_role='partner',
+            labels=labels[:(i % 3) + 1],
+        )
+        store.session.add(user)
+    store.session.commit()
+    for user in store.session.query(User):
+        user.educator_profile_search.searcher_user_id = user.id
+    store.session.commit()
+
+
+class SerializeManyTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        patcher = mock.patch.object(config, 'UPLOAD_LOCATION', '', create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.n_queries = 0
+        event.listen(store.engine, 'before_cursor_execute', self.count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', self.count_query)
+
+    def count_query(self, *args):
+        self.n_queries += 1
+
+    def serialize_many_cost(self):
+        store.session.expire_all()
+        users = store.session.query(User).all()
+        requester = users[0]
+        self.n_queries = 0
+        User.serialize_many(users, requester)
+        return self.n_queries
+
+    def test_matches_individual_serialization(self):
+        add_users(5)
+        store.session.expire_all()
+        users = store.session.query(User).order_by(User.id).all()
+        expected = [user.serialize(users[0]) for user in users]
+
+        store.session.expire_all()
+        users = store.session.query(User).order_by(User.id).all()
+        self.assertEqual(expected, User.serialize_many(users, users[0]))
+
+    def test_query_count_independent_of_batch_size(self):
+        add_users(3)
+        few_users_cost = self.serialize_many_cost()
+
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        add_users(12)
+
+        self.assertEqual(few_users_cost, self.serialize_many_cost())
+
+    def test_eager_load_paths_follow_nested_excludes(self):
+        self.assertIn('educator_profile_search.labels', User.eager_load_paths())
+        self.assertNotIn('educator_profile_search.searcher_user', User.eager_load_paths())
+        self.assertIn('searcher_user.institution_associations', Search.eager_load_paths())
+
+    def test_skips_reload_when_already_loaded(self):
+        add_users(3)
+        users = store.session.query(User).all()
+        User.eager_load(users)
+        self.n_queries = 0
+        User.eager_load(users)
+
+        self.assertEqual(0, self.n_queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import datetime
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base
+from community_share.models import statistics, survey  # noqa: F401, registers Answer for Event
+from community_share.models.conversation import Conversation
+from community_share.models.share import Event, Share
+from community_share.models.statistics import Statistic, StatisticCounter
+from community_share.models.user import User, UserReview
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+DAY_1 = datetime.date(2016, 3, 1)
+DAY_2 = datetime.date(2016, 3, 2)
+DAY_3 = datetime.date(2016, 3, 3)
+
+
+def at(date, hour):
+    return datetime.datetime.combine(date, datetime.time(hour))
+
+
+class StatisticsTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+        patcher = mock.patch.object(statistics, 'store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        users = [
+            User(name='A', email='a@example.com', date_created=at(DAY_1, 9)),
+            User(name='B', email='b@example.com', date_created=at(DAY_1, 10),
+                 date_inactivated=at(DAY_3, 8)),
+            User(name='C', email='c@example.com', date_created=at(DAY_2, 9)),
+        ]
+        store.session.add_all(users)
+        store.session.flush()
+        # Conversation checks its users with the global store.
+        store.session.execute(Conversation.__table__.insert(), {
+            'title': 'Trip',
+            'userA_id': users[0].id,
+            'userB_id': users[1].id,
+            'date_created': at(DAY_2, 12),
+            'active': True,
+        })
+        share = Share(
+            conversation_id=1, educator_user_id=users[0].id,
+            community_partner_user_id=users[1].id, description='Trip')
+        store.session.add(share)
+        store.session.flush()
+        # Event refuses to be created in the past.
+        store.session.execute(Event.__table__.insert(), [
+            {
+                'share_id': share.id,
+                'location': 'School',
+                'date_created': at(DAY_1, 11),
+                'datetime_start': at(date, 14),
+                'datetime_stop': at(date, 15),
+                'active': active,
+            } for date, active in [(DAY_2, True), (DAY_3, True), (DAY_3, False)]
+        ])
+        store.session.add(UserReview(
+            user_id=users[1].id, creator_user_id=users[0].id, event_id=1, rating=5,
+            date_created=at(DAY_3, 10)))
+        store.session.commit()
+
+    def recount(self, first_date, last_date):
+        days = (last_date - first_date).days + 1
+        dates = [first_date + datetime.timedelta(days=n) for n in range(days)]
+        return statistics.derive_statistics(statistics.count_daily_changes(), dates)
+
+    def test_statistics_for_range(self):
+        # Rows inserted straight into their tables are only counted by reconcile.
+        StatisticCounter.reconcile()
+        calculated = Statistic.calculate_statistics_for_range(DAY_1, DAY_3)
+
+        self.assertEqual([DAY_1, DAY_2, DAY_3], list(calculated.keys()))
+        expected = {
+            'n_new_users': [2, 1, 0],
+            'n_total_users': [2, 3, 2],
+            'n_users_active_in_last_month': [None, None, None],
+            'n_users_started_conversation': [0, 1, 0],
+            'n_users_did_event': [0, 2, 4],
+            'n_users_reviewed_event': [0, 0, 1],
+            'n_events_done': [0, 1, 1],
+            'n_total_events_done': [0, 1, 2],
+            'n_upcoming_events': [2, 1, 0],
+        }
+        for name, values in expected.items():
+            self.assertEqual(values, [calculated[date][name] for date in calculated], name)
+
+    def test_query_count_independent_of_range(self):
+        n_queries = []
+        count_query = lambda *args: n_queries.append(1)
+        event.listen(store.engine, 'before_cursor_execute', count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', count_query)
+
+        Statistic.calculate_statistics_for_range(DAY_1, DAY_1)
+        n_one_day = len(n_queries)
+        del n_queries[:]
+        Statistic.calculate_statistics_for_range(DAY_1, DAY_1 + datetime.timedelta(days=365))
+
+        self.assertEqual(n_one_day, len(n_queries))
+
+    def test_reads_counters_not_tables(self):
+        StatisticCounter.reconcile()
+        n_queries = []
+        count_query = lambda conn, cursor, statement, *args: n_queries.append(statement)
+        event.listen(store.engine, 'before_cursor_execute', count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', count_query)
+
+        Statistic.calculate_statistics_for_range(DAY_1, DAY_3)
+        self.assertTrue(n_queries)
+        for statement in n_queries:
+            self.assertIn('statistic_counter', statement)
+
+    def test_update_keeps_stored_statistics_unless_forced(self):
+        StatisticCounter.reconcile()
+        Statistic.update_statistics_for_range(DAY_1, DAY_3)
+        stored = store.session.query(Statistic).filter(Statistic.date == DAY_2)
+        self.assertEqual(8, stored.count())
+
+        stat = stored.filter(Statistic.name == 'n_new_users').one()
+        stat.value = 7
+        store.session.commit()
+        Statistic.update_statistics(DAY_2)
+        self.assertEqual(7, stored.filter(Statistic.name == 'n_new_users').one().value)
+        Statistic.update_statistics(DAY_2, force=True)
+        self.assertEqual(1, stored.filter(Statistic.name == 'n_new_users').one().value)
+        self.assertEqual(8, stored.count())
+
+    def test_report_reads_stored_statistics(self):
+        StatisticCounter.reconcile()
+        statistics.statistics_reports.clear()
+        Statistic.update_statistics_for_range(DAY_1, DAY_2)
+        n_queries = []
+        count_query = lambda *args: n_queries.append(1)
+        event.listen(store.engine, 'before_cursor_execute', count_query)
+        self.addCleanup(event.remove, store.engine, 'before_cursor_execute', count_query)
+
+        report = Statistic.get_report(DAY_1, DAY_3)
+        self.assertEqual(1, len(n_queries))
+        self.assertEqual({}, report[DAY_3])
+        self.assertEqual(1, report[DAY_2]['n_new_users'])
+        self.assertIs(report, Statistic.get_report(DAY_1, DAY_3))
+        self.assertEqual(1, len(n_queries))
+
+        Statistic.update_statistics(DAY_3)
+        self.assertEqual(0, Statistic.get_report(DAY_1, DAY_3)[DAY_3]['n_new_users'])
+
+    def assert_counters_match_tables(self):
+        expected = self.recount(DAY_1, DAY_3)
+        for date, counted in expected.items():
+            del counted['n_users_active_in_last_month']
+            self.assertEqual(counted, Statistic.get_statistics(date), date)
+
+    def test_reconcile_fills_counters(self):
+        self.assertEqual(0, Statistic.get_statistics(DAY_2)['n_users_did_event'])
+
+        self.assertGreater(StatisticCounter.reconcile(), 0)
+        self.assert_counters_match_tables()
+        self.assertEqual(0, StatisticCounter.reconcile())
+
+    def test_reconcile_is_not_fooled_by_commits_while_it_runs(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        url = 'sqlite:///' + os.path.join(directory.name, 'statistics.db')
+        file_store = mock.Mock()
+        file_store.engine = create_engine(url)
+        file_store.session = sessionmaker(bind=file_store.engine)()
+        self.addCleanup(file_store.session.close)
+        Base.metadata.create_all(file_store.engine)
+        patcher = mock.patch.object(statistics, 'store', file_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        other_session = sessionmaker(bind=create_engine(url))()
+        self.addCleanup(other_session.close)
+        errors = []
+
+        def add_user():
+            try:
+                other_session.add(User(name='D', email='d@example.com', date_created=at(DAY_3, 9)))
+                other_session.commit()
+            except Exception as e:
+                errors.append(e)
+
+        # Commit a user between the recount and the read of the counters.
+        adder = threading.Thread(target=add_user)
+        count_daily_changes = statistics.count_daily_changes
+
+        def count_then_add_user():
+            counts = count_daily_changes()
+            adder.start()
+            adder.join(0.5)
+            return counts
+
+        with mock.patch.object(statistics, 'count_daily_changes', count_then_add_user):
+            self.assertEqual(0, StatisticCounter.reconcile())
+        adder.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(1, Statistic.get_statistics(DAY_3)['n_new_users'])
+        self.assertEqual(0, StatisticCounter.reconcile())
+
+    def test_counters_follow_flushed_rows(self):
+        StatisticCounter.reconcile()
+        user = User(name='D', email='d@example.com', date_created=at(DAY_3, 9))
+        store.session.add(user)
+        store.session.commit()
+        self.assertEqual(1, Statistic.get_statistics(DAY_3)['n_new_users'])
+
+        user.date_created = at(DAY_2, 9)
+        store.session.query(User).filter_by(name='A').one().date_inactivated = at(DAY_2, 20)
+        store.session.query(Event).filter_by(id=1).one().active = False
+        store.session.query(Conversation).one().date_created = at(DAY_3, 12)
+        store.session.commit()
+
+        self.assert_counters_match_tables()
+        self.assertEqual(0, StatisticCounter.reconcile())
+
+    def test_rolled_back_rows_are_not_counted(self):
+        StatisticCounter.reconcile()
+        store.session.add(User(name='D', email='d@example.com', date_created=at(DAY_3, 9)))
+        store.session.flush()
+        store.session.rollback()
+
+        self.assertEqual(0, Statistic.get_statistics(DAY_3)['n_new_users'])
+
+
+if __name__ == '__main__':
+    unittest.main()
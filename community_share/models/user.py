@@ -58,6 +58,7 @@ class User(Base, Serializable):
         'ethnicity',
         'bio',
         'picture_url',
+        'picture_urls',
         'email_confirmed',
         'active',
         'educator_profile_search',
@@ -84,6 +85,7 @@ class User(Base, Serializable):
         'ethnicity',
         'bio',
         'picture_url',
+        'picture_urls',
         'email_confirmed',
         'active',
         'educator_profile_search',
@@ -196,8 +198,12 @@ class User(Base, Serializable):
         output = None
         error_messages = self.is_password_valid(password)
         if not error_messages:
+            # Importing here to prevent circular reference
+            from community_share.authorization import invalidate_login_cache
             password_hash = User.pwd_context.encrypt(password)
             self.password_hash = password_hash
+            if self.id is not None:
+                invalidate_login_cache(self.id)
         return error_messages
 
     def __repr__(self):
@@ -243,13 +249,33 @@ class User(Base, Serializable):
             url = config.UPLOAD_LOCATION + self.picture_filename
         return url
 
+    def serialize_picture_urls(self, requester):
+        """Thumbnail URLs by size, for pages showing many users"""
+        urls = {}
+        if (config.UPLOAD_LOCATION is not None) and self.picture_filename:
+            # Importing here, so that the models do not need PIL
+            from community_share.picture_utils import picture_urls, thumbnails_exist
+            urls = picture_urls(
+                config.UPLOAD_LOCATION,
+                self.picture_filename,
+                thumbnails_exist(self.picture_filename),
+            )
+        return urls
+
     custom_serializers = {
         'institution_associations': serialize_institution_associations,
         'picture_url': serialize_picture_url,
+        'picture_urls': serialize_picture_urls,
         'educator_profile_search': serialize_educator_profile_search,
         'community_partner_profile_search': serialize_community_partner_profile_search,
     }
 
+    SERIALIZED_RELATIONSHIPS = {
+        'institution_associations': [],
+        'educator_profile_search': ['searcher_user'],
+        'community_partner_profile_search': ['searcher_user'],
+    }
+
     def deserialize_bio(self, bio):
         BIO_LIMIT = 1000
         if bio != None:
@@ -305,7 +331,9 @@ class User(Base, Serializable):
     def on_delete(self, requester):
         # Importing here to prevent circular reference
         from community_share import mail_actions
+        from community_share.authorization import invalidate_login_cache
         from community_share.models.share import Event, Share
+        invalidate_login_cache(self.id)
         mail_actions.send_account_deletion_message(self)
         # Delete all upcoming events.
         upcoming_events = store.session.query(Event).filter(
@@ -357,6 +385,8 @@ class User(Base, Serializable):
 
     @classmethod
     def activate_email(cls, user=None):
+        # Importing here to prevent circular reference
+        from community_share.search_index import search_index
         if not user:
             store.session \
                 .query(User) \
@@ -364,6 +394,8 @@ class User(Base, Serializable):
                 .filter(User.email_confirmed==False) \
                 .update({'email_confirmed': True})
             store.session.commit()
+            # Bulk updates are not seen by the index's flush listener.
+            search_index.invalidate()
 
     @classmethod
     def dump_csv(cls):
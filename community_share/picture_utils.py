@@ -1,22 +1,89 @@
+import datetime
 import hashlib
 import imghdr
+import logging
+import os
+import re
+import tempfile
+from collections import OrderedDict, namedtuple
+from typing import Dict, FrozenSet
 
-from community_share.s3_connection import save_file_to_s3
+from PIL import Image
+
+from community_share import store
+from community_share.cache import TTLCache
+from community_share.models.picture import PictureObject
+from community_share.s3_connection import s3_uploader
+
+logger = logging.getLogger(__name__)
 
 allowable_types = ['gif', 'jpeg', 'png']
 
+CHUNK_SIZE = 64 * 1024
+# imghdr only looks at this much of the start of a file.
+HEADER_SIZE = 32
+
+# Longest side of each thumbnail made of an uploaded picture, in pixels.
+THUMBNAIL_SIZES = [64, 160, 480]
+THUMBNAIL_QUALITY = 85
+# Transparent pictures are flattened onto this, as JPEG has no alpha.
+THUMBNAIL_BACKGROUND = (255, 255, 255)
+
+# Pictures uploaded by users, named after the hash of their content.
+# Pictures used to be named after their user as well.
+UPLOADED_FILENAME_PATTERN = re.compile(r'^(picture|user_\d+)_(?P<sha1>[0-9a-f]{40})\.\w+$')
+
+# Pictures uploaded by other processes are shown at full size until this
+# process notices their thumbnails, after at most this long.
+THUMBNAILED_PICTURES_TTL = 300  # seconds
+
+thumbnailed_pictures = TTLCache(max_size=1, ttl=THUMBNAILED_PICTURES_TTL)
+
+# A picture is only deleted once no user has referred to it for this long.
+UNREFERENCED_PICTURE_GRACE = datetime.timedelta(days=1)
+
+# An upload copied to the local file `path`.
+StagedImage = namedtuple('StagedImage', ['path', 'header', 'sha1', 'size'])
+
 
 def get_image_type(image_data):
     return imghdr.what('ignored', h=image_data)
 
 
-def image_to_user_filename(image_data, user_id):
-    image_type = get_image_type(image_data)
+def stage_image(stream):
+    """
+    Copy an uploaded image to a temporary file, a chunk at a time,
+    hashing it on the way
+
+    The caller must pass the file on to `store_image` or remove it.
+    """
+    sha1 = hashlib.sha1()
+    header = b''
+    size = 0
+    with tempfile.NamedTemporaryFile(prefix='picture_', delete=False) as staged:
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                if len(header) < HEADER_SIZE:
+                    header += chunk[:HEADER_SIZE - len(header)]
+                sha1.update(chunk)
+                staged.write(chunk)
+                size += len(chunk)
+        except Exception:
+            os.remove(staged.name)
+            raise
+    return StagedImage(staged.name, header, sha1.hexdigest(), size)
+
+
+def image_to_filename(image):
+    """
+    Name of a picture in the bucket, which depends only on its content,
+    so users uploading the same picture share it
+    """
+    image_type = get_image_type(image.header)
 
-    return 'user_{0:d}_{1}.{2}'.format(
-        user_id,
-        hashlib.sha1(image_data).hexdigest(),
-        image_type if image_type is not 'jpeg' else 'jpg',
+    return 'picture_{0}.{1}'.format(
+        image.sha1,
+        image_type if image_type != 'jpeg' else 'jpg',
     )
 
 
@@ -26,8 +93,216 @@ def is_allowable_image(image_data):
     return get_image_type(image_data) in allowable_types
 
 
-def store_image(src_filename, dst_filename):
+def thumbnail_filename(picture_filename, size):
+    """
+    Name of the thumbnail of a picture
+
+    The picture's name holds the hash of its content, so the same
+    picture always has the same thumbnails.
+    """
+    stem = picture_filename.rsplit('.', 1)[0]
+    return '{}_{}.jpg'.format(stem, size)
+
+
+def pictures_with_thumbnails() -> FrozenSet[str]:
+    """
+    Filenames of the pictures whose thumbnails are uploaded
+
+    Cached for the process, as it is needed for every user serialized.
+    """
+    filenames = thumbnailed_pictures.get('filenames')
+    if filenames is None:
+        filenames = PictureObject.with_thumbnails(store.session)
+        thumbnailed_pictures.set('filenames', filenames)
+    return filenames
+
+
+def thumbnails_exist(picture_filename) -> bool:
+    """
+    Whether the picture `picture_filename` has thumbnails, according to
+    the manifest
+
+    Sample pictures, pictures uploaded before there were thumbnails
+    and not yet backfilled, and pictures no thumbnails could be made of
+    have none.
+    """
+    return picture_filename in pictures_with_thumbnails()
+
+
+def picture_urls(base_url, picture_filename, has_thumbnails):
+    """
+    URL of each size of a picture, and of the original
+
+    Every size of a picture without thumbnails is the original.
+    """
+    original = base_url + picture_filename
+    urls = OrderedDict()
+    for size in THUMBNAIL_SIZES:
+        if has_thumbnails:
+            urls[str(size)] = base_url + thumbnail_filename(picture_filename, size)
+        else:
+            urls[str(size)] = original
+    urls['original'] = original
+    return urls
+
+
+def make_thumbnails(src_filename) -> Dict[int, str]:
+    """
+    Write a JPEG thumbnail of the picture in `src_filename` for each of
+    `THUMBNAIL_SIZES` to a temporary file
+
+    Pictures are scaled down to fit, keeping their shape, and never
+    scaled up.
+
+    :return: the temporary file of each size
+    """
+    thumbnails = {}
+    with Image.open(src_filename) as image:
+        # JPEGs can be decoded straight to a smaller scale.
+        image.draft('RGB', (max(THUMBNAIL_SIZES), max(THUMBNAIL_SIZES)))
+        image = flatten(image)
+        try:
+            # Each size is scaled from the next larger one.
+            for size in sorted(THUMBNAIL_SIZES, reverse=True):
+                image.thumbnail((size, size), Image.LANCZOS)
+                with tempfile.NamedTemporaryFile(
+                        prefix='thumbnail_', suffix='.jpg', delete=False) as thumbnail:
+                    thumbnails[size] = thumbnail.name
+                    image.save(
+                        thumbnail,
+                        'JPEG',
+                        quality=THUMBNAIL_QUALITY,
+                        optimize=True,
+                        progressive=True,
+                    )
+        except Exception:
+            for filename in thumbnails.values():
+                os.remove(filename)
+            raise
+    return thumbnails
+
+
+def flatten(image):
+    """`image` in RGB, with any transparency on `THUMBNAIL_BACKGROUND`"""
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, THUMBNAIL_BACKGROUND)
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def upload_thumbnail_files(thumbnails, dst_filename):
+    """
+    Upload the thumbnails made by `make_thumbnails`, removing them
+
+    :return: whether every one was uploaded
+    """
+    uploaded = True
+    for size, filename in sorted(thumbnails.items()):
+        uploaded &= s3_uploader.upload(filename, thumbnail_filename(dst_filename, size))
+    return uploaded
+
+
+def upload_picture(src_filename, dst_filename, sha1):
+    """
+    Upload a staged picture and its thumbnails, and record in the
+    manifest that it is uploaded
+
+    The staged picture is removed once it is uploaded, and otherwise
+    kept for `upload_stale_pictures`.  A picture no thumbnails can be
+    made of is still uploaded, and recorded as having none so that its
+    URLs are all the original.
+
+    :return: whether the picture was uploaded
+    """
+    has_thumbnails = True
+    uploaded = False
     try:
-        save_file_to_s3(src_filename, dst_filename)
-    except:
-        return
+        try:
+            thumbnails = make_thumbnails(src_filename)
+        except (OSError, ValueError) as e:
+            logger.error('Could not make thumbnails of {}: {}'.format(dst_filename, e))
+            thumbnails = {}
+            has_thumbnails = False
+        uploaded = upload_thumbnail_files(thumbnails, dst_filename)
+    finally:
+        uploaded &= s3_uploader.upload(src_filename, dst_filename, remove=False)
+        if uploaded:
+            try:
+                PictureObject.record_uploaded(store.session, sha1, has_thumbnails)
+            finally:
+                store.session.remove()
+            os.remove(src_filename)
+    if uploaded:
+        thumbnailed_pictures.clear()
+    return uploaded
+
+
+def store_image(image, dst_filename):
+    """
+    Upload the staged picture `image` and its thumbnails in the
+    background, unless they are in the bucket already
+
+    :return: whether the picture is being uploaded
+    """
+    try:
+        claimed = PictureObject.claim(store.session, image.sha1, dst_filename, image.size,
+                                      image.path)
+    except Exception:
+        os.remove(image.path)
+        raise
+    if not claimed:
+        logger.info('Picture {} is already uploaded'.format(dst_filename))
+        os.remove(image.path)
+        return False
+    s3_uploader.call(upload_picture, image.path, dst_filename, image.sha1)
+    # Pick up where a previous process on this host left off.
+    s3_uploader.call(upload_stale_pictures)
+    return True
+
+
+def upload_stale_pictures(now=None):
+    """
+    Upload the pictures staged on this host whose upload failed, or
+    was lost with the process making it
+
+    Run by the worker, and by the web processes' uploaders, as only a
+    process on the host a picture was staged on can upload it.
+
+    :return: number of pictures uploaded
+    """
+    n_uploaded = 0
+    try:
+        for sha1, filename, staged_path in PictureObject.stale_uploads(store.session, now):
+            if not os.path.exists(staged_path):
+                continue
+            claimed = PictureObject.claim_stale(store.session, sha1, now)
+            store.session.commit()
+            if not claimed:
+                continue
+            logger.info('Uploading {} again'.format(filename))
+            if upload_picture(staged_path, filename, sha1):
+                n_uploaded += 1
+    finally:
+        store.session.remove()
+    return n_uploaded
+
+
+def delete_unreferenced_pictures(now=None):
+    """
+    Delete the pictures, and their thumbnails, that no user has referred
+    to for `UNREFERENCED_PICTURE_GRACE`
+
+    :return: number of pictures deleted
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    filenames = PictureObject.remove_unreferenced(store.session, now - UNREFERENCED_PICTURE_GRACE)
+    for filename in filenames:
+        for key in [filename] + [thumbnail_filename(filename, size) for size in THUMBNAIL_SIZES]:
+            s3_uploader.delete(key)
+    if filenames:
+        logger.info('Deleted {} unreferenced pictures'.format(len(filenames)))
+    return len(filenames)
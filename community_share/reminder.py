@@ -1,6 +1,6 @@
 import logging
 
-from community_share import store, mail_actions
+from community_share import mail, mail_actions
 from community_share.models import conversation
 from community_share.models.share import EventReminder
 
@@ -15,27 +15,19 @@ def send_reminders():
     events = EventReminder.get_oneday_reminder_events()
     if events:
         logger.info('Sending reminders for {} events'.format(len(events)))
-        event_reminders = [
-            EventReminder(
-                event_id=event.id,
-                typ='oneday_before',
-            ) for event in events
-        ]
-        for reminder in event_reminders:
-            store.session.add(reminder)
-        store.session.commit()
-        for event in events:
-            mail_actions.send_event_reminder_message(event)
+        # The reminders are recorded in the same commit as their mail.
+        with mail.deferred_commit():
+            EventReminder.add_for_events(events, 'oneday_before')
+            for event in events:
+                mail_actions.send_event_reminder_message(event)
 
     # Send review reminder one day after they finish.
     send_review_reminders = False
     events = EventReminder.get_review_reminder_events()
     if events and send_review_reminders:
         logger.info('Sending review reminders for {} events'.format(len(events)))
-        event_reminders = [EventReminder(event_id=event.id, typ='review') for event in events]
-        for reminder in event_reminders:
-            store.session.add(reminder)
-            store.session.commit()
+        with mail.deferred_commit():
+            EventReminder.add_for_events(events, 'review')
             for event in events:
                 users = [event.share.educator, event.share.community_partner]
                 for user in users:
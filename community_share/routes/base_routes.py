@@ -1,14 +1,15 @@
 import logging
 from http import HTTPStatus
 from functools import wraps
+from urllib.parse import urlencode
 
-from flask import jsonify, request, Blueprint
+from flask import Response, Blueprint, json, jsonify, request, stream_with_context
 
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
-from community_share import store
+from community_share import config, store
 from community_share.app_exceptions import BadRequest, Unauthorized, Forbidden, NotFound
-from community_share.utils import StatusCodes, is_integer
+from community_share.utils import StatusCodes, clamped, int_or, is_integer
 from community_share.authorization import get_requesting_user
 from community_share.models.base import ValidationException
 
@@ -62,13 +63,104 @@ def make_server_error_response(message=None):
 
 
 def make_many_response(requester, items):
-    serialized = [item.serialize(requester) for item in items]
-    serialized = [s for s in serialized if s is not None]
+    items = list(items)
+    if items:
+        serialized = type(items[0]).serialize_many(items, requester)
+    else:
+        serialized = []
     response_data = {'data': serialized}
     response = jsonify(response_data)
     return response
 
 
+MAX_PAGE_LIMIT = 1000
+STREAM_CHUNK_SIZE = 200
+
+
+def paginate(query, Item, limit, after_id=None):
+    """
+    Keyset pagination over item ids
+
+    :param query: query for items of class Item
+    :param limit: maximum number of items to return, or None for all
+    :param after_id: only return items with a greater id
+    :return: (items, whether more items follow)
+    """
+    query = query.order_by(None).order_by(Item.id.asc())
+    if after_id is not None:
+        query = query.filter(Item.id > after_id)
+    if limit is None:
+        return query.all(), False
+    items = query.limit(limit + 1).all()
+    return items[:limit], len(items) > limit
+
+
+def make_page_response(requester, items, limit, has_more):
+    serialized = type(items[0]).serialize_many(items, requester) if items else []
+    links = [{'rel': 'self', 'href': request.url}]
+    if has_more:
+        args = request.args.to_dict(flat=False)
+        args.update({'limit': limit, 'after_id': items[-1].id})
+        links.append({
+            'rel': 'next_page',
+            'href': '{0}{1}?{2}'.format(config.BASEURL, request.path, urlencode(args, doseq=True)),
+        })
+    response_data = {'data': serialized, 'links': links}
+    response = jsonify(response_data)
+    return response
+
+
+def make_streamed_response(requester, Item, query, after_id=None):
+    """
+    Streams items as JSON, loading and serializing them in chunks so
+    that memory use does not grow with the size of the table.
+    """
+
+    def generate():
+        last_id = after_id
+        separator = ''
+        yield '{"data": ['
+        while True:
+            items, has_more = paginate(query, Item, STREAM_CHUNK_SIZE, last_id)
+            serialized = Item.serialize_many(items, requester)
+            if serialized:
+                yield separator + ', '.join(json.dumps(s) for s in serialized)
+                separator = ', '
+            if not has_more:
+                break
+            last_id = items[-1].id
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def make_query_response(requester, Item, query):
+    """
+    Responds with the items matched by a query
+
+    Without a `limit` argument every item is returned, or every item
+    after `after_id` in id order.  With one, items are returned a page
+    at a time in id order, starting after `after_id`, along with a link
+    to the next page.  Administrators may pass `stream=true` to have
+    every item streamed in chunks.
+    """
+    after_id = int_or(request.args.get('after_id'), None)
+    if request.args.get('stream', 'false') == 'true':
+        if requester is None or not requester.is_administrator:
+            raise Forbidden('Only administrators may stream results')
+        response = make_streamed_response(requester, Item, query, after_id)
+    elif 'limit' in request.args:
+        limit = clamped(1, MAX_PAGE_LIMIT, int_or(request.args.get('limit'), MAX_PAGE_LIMIT))
+        items, has_more = paginate(query, Item, limit, after_id)
+        response = make_page_response(requester, items, limit, has_more)
+    elif after_id is not None:
+        items, _ = paginate(query, Item, None, after_id)
+        response = make_many_response(requester, items)
+    else:
+        response = make_many_response(requester, query.all())
+    return response
+
+
 def make_single_response(requester, item, include_user=None):
     '''
     Sometimes we want to include the current user info in the response
@@ -111,8 +203,7 @@ def make_blueprint(Item, resource_name):
                         if query is None:
                             raise Forbidden()
                         else:
-                            items = query.all()
-                            response = make_many_response(requester, items)
+                            response = make_query_response(requester, Item, query)
                     except ValueError as e:
                         raise BadRequest(', '.join(e.args))
                 else:
@@ -120,8 +211,7 @@ def make_blueprint(Item, resource_name):
             else:
                 try:
                     query = Item.args_to_query(request.args, requester)
-                    items = query.all()
-                    response = make_many_response(requester, items)
+                    response = make_query_response(requester, Item, query)
                 except ValueError as e:
                     raise BadRequest(', '.join(e.args))
         return response
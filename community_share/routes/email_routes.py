@@ -2,8 +2,8 @@ import logging
 
 from flask import request
 
-from community_share.models.conversation import Message
-from community_share.mail import Email, get_mailer
+from community_share.models.conversation import Message, load_participants
+from community_share.mail import Email, deferred_commit, get_mailer
 from community_share.mail_actions import append_conversation_link
 from community_share import config, store
 from community_share.routes import base_routes
@@ -24,34 +24,37 @@ def register_email_routes(app):
         email = Email.from_mailgun_data(request.values, verify=verify)
         logger.info('Received an email with content "{}"'.format(email.content))
 
-        message = None
-        message_id = Message.process_from_address(email.to_address)
-        if message_id is not None:
-            message = store.session.query(Message).filter_by(id=message_id).first()
-        if message is None:
+        target = Message.find_reply_target(email.to_address)
+        if target is None:
             logger.warning('Received an email but did not find corresponding message.')
         else:
             logger.debug('Creating a new email to send')
-            # Create a new message
-            new_message = Message(
-                conversation_id=message.conversation_id,
-                sender_user_id=message.receiver_user().id,
-                content=email.new_content,
-            )
-            store.session.add(new_message)
-            store.session.commit()
-            # Create an email to send to the recipient
-            forward_to_address = message.sender_user.email
-            forward_from_address = new_message.generate_from_address()
-            forward_content = append_conversation_link(email.content, message.conversation)
-            forward_new_content = append_conversation_link(email.new_content, message.conversation)
-            forward_email = Email(
-                from_address=forward_from_address,
-                to_address=forward_to_address,
-                subject=email.subject,
-                content=forward_content,
-                new_content=forward_new_content,
-            )
-            error_message = get_mailer().send(forward_email)
+            sender, receiver = load_participants(target)
+            # The message and the email forwarding it are committed together.
+            with deferred_commit():
+                # Create a new message
+                new_message = Message(
+                    conversation_id=target.conversation_id,
+                    sender_user_id=target.receiver_id,
+                    content=email.new_content,
+                )
+                store.session.add(new_message)
+                store.session.flush()
+                # Create an email to send to the recipient
+                forward_to_address = sender.email
+                forward_from_address = Message.generate_reply_from_address(
+                    target, new_message.id, receiver.name)
+                forward_content = append_conversation_link(email.content, target.conversation_id)
+                forward_new_content = append_conversation_link(
+                    email.new_content, target.conversation_id)
+                forward_email = Email(
+                    from_address=forward_from_address,
+                    to_address=forward_to_address,
+                    subject=email.subject,
+                    content=forward_content,
+                    new_content=forward_new_content,
+                )
+                idempotency_key = 'message-{}'.format(new_message.id)
+                error_message = get_mailer().send(forward_email, idempotency_key=idempotency_key)
         response = base_routes.make_OK_response()
         return response
@@ -1,12 +1,19 @@
-from flask import jsonify
+from http import HTTPStatus
+
+from flask import jsonify, request
 
 from community_share.models.search import Search, Label
+from community_share.search_index import RANK_BY_LABELS, RANKINGS
 from community_share import search_utils, store
 from community_share.routes import base_routes
 from community_share.authorization import get_requesting_user
 from community_share.utils import is_integer
 
 
+# Browsers check for new labels after this long.
+LABELS_MAX_AGE = 60  # seconds
+
+
 def register_search_routes(app):
 
     search_blueprint = base_routes.make_blueprint(Search, 'search')
@@ -14,34 +21,39 @@ def register_search_routes(app):
 
     @app.route('/api/labels')
     def get_labels():
-        labels = store.session.query(Label).filter(Label.active == True).all()
-        labelnames = [label.name for label in labels]
-        response_data = {'data': labelnames}
-        response = jsonify(response_data)
+        catalogue = Label.get_catalogue()
+        if request.if_none_match.contains(catalogue.etag):
+            response = app.response_class(status=HTTPStatus.NOT_MODIFIED)
+        else:
+            response_data = {'data': list(catalogue.names)}
+            response = jsonify(response_data)
+        response.set_etag(catalogue.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = LABELS_MAX_AGE
         return response
 
     @app.route('/api/search/<id>/<page>/results', methods=['GET'])
     def get_search_results(id, page):
         page = int(page)
+        rank_by = request.args.get('rank_by', RANK_BY_LABELS)
         requester = get_requesting_user()
         if requester is None:
             response = base_routes.make_not_authorized_response()
         elif not is_integer(id):
             response = base_routes.make_bad_request_response()
+        elif rank_by not in RANKINGS:
+            response = base_routes.make_bad_request_response(
+                'rank_by must be one of {}'.format(', '.join(RANKINGS)))
         else:
             search = store.session.query(Search).filter_by(id=id).first()
             if search is None:
                 response = base_routes.make_not_found_response()
             else:
                 if search.has_admin_rights(requester):
-                    matching_searches = search_utils.find_matching_searches(search, page)
-
-                    serialized = [
-                        search.serialize(
-                            requester,
-                            exclude=[],
-                        ) for search in matching_searches
-                    ]
+                    matching_searches = search_utils.find_matching_searches(
+                        search, page, rank_by=rank_by)
+
+                    serialized = Search.serialize_many(matching_searches, requester)
                     response_data = {'data': serialized}
                     response = jsonify(response_data)
                 else:
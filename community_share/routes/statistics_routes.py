@@ -1,11 +1,11 @@
 import logging
 import datetime
 
-from flask import jsonify
+from flask import jsonify, request
 
 from community_share.authorization import get_requesting_user
 from community_share import store, time_format
-from community_share.models.statistics import Statistic
+from community_share.models.statistics import MAX_REPORT_DAYS, STATISTICS_WINDOW, Statistic
 from community_share.routes import base_routes
 
 
@@ -28,6 +28,17 @@ def get_new_user_statistics():
 logger = logging.getLogger(__name__)
 
 
+def parse_date(value):
+    """
+    Date from either YYYY-MM-DD or the ISO 8601 timestamps the
+    statistics are keyed by
+    """
+    try:
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
 def register_statistics_routes(app):
     @app.route('/api/statistics', methods=['GET'])
     def statistics():
@@ -38,10 +49,23 @@ def register_statistics_routes(app):
             response = base_routes.make_forbidden_response()
         else:
             yesterday = Statistic.date_yesterday()
-            response_data = {'data': {}}
-            for days_ago in range(30):
-                date = yesterday - datetime.timedelta(days=days_ago)
-                stats = Statistic.get_statistics(date)
-                response_data['data'][time_format.to_iso8601(date)] = stats
-            response = jsonify(response_data)
+            end = parse_date(request.args.get('end', yesterday.isoformat()))
+            if end is not None:
+                default_start = end - datetime.timedelta(days=STATISTICS_WINDOW - 1)
+                start = parse_date(request.args.get('start', default_start.isoformat()))
+            else:
+                start = None
+            if start is None or end is None:
+                response = base_routes.make_bad_request_response(
+                    'start and end must be dates formatted as YYYY-MM-DD')
+            elif not (0 <= (end - start).days < MAX_REPORT_DAYS):
+                response = base_routes.make_bad_request_response(
+                    'start must be before end and at most {} days earlier'.format(
+                        MAX_REPORT_DAYS - 1))
+            else:
+                report = Statistic.get_report(start, end)
+                response_data = {'data': {}}
+                for date, stats in report.items():
+                    response_data['data'][time_format.to_iso8601(date)] = stats
+                response = jsonify(response_data)
         return response
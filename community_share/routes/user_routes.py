@@ -1,4 +1,5 @@
 import logging
+import os
 
 from flask import Response, request, jsonify, make_response
 
@@ -12,7 +13,12 @@ from community_share.picture_utils import allowable_types as picture_types, get_
 from community_share.models.base import ValidationException
 from community_share.models.institution import Institution
 from community_share.models.user import User, UserReview
-from community_share.picture_utils import image_to_user_filename, is_allowable_image, store_image
+from community_share.picture_utils import (
+    image_to_filename,
+    is_allowable_image,
+    stage_image,
+    store_image,
+)
 from community_share.routes import base_routes
 
 logger = logging.getLogger(__name__)
@@ -175,9 +181,10 @@ def register_user_routes(app):
                 'image data as the request parameter named "file".'
             )
 
-        image_data = image_file.read()
-        if not is_allowable_image(image_data):
-            image_type = get_image_type(image_data)
+        image = stage_image(image_file.stream)
+        if not is_allowable_image(image.header):
+            os.remove(image.path)
+            image_type = get_image_type(image.header)
 
             if image_type is None:
                 reason = 'Could not infer type of image.'
@@ -194,9 +201,10 @@ def register_user_routes(app):
                 )
             )
 
-        filename = image_to_user_filename(image_data, user_id)
+        filename = image_to_filename(image)
 
-        store_image(image_file, filename)
+        # Returns once the upload is queued; it is sent to S3 in the background.
+        store_image(image, filename)
 
         requester.picture_filename = filename
         store.session.add(requester)
@@ -1,14 +1,154 @@
+"""Uploads to the S3 bucket holding user pictures
+
+Requests only stage a file on local disk and hand it to
+`s3_uploader`, whose thread uploads it in the background, retrying
+failures a few times.  Every upload goes over the same HTTP session,
+so the connection to S3 is kept alive between them.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable
+from urllib.parse import quote
+
+import requests
 import tinys3
+from tinys3.request_factory import DeleteRequest, UploadRequest
 
 from community_share import config
 
+logger = logging.getLogger(__name__)
+
+S3_URL = 'https://{bucket}.s3.amazonaws.com/{key}'
+S3_TIMEOUT = 30  # seconds
+CACHE_EXPIRY = 3600  # seconds
+MAX_ATTEMPTS = 3
+FIRST_RETRY_DELAY = 2  # seconds, doubling after each attempt
+
+s3_session = requests.Session()
+
+
+class PooledRequest(object):
+    """Sends a tinys3 request over `s3_session`"""
+
+    def bucket_url(self, key, bucket):
+        return S3_URL.format(bucket=bucket, key=quote(key.lstrip('/')))
+
+    def adapter(self):
+        return self
+
+    def put(self, url, **kwargs):
+        return s3_session.put(url, timeout=S3_TIMEOUT, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return s3_session.delete(url, timeout=S3_TIMEOUT, **kwargs)
+
+
+class PooledUploadRequest(PooledRequest, UploadRequest):
+    pass
+
+
+class PooledDeleteRequest(PooledRequest, DeleteRequest):
+    pass
+
+
+class S3Uploader(object):
+    def __init__(self) -> None:
+        self._connection = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> tinys3.Connection:
+        if self._connection is None:
+            self._connection = tinys3.Connection(config.S3_USERNAME, config.S3_KEY, tls=True)
+        return self._connection
+
+    def submit(self, src_filename: str, dst_filename: str) -> None:
+        """
+        Upload the local file `src_filename` in the background,
+        removing it once it has been uploaded or given up on
+        """
+        self.call(self.upload, src_filename, dst_filename)
+
+    def call(self, func: Callable[..., Any], *args: Any) -> None:
+        """
+        Call `func(*args)` on the uploader's thread, after the uploads
+        already submitted, e.g. to make files and then upload them
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='s3-uploader', daemon=True)
+                self._thread.start()
+                # Finish the uploads already accepted before exiting.
+                atexit.register(self.join)
+        self._queue.put((func, args))
+
+    def join(self) -> None:
+        """Wait until every submitted file has been uploaded or given up on"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                func(*args)
+            except Exception:
+                # Keep the thread going for the uploads after this one.
+                logger.exception('Background upload task failed')
+            finally:
+                self._queue.task_done()
+
+    def upload(self, src_filename: str, dst_filename: str, remove: bool=True) -> bool:
+        """
+        Upload the local file `src_filename` as `dst_filename`, and
+        remove it unless `remove` is False
+
+        :return: whether the file was uploaded
+        """
+        delay = FIRST_RETRY_DELAY
+        try:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    with open(src_filename, 'rb') as src:
+                        self.connection.run(PooledUploadRequest(
+                            self.connection,
+                            dst_filename,
+                            src,
+                            config.S3_BUCKETNAME,
+                            expires=CACHE_EXPIRY,
+                        ))
+                    logger.info('Uploaded {} to S3'.format(dst_filename))
+                    return True
+                except (requests.RequestException, OSError) as e:
+                    logger.warning('Attempt {} to upload {} failed: {}'.format(
+                        attempt, dst_filename, e))
+                if attempt < MAX_ATTEMPTS:
+                    time.sleep(delay)
+                    delay *= 2
+            logger.error('Giving up uploading {} to S3'.format(dst_filename))
+            return False
+        finally:
+            if remove:
+                os.remove(src_filename)
+
+    def delete(self, dst_filename: str) -> bool:
+        """
+        Delete `dst_filename` from the bucket
+
+        :return: whether it was deleted, or was not there
+        """
+        try:
+            self.connection.run(
+                PooledDeleteRequest(self.connection, dst_filename, config.S3_BUCKETNAME))
+        except requests.RequestException as e:
+            logger.warning('Could not delete {} from S3: {}'.format(dst_filename, e))
+            return False
+        return True
 
-def save_file_to_s3(src_filename, dst_filename):
-    conn = tinys3.Connection(config.S3_USERNAME, config.S3_KEY, tls=True)
 
-    conn.upload(
-        dst_filename,
-        src_filename,
-        config.S3_BUCKETNAME,
-        expires=3600  # cache-expiry = 1 hour
-    )
+s3_uploader = S3Uploader()
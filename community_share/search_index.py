@@ -0,0 +1,409 @@
+"""In-memory label-overlap matching for searches
+
+Keeps an inverted index from lowercased label name to the active
+searches carrying that label, split by (searcher_role,
+searching_for_role), along with the set of users whose searches may
+be matched (active users with a confirmed email).  Matching a search
+is then a matter of summing a handful of posting lists instead of
+grouping a join over the whole `search_label` table.
+
+Searches with a location are also kept in a coarse grid (see
+`community_share.geo`) so that a searcher's `distance` can cut the
+candidates down to nearby searches before any labels are compared.
+
+The index is built from the database on first use and kept up to date
+from the searches and users flushed by this process.  Changes made by
+other processes are picked up when the index is rebuilt, at most
+`REBUILD_INTERVAL` seconds later.
+"""
+import heapq
+import logging
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict, namedtuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from community_share import geo
+from community_share.models.search import (
+    Search,
+    Label,
+    normalize_label_name,
+    search_label_table,
+)
+from community_share.models.user import User
+
+logger = logging.getLogger(__name__)
+
+REBUILD_INTERVAL = 120  # seconds
+
+RANK_BY_LABELS = 'labels'
+RANK_BY_COMBINED = 'combined'
+RANKINGS = (RANK_BY_LABELS, RANK_BY_COMBINED)
+
+# In combined ranking a match this many miles away scores half as
+# much as one next door.  Searches without a location are scored as
+# if they were this far away.
+HALF_SCORE_DISTANCE = 10.0
+
+# Beyond this many grid cells around the searcher it is cheaper to
+# check the distance to every candidate than to look in each cell.
+MAX_NEARBY_CELLS = 2500
+
+IndexedSearch = namedtuple('IndexedSearch', ['roles', 'label_counts', 'user_id', 'location'])
+
+
+class SearchIndex(object):
+    def __init__(self, rebuild_interval: Optional[float]=REBUILD_INTERVAL) -> None:
+        self.rebuild_interval = rebuild_interval
+        # Bumped whenever the outcome of a match may have changed, so it
+        # can be used as part of a cache key for match results.
+        self.version = 0
+        self._lock = threading.RLock()
+        self._reset()
+        self._built_at = None
+
+    def _reset(self):
+        # (searcher_role, searching_for_role) -> label name -> search id -> n labels
+        self._postings = defaultdict(lambda: defaultdict(dict))
+        # (searcher_role, searching_for_role) -> grid cell -> search ids
+        self._cells = defaultdict(lambda: defaultdict(set))
+        # search id -> IndexedSearch
+        self._searches = {}
+        self._eligible_user_ids = set()
+
+    @property
+    def is_built(self) -> bool:
+        return self._built_at is not None
+
+    def is_stale(self) -> bool:
+        if self._built_at is None:
+            return True
+        if self.rebuild_interval is None:
+            return False
+        return time.monotonic() - self._built_at > self.rebuild_interval
+
+    def invalidate(self) -> None:
+        """Force a rebuild before the next match"""
+        with self._lock:
+            self._built_at = None
+            self.version += 1
+
+    def rebuild(self, session) -> None:
+        """Load every active, labelled search from the database"""
+        started = time.monotonic()
+        query = session.query(
+            Search.id,
+            Search.searcher_role,
+            Search.searching_for_role,
+            Search.searcher_user_id,
+            Search.latitude,
+            Search.longitude,
+            func.lower(Label.name),
+        )
+        query = query.join(search_label_table, search_label_table.c.search_id == Search.id)
+        query = query.join(Label, search_label_table.c.label_id == Label.id)
+        query = query.filter(Search.active == True)
+
+        searches = {}
+        for (search_id, searcher_role, searching_for_role, user_id, latitude, longitude,
+             labelname) in query:
+            if search_id not in searches:
+                searches[search_id] = IndexedSearch(
+                    (searcher_role, searching_for_role),
+                    Counter(),
+                    user_id,
+                    geo.location_of(latitude, longitude),
+                )
+            searches[search_id].label_counts[labelname] += 1
+
+        user_ids = session.query(User.id)
+        user_ids = user_ids.filter(User.active == True, User.email_confirmed == True)
+        eligible_user_ids = set(user_id for (user_id, ) in user_ids)
+
+        with self._lock:
+            self._reset()
+            for search_id, indexed in searches.items():
+                self._add_search(search_id, indexed)
+            self._eligible_user_ids = eligible_user_ids
+            self._built_at = time.monotonic()
+            self.version += 1
+
+        logger.info(
+            'Built search index of {} searches in {:.2f}s'
+            .format(len(searches), time.monotonic() - started)
+        )
+
+    def ensure_built(self, session) -> None:
+        if self.is_stale():
+            self.rebuild(session)
+
+    def update_search(
+            self,
+            search_id: int,
+            active: bool,
+            roles: Tuple[str, str],
+            labelnames: Iterable[str],
+            user_id: Optional[int],
+            location: Optional[geo.Location]=None,
+    ) -> None:
+        label_counts = Counter(normalize_label_name(name) for name in labelnames)
+        if active and label_counts:
+            indexed = IndexedSearch(roles, label_counts, user_id, location)
+        else:
+            indexed = None
+        with self._lock:
+            if self._searches.get(search_id) == indexed:
+                return
+            self._remove_search(search_id)
+            if indexed is not None:
+                self._add_search(search_id, indexed)
+            self.version += 1
+
+    def remove_search(self, search_id: int) -> None:
+        with self._lock:
+            if self._remove_search(search_id):
+                self.version += 1
+
+    def update_user(self, user_id: int, eligible: bool) -> None:
+        with self._lock:
+            if eligible == (user_id in self._eligible_user_ids):
+                return
+            if eligible:
+                self._eligible_user_ids.add(user_id)
+            else:
+                self._eligible_user_ids.discard(user_id)
+            self.version += 1
+
+    def _add_search(self, search_id, indexed):
+        if not indexed.label_counts:
+            return
+        postings = self._postings[indexed.roles]
+        for labelname, count in indexed.label_counts.items():
+            postings[labelname][search_id] = count
+        if indexed.location is not None:
+            self._cells[indexed.roles][geo.cell_of(indexed.location)].add(search_id)
+        self._searches[search_id] = indexed
+
+    def _remove_search(self, search_id):
+        indexed = self._searches.pop(search_id, None)
+        if indexed is None:
+            return False
+        postings = self._postings[indexed.roles]
+        for labelname in indexed.label_counts:
+            postings[labelname].pop(search_id, None)
+            if not postings[labelname]:
+                del postings[labelname]
+        if indexed.location is not None:
+            cells = self._cells[indexed.roles]
+            cell = geo.cell_of(indexed.location)
+            cells[cell].discard(search_id)
+            if not cells[cell]:
+                del cells[cell]
+        return True
+
+    def searches_near(
+            self,
+            searcher_role: str,
+            searching_for_role: str,
+            location: geo.Location,
+            distance: float,
+    ) -> Set[int]:
+        """Ids of searches located within `distance` miles of `location`"""
+        with self._lock:
+            cells = self._cells.get((searcher_role, searching_for_role), {})
+            searches = self._searches
+            nearby_cells = self._nearby_cells(cells, location, distance)
+            if nearby_cells is None:
+                nearby_cells = cells.values()
+            return set(
+                search_id
+                for ids in nearby_cells
+                for search_id in ids
+                if self._is_within(location, distance, searches[search_id])
+            )
+
+    def count_matches(
+            self,
+            labelnames: Iterable[str],
+            searcher_role: str,
+            searching_for_role: str,
+            near: Optional[geo.Location]=None,
+            within: Optional[float]=None,
+    ) -> Dict[int, int]:
+        """
+        Number of matching labels for every search with at least one
+
+        :param near: location of the searcher
+        :param within: only count searches this many miles from `near`;
+            searches without a location are left out
+        """
+        labelnames = set(normalize_label_name(name) for name in labelnames)
+        roles = (searcher_role, searching_for_role)
+        with self._lock:
+            searches = self._searches
+            postings = self._postings.get(roles, {})
+            label_postings = [postings[labelname] for labelname in labelnames if labelname in postings]
+            is_located = near is not None and within is not None
+            if is_located:
+                nearby_cells = self._nearby_cells(self._cells.get(roles, {}), near, within)
+            else:
+                nearby_cells = None
+
+            # Count labels for whichever is smaller: the searches in the
+            # cells around the searcher or the searches with any of the labels.
+            if nearby_cells is not None and (
+                    sum(len(ids) for ids in nearby_cells) <
+                    sum(len(ids) for ids in label_postings)):
+                matches = {}
+                for ids in nearby_cells:
+                    for search_id in ids:
+                        label_counts = searches[search_id].label_counts
+                        shared = labelnames.intersection(label_counts)
+                        if shared:
+                            matches[search_id] = sum(label_counts[name] for name in shared)
+            else:
+                matches = Counter()
+                for ids in label_postings:
+                    matches.update(ids)
+
+            eligible_user_ids = self._eligible_user_ids
+            return {
+                search_id: n_matches
+                for search_id, n_matches in matches.items()
+                if searches[search_id].user_id in eligible_user_ids and (
+                    not is_located or
+                    self._is_within(near, within, searches[search_id]))
+            }
+
+    @staticmethod
+    def _nearby_cells(cells, near, within):
+        """
+        Searches in each occupied cell around `near`, or None when
+        there are too many cells to look in
+        """
+        if geo.n_cells_within(near, within) > MAX_NEARBY_CELLS:
+            return None
+        return [cells[cell] for cell in geo.cells_within(near, within) if cell in cells]
+
+    @staticmethod
+    def _is_within(near, within, indexed):
+        return (
+            indexed.location is not None and
+            geo.distance_between(near, indexed.location) <= within
+        )
+
+    def ranked_matches(
+            self,
+            labelnames: Iterable[str],
+            searcher_role: str,
+            searching_for_role: str,
+            near: Optional[geo.Location]=None,
+            within: Optional[float]=None,
+            rank_by: str=RANK_BY_LABELS,
+            limit: Optional[int]=None,
+    ) -> List[int]:
+        """
+        Ids of matching searches, best match first
+
+        Ties are broken by search id so that paging is stable.
+
+        :param near: location of the searcher
+        :param within: only rank searches this many miles from `near`
+        :param rank_by: `RANK_BY_LABELS` to rank by the number of
+            matching labels alone, `RANK_BY_COMBINED` to also favour
+            searches close to `near`
+        :param limit: only rank the top `limit` searches
+        """
+        with self._lock:
+            matches = self.count_matches(
+                labelnames, searcher_role, searching_for_role, near=near, within=within)
+            if rank_by == RANK_BY_COMBINED and near is not None:
+                searches = self._searches
+                scores = {
+                    search_id: n_matches / (1 + self._distance(near, searches[search_id]) /
+                                            HALF_SCORE_DISTANCE)
+                    for search_id, n_matches in matches.items()
+                }
+            else:
+                scores = matches
+        key = lambda item: (-item[1], item[0])
+        if limit is None:
+            ranked = sorted(scores.items(), key=key)
+        else:
+            ranked = heapq.nsmallest(limit, scores.items(), key=key)
+        return [search_id for search_id, _ in ranked]
+
+    @staticmethod
+    def _distance(near, indexed):
+        if indexed.location is None:
+            return HALF_SCORE_DISTANCE
+        return geo.distance_between(near, indexed.location)
+
+    def top_matches(
+            self,
+            labelnames: Iterable[str],
+            searcher_role: str,
+            searching_for_role: str,
+            offset: int=0,
+            limit: int=10,
+            **kwargs
+    ) -> List[int]:
+        """
+        One page of `ranked_matches`, taking the same keyword arguments
+        """
+        ranked = self.ranked_matches(
+            labelnames,
+            searcher_role,
+            searching_for_role,
+            limit=offset + limit,
+            **kwargs
+        )
+        return ranked[offset:offset + limit]
+
+
+search_index = SearchIndex()
+
+# Changes flushed by each session, applied once it commits.
+_pending_changes = weakref.WeakKeyDictionary()
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    """Note the searches and users flushed so the index can follow them on commit"""
+    changes = _pending_changes.setdefault(session, [])
+    for obj in session.deleted:
+        if isinstance(obj, Search):
+            changes.append(('remove_search', (obj.id, )))
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Search):
+            changes.append((
+                'update_search',
+                (
+                    obj.id,
+                    obj.active,
+                    (obj.searcher_role, obj.searching_for_role),
+                    [label.name for label in obj.labels],
+                    obj.searcher_user_id,
+                    geo.location_of(obj.latitude, obj.longitude),
+                ),
+            ))
+        elif isinstance(obj, User):
+            eligible = bool(obj.active) and bool(obj.email_confirmed)
+            changes.append(('update_user', (obj.id, eligible)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = _pending_changes.pop(session, [])
+    if search_index.is_built:
+        for method_name, args in changes:
+            getattr(search_index, method_name)(*args)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    _pending_changes.pop(session, None)
@@ -1,9 +1,19 @@
-from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import desc, func
 
-from community_share.models.search import Search, Label
+from community_share.models.search import Search, Label, normalize_label_name
 from community_share.models.user import User
+from community_share import geo
+from community_share.cache import TTLCache
+from community_share.search_index import RANK_BY_LABELS, search_index
 from community_share import store
 
+MATCH_CACHE_SIZE = 1024
+MATCH_CACHE_TTL = 600
+
+# (label names, searcher role, searching for role, location, distance, ranking, index version)
+#  -> ranked search ids
+match_cache = TTLCache(MATCH_CACHE_SIZE, MATCH_CACHE_TTL)
+
 
 def get_searches_ordered_by_label_matches(
         labels,
@@ -11,8 +21,90 @@ def get_searches_ordered_by_label_matches(
         searching_for_role,
         offset_number=0,
         max_number=10,
+        near=None,
+        within=None,
+        rank_by=RANK_BY_LABELS,
 ):
 
+    if offset_number > 0:
+        offset_number *= max_number
+    offset_number = max(offset_number, 0)
+
+    search_ids = get_ranked_search_ids(
+        labels,
+        searcher_role,
+        searching_for_role,
+        near=near,
+        within=within,
+        rank_by=rank_by,
+    )
+    return get_searches_in_order(search_ids[offset_number:offset_number + max_number])
+
+
+def get_ranked_search_ids(
+        labels,
+        searcher_role,
+        searching_for_role,
+        near=None,
+        within=None,
+        rank_by=RANK_BY_LABELS,
+):
+    """
+    Ids of every search matching `labels`, best match first
+
+    The full ranking is cached so that later pages are slices of it.
+    Entries are keyed on the index version and so are never served
+    once a search or user has changed; they are dropped as soon as a
+    ranking for a newer version is cached.
+    """
+    search_index.ensure_built(store.session)
+    labelnames = frozenset(normalize_label_name(label.name) for label in labels)
+    key = (
+        labelnames,
+        searcher_role,
+        searching_for_role,
+        near,
+        within,
+        rank_by,
+        search_index.version,
+    )
+    search_ids = match_cache.get(key)
+    if search_ids is None:
+        search_ids = tuple(
+            search_index.ranked_matches(
+                labelnames,
+                searcher_role,
+                searching_for_role,
+                near=near,
+                within=within,
+                rank_by=rank_by,
+            )
+        )
+        match_cache.discard_where(lambda cached_key, _: cached_key[-1] < key[-1])
+        match_cache.set(key, search_ids)
+    return search_ids
+
+
+def get_searches_in_order(search_ids):
+    if not search_ids:
+        return []
+    searches = store.session.query(Search).filter(Search.id.in_(search_ids)).all()
+    searches_by_id = {search.id: search for search in searches}
+    return [searches_by_id[search_id] for search_id in search_ids if search_id in searches_by_id]
+
+
+def query_searches_ordered_by_label_matches(
+        labels,
+        searcher_role,
+        searching_for_role,
+        offset_number=0,
+        max_number=10,
+):
+    """
+    Database equivalent of `get_searches_ordered_by_label_matches`,
+    kept to check the search index against.
+    """
+
     if offset_number > 0:
         offset_number *= max_number
 
@@ -27,17 +119,27 @@ def get_searches_ordered_by_label_matches(
     query = query.filter(User.email_confirmed == True)
     query = query.filter(User.active == True)
     query = query.group_by(Search.id)
-    query = query.order_by('matches DESC')
+    query = query.order_by(desc('matches'), Search.id)
     searches_and_count = query.offset(offset_number).limit(max_number)
     searches = [sc[0] for sc in searches_and_count]
     return searches
 
 
-def find_matching_searches(search, page):
+def find_matching_searches(search, page, rank_by=RANK_BY_LABELS):
+    """
+    Searches complementing `search`, one page at a time
+
+    When `search` has a location and a distance, searches further than
+    `distance` miles away are left out.
+    """
+    near = geo.location_of(search.latitude, search.longitude)
     searches = get_searches_ordered_by_label_matches(
         search.labels,
         searcher_role=search.searching_for_role,
         searching_for_role=search.searcher_role,
         offset_number=page,
+        near=near,
+        within=search.distance if near is not None else None,
+        rank_by=rank_by,
     )
     return searches
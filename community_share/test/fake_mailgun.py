@@ -0,0 +1,105 @@
+"""A local stand-in for the Mailgun messages API
+
+Accepts `POST /<domain>/messages` like Mailgun does, keeping one
+message for every recipient of an accepted request with its
+recipient variables filled in.  Tests can make it answer the next
+requests with an error status, reject some addresses, or stall, to
+exercise retries.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+
+RECIPIENT_VARIABLE_PATTERN = re.compile(r'%recipient\.(\w+)%')
+
+
+def fill(text, variables):
+    return RECIPIENT_VARIABLE_PATTERN.sub(lambda match: str(variables.get(match.group(1), match.group(0))), text)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeMailgun(object):
+    def __init__(self):
+        self.messages = []
+        self.n_requests = 0
+        # Status codes to answer the next requests with, in order.
+        self.failures = []
+        # Requests to any of these addresses are rejected as Mailgun
+        # rejects invalid addresses.
+        self.rejected_addresses = set()
+        self.delay = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return 'http://{}:{}/v2'.format(host, port)
+
+    def fail_next(self, status_code: int, n: int=1) -> None:
+        with self._lock:
+            self.failures.extend([status_code] * n)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _respond(self, form):
+        time.sleep(self.delay)
+        with self._lock:
+            self.n_requests += 1
+            if self.failures:
+                status_code = self.failures.pop(0)
+                return status_code, {'message': 'Fake failure'}
+            if self.rejected_addresses.intersection(form['to']):
+                return 400, {'message': "'to' parameter is not a valid address"}
+            recipient_variables = json.loads(form.get('recipient-variables', ['{}'])[0])
+            for to_address in form['to']:
+                variables = recipient_variables.get(to_address, {})
+                self.messages.append({
+                    'from': form['from'][0],
+                    'to': to_address,
+                    'subject': fill(form['subject'][0], variables),
+                    'html': fill(form['html'][0], variables),
+                    'text': fill(form['text'][0], variables),
+                    'variables': variables,
+                })
+            message_id = '<{}@fake.mailgun>'.format(self.n_requests)
+        return 200, {'id': message_id, 'message': 'Queued. Thank you.'}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.endswith('/messages'):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf8')
+                status_code, data = fake._respond(parse_qs(body))
+                content = json.dumps(data).encode('utf8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
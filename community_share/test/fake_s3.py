@@ -0,0 +1,115 @@
+"""A local stand-in for the S3 object API
+
+Accepts `PUT` and `DELETE /<bucket>/<key>` and keeps the bodies it
+is sent, so uploads can be tested with S3_URL pointed at it.  Objects
+can be fetched back with `GET` and `HEAD`, which are not counted.  It keeps
+connections alive like S3 does and counts them, and tests can make it
+answer the next requests with an error status.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeS3(object):
+    def __init__(self):
+        # (bucket, key) -> (headers, body)
+        self.objects = {}
+        self.n_requests = 0
+        self.n_connections = 0
+        # Status codes to answer the next requests with, in order.
+        self.failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return 'http://{}:{}/{{bucket}}/{{key}}'.format(host, port)
+
+    def fail_next(self, status_code: int, n: int=1) -> None:
+        with self._lock:
+            self.failures.extend([status_code] * n)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _put(self, path, headers, body):
+        with self._lock:
+            self.n_requests += 1
+            if self.failures:
+                return self.failures.pop(0)
+            bucket, key = unquote(path).lstrip('/').split('/', 1)
+            self.objects[(bucket, key)] = (headers, body)
+        return 200
+
+    def _get(self, path):
+        with self._lock:
+            bucket, key = unquote(path).lstrip('/').split('/', 1)
+            if (bucket, key) not in self.objects:
+                return 404, b''
+            return 200, self.objects[(bucket, key)][1]
+
+    def _delete(self, path):
+        with self._lock:
+            self.n_requests += 1
+            if self.failures:
+                return self.failures.pop(0)
+            bucket, key = unquote(path).lstrip('/').split('/', 1)
+            self.objects.pop((bucket, key), None)
+        return 204
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.n_connections += 1
+
+            def do_PUT(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                status_code = fake._put(self.path, dict(self.headers), body)
+                self.send_response(status_code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                status_code, body = fake._get(self.path)
+                self.send_response(status_code)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_HEAD(self):
+                status_code, body = fake._get(self.path)
+                self.send_response(status_code)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+
+            def do_DELETE(self):
+                status_code = fake._delete(self.path)
+                self.send_response(status_code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
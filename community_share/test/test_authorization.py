@@ -1,11 +1,19 @@
 import unittest
+from datetime import datetime, timedelta
+from unittest import mock
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from community_share import Base
-from community_share.authorization import user_from_api_key, user_from_login
-from community_share.models.secret import Secret, create_secret
+from community_share.authorization import (
+    invalidate_login_cache,
+    login_cache,
+    user_from_api_key,
+    user_from_login,
+)
+from community_share.models import secret, survey  # noqa: F401, registers Answer for Event
+from community_share.models.secret import Secret, create_secret, secret_cache
 from community_share.models.user import User
 
 
@@ -61,6 +69,8 @@ class AuthorizationTest(unittest.TestCase):
     def setUp(self):
         Base.metadata.drop_all(store.engine)
         Base.metadata.create_all(store.engine)
+        login_cache.clear()
+        secret_cache.clear()
 
     def test_rejects_missing_api_key_secret(self):
         add_user(active_user)
@@ -97,6 +107,34 @@ class AuthorizationTest(unittest.TestCase):
 
         self.assertIsInstance(user_from_api_key(test_api_key, store=store), User)
 
+    def test_repeat_api_key_skips_secret_lookup(self):
+        add_user(active_user)
+        test_api_key = create_secret({'action': 'api_key', 'userId': active_user['id']}, 24, store=store).key
+        user_from_api_key(test_api_key, store=store)
+
+        with mock.patch.object(secret, 'lookup_secret') as lookup_secret:
+            self.assertIsInstance(user_from_api_key(test_api_key, store=store), User)
+            self.assertFalse(lookup_secret.called)
+
+    def test_rejects_api_key_after_marked_used(self):
+        add_user(active_user)
+        test_secret = create_secret({'action': 'api_key', 'userId': active_user['id']}, 24, store=store)
+        user_from_api_key(test_secret.key, store=store)
+        test_secret.mark_used()
+        store.session.commit()
+
+        self.assertIsNone(user_from_api_key(test_secret.key, store=store))
+
+    def test_rejects_cached_api_key_after_expiration(self):
+        add_user(active_user)
+        test_secret = create_secret({'action': 'api_key', 'userId': active_user['id']}, 24, store=store)
+        user_from_api_key(test_secret.key, store=store)
+        user_id, _, action = secret_cache.get(test_secret.key)
+        secret_cache.set(test_secret.key, (user_id, datetime.utcnow() - timedelta(seconds=1), action))
+
+        self.assertIsNone(user_from_api_key(test_secret.key, store=store))
+        self.assertNotIn(test_secret.key, secret_cache)
+
     def test_rejects_login_missing_user(self):
         self.assertIsNone(store.session.query(User).filter(User.email == 'email').first())
         self.assertIsNone(user_from_login('email', 'password', store=store))
@@ -118,6 +156,63 @@ class AuthorizationTest(unittest.TestCase):
 
         self.assertIsInstance(user_from_login(active_user['email'], 'password', store=store), User)
 
+    def test_repeat_login_skips_password_check(self):
+        add_user(active_user)
+        user_from_login(active_user['email'], 'password', store=store)
+
+        with mock.patch.object(User, 'is_password_correct') as is_password_correct:
+            self.assertIsInstance(user_from_login(active_user['email'], 'password', store=store), User)
+            self.assertFalse(is_password_correct.called)
+
+    def test_counts_login_cache_hits_and_misses(self):
+        add_user(active_user)
+        hits, misses = login_cache.hits, login_cache.misses
+
+        user_from_login(active_user['email'], 'password', store=store)
+        user_from_login(active_user['email'], 'password', store=store)
+
+        self.assertEqual(login_cache.hits, hits + 1)
+        self.assertEqual(login_cache.misses, misses + 1)
+
+    def test_does_not_cache_invalid_password(self):
+        add_user(active_user)
+        user_from_login(active_user['email'], 'wrong password', store=store)
+
+        self.assertEqual(0, len(login_cache))
+
+    def test_rejects_old_password_after_change(self):
+        add_user(active_user)
+        user = user_from_login(active_user['email'], 'password', store=store)
+        user.set_password('new password')
+        store.session.commit()
+
+        self.assertEqual(0, len(login_cache))
+        self.assertIsNone(user_from_login(active_user['email'], 'password', store=store))
+        self.assertIsInstance(user_from_login(active_user['email'], 'new password', store=store), User)
+
+    def test_rejects_cached_login_after_password_changed_elsewhere(self):
+        add_user(active_user)
+        user = user_from_login(active_user['email'], 'password', store=store)
+        user.password_hash = User.pwd_context.encrypt('new password')
+        store.session.commit()
+
+        self.assertIsNone(user_from_login(active_user['email'], 'password', store=store))
+
+    def test_rejects_cached_login_after_deactivation(self):
+        add_user(active_user)
+        user = user_from_login(active_user['email'], 'password', store=store)
+        user.active = False
+        store.session.commit()
+
+        self.assertIsNone(user_from_login(active_user['email'], 'password', store=store))
+
+    def test_invalidates_cached_logins_for_user(self):
+        add_user(active_user)
+        user_from_login(active_user['email'], 'password', store=store)
+        invalidate_login_cache(active_user['id'])
+
+        self.assertEqual(0, len(login_cache))
+
     def assert_user_exists(self, user):
         self.assertIsInstance(store.session.query(User).get(user['id']), User)
 
@@ -0,0 +1,37 @@
+import unittest
+
+from community_share.crypt import CryptHelper
+
+KEY = CryptHelper.encode(b'This is a key123This is an IV456')
+
+# Tokens in mail already sent, which must still be understood.
+TOKENS = {
+    'message-1': '056BF27874586438D535D4751CFF5101',
+    'message-123456789012345': (
+        '1CFEFE488AB291F3C469FEC0F1B48D25992F6A56D16FA6120D0E1CA5FC73D692'
+    ),
+}
+
+
+class CryptHelperTest(unittest.TestCase):
+    def setUp(self):
+        self.helper = CryptHelper(KEY)
+
+    def test_codec(self):
+        self.assertEqual('00FF10', CryptHelper.encode(b'\x00\xff\x10'))
+        self.assertEqual(b'\x00\xff\x10', CryptHelper.decode('00ff10'))
+
+    def test_tokens_are_unchanged(self):
+        for text, token in TOKENS.items():
+            self.assertEqual(token, self.helper.encrypt(text))
+            self.assertEqual(text, self.helper.decrypt(token))
+            self.assertEqual(text, self.helper.decrypt(token.lower()))
+
+    def test_invalid_tokens(self):
+        for token in ['not hex', 'ABC', 'AB' * 5]:
+            with self.assertRaises(ValueError):
+                self.helper.decrypt(token)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+import datetime
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base, config, mail
+from community_share.mail_sender import MailSender, make_batches
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.outbox import (
+    CLAIM_DURATION,
+    FIRST_RETRY_DELAY,
+    OutboxMail,
+    STATUS_FAILED,
+    STATUS_PENDING,
+    STATUS_SENT,
+)
+from community_share.models.user import User
+from community_share.test.fake_mailgun import FakeMailgun
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+
+def make_email(i=0):
+    return mail.Email(
+        from_address='CommunityShare <donotreply@example.org>',
+        to_address='user{}@example.org'.format(i),
+        subject='Subject {}'.format(i),
+        content='<p>Content {}</p>'.format(i),
+        new_content='<p>Content {}</p>'.format(i),
+    )
+
+
+class MailSenderTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+
+        self.mailgun = FakeMailgun()
+        self.mailgun.start()
+        self.addCleanup(self.mailgun.stop)
+
+        for target, name, value in [
+            (mail, 'store', store),
+            (mail, 'MAILGUN_API_URL', self.mailgun.url),
+            (config, 'MAILGUN_DOMAIN', 'mail.example.org'),
+            (config, 'MAILGUN_API_KEY', 'key'),
+        ]:
+            patcher = mock.patch.object(target, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('community_share.mail_sender.store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.sender = MailSender(pool_size=4)
+        self.addCleanup(self.sender.stop)
+
+    def outbox(self):
+        store.session.expire_all()
+        return store.session.query(OutboxMail).order_by(OutboxMail.id).all()
+
+    def test_send_only_queues(self):
+        error_message = mail.MailgunMailer.send(make_email(), idempotency_key='message-1')
+
+        self.assertEqual('', error_message)
+        self.assertEqual(0, self.mailgun.n_requests)
+        [queued] = self.outbox()
+        self.assertEqual(STATUS_PENDING, queued.status)
+        self.assertEqual('user0@example.org', queued.to_address)
+
+    def test_same_key_queued_once(self):
+        mail.MailgunMailer.send(make_email(), idempotency_key='message-1')
+        mail.MailgunMailer.send(make_email(), idempotency_key='message-1')
+        mail.MailgunMailer.send(make_email(), idempotency_key='message-2')
+        mail.MailgunMailer.send(make_email())
+
+        self.assertEqual(3, len(self.outbox()))
+
+    def test_deferred_commit_queues_at_the_end(self):
+        with mail.deferred_commit():
+            for i in range(3):
+                mail.MailgunMailer.send(make_email(i), idempotency_key='message-{}'.format(i))
+            self.assertEqual([], self.outbox())
+        mail.MailgunMailer.send(make_email(), idempotency_key='message-0')
+
+        self.assertEqual(3, len(self.outbox()))
+
+    def test_deferred_commit_queues_nothing_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with mail.deferred_commit():
+                mail.MailgunMailer.send(make_email())
+                raise RuntimeError()
+
+        self.assertEqual([], self.outbox())
+
+    def test_deferred_commit_nested_queues_at_the_outer_end(self):
+        with mail.deferred_commit():
+            mail.MailgunMailer.send(make_email(0), idempotency_key='message-0')
+            with mail.deferred_commit():
+                mail.MailgunMailer.send(make_email(1), idempotency_key='message-1')
+            self.assertEqual([], self.outbox())
+            mail.MailgunMailer.send(make_email(2), idempotency_key='message-2')
+
+        self.assertEqual(
+            ['message-0', 'message-1', 'message-2'],
+            [queued.idempotency_key for queued in self.outbox()],
+        )
+
+    def test_send_commits_with_the_caller(self):
+        user = User(name='Before', email='before@example.org')
+        store.session.add(user)
+        store.session.commit()
+
+        user.name = 'After'
+        mail.MailgunMailer.send(make_email(), idempotency_key='message-1')
+        store.session.rollback()
+
+        self.assertEqual('Before', store.session.query(User.name).scalar())
+        self.assertEqual([], self.outbox())
+
+        user.name = 'After'
+        mail.MailgunMailer.send(make_email(), idempotency_key='message-1')
+        store.session.commit()
+
+        self.assertEqual('After', store.session.query(User.name).scalar())
+        self.assertEqual(['message-1'], [queued.idempotency_key for queued in self.outbox()])
+
+    def test_example_addresses_are_not_queued(self):
+        email = make_email()
+        email.to_address = 'someone@example.com'
+        mail.MailgunMailer.send(email)
+
+        self.assertEqual([], self.outbox())
+
+    def test_sends_due_mail(self):
+        for i in range(3):
+            mail.MailgunMailer.send(make_email(i), idempotency_key='message-{}'.format(i))
+
+        self.assertEqual(3, self.sender.send_due())
+
+        self.assertEqual([STATUS_SENT] * 3, [queued.status for queued in self.outbox()])
+        self.assertEqual(
+            ['message-0', 'message-1', 'message-2'],
+            sorted(message['variables']['idempotency_key'] for message in self.mailgun.messages),
+        )
+        self.assertEqual(0, self.sender.send_due())
+        self.assertEqual(3, self.mailgun.n_requests)
+
+    def test_same_content_is_sent_in_one_call(self):
+        for i in range(5):
+            email = make_email(i)
+            email.subject = 'Reminder for %recipient.name%'
+            email.content = '<p>Hello %recipient.name%</p>'
+            email.recipient_variables = {'name': 'User {}'.format(i)}
+            mail.MailgunMailer.send(email)
+        mail.MailgunMailer.send(make_email(5))
+
+        self.assertEqual(6, self.sender.send_due())
+
+        self.assertEqual(2, self.mailgun.n_requests)
+        messages = {message['to']: message for message in self.mailgun.messages}
+        self.assertEqual('Reminder for User 3', messages['user3@example.org']['subject'])
+        self.assertEqual('<p>Hello User 3</p>', messages['user3@example.org']['html'])
+        self.assertEqual('<p>Content 5</p>', messages['user5@example.org']['html'])
+
+    def test_variables_are_only_escaped_in_html(self):
+        email = make_email()
+        email.subject = 'Reminder for %recipient.name%'
+        email.content = '<p>Hello %recipient.name%</p>'
+        email.recipient_variables = {'name': 'Ann & <Bob>'}
+        mail.MailgunMailer.send(email)
+
+        self.assertEqual(1, self.sender.send_due())
+
+        [message] = self.mailgun.messages
+        self.assertEqual('Reminder for Ann & <Bob>', message['subject'])
+        self.assertEqual('<p>Hello Ann &amp; &lt;Bob&gt;</p>', message['html'])
+        self.assertEqual('Hello Ann & <Bob>', message['text'].strip())
+        personalized = email.personalized()
+        self.assertEqual(message['subject'], personalized.subject)
+        self.assertEqual(message['html'], personalized.content)
+
+    def test_batches_go_to_distinct_addresses(self):
+        for i in [0, 1, 0, 2, 0]:
+            email = make_email(i)
+            email.subject = 'Same subject'
+            email.content = '<p>Same content</p>'
+            mail.MailgunMailer.send(email)
+        mail.MailgunMailer.send(make_email(3))
+        outbox = self.outbox()
+
+        batches = make_batches(outbox, max_recipients=2)
+
+        # A second mail to user0 starts a new batch, as does a third
+        # address; the last mail has different content.
+        self.assertEqual(
+            [[0, 1], [2, 3], [4], [5]],
+            [[outbox.index(queued) for queued in batch] for batch in batches],
+        )
+
+    def test_personalized(self):
+        email = make_email()
+        email.content = '<p>%recipient.name% and %recipient.unknown%</p>'
+        email.recipient_variables = {'name': 'Ann'}
+
+        self.assertEqual('<p>Ann and %recipient.unknown%</p>', email.personalized().content)
+        email = make_email()
+        self.assertIs(email, email.personalized())
+
+    def test_retries_with_backoff(self):
+        mail.MailgunMailer.send(make_email())
+        self.mailgun.fail_next(503, n=2)
+        now = datetime.datetime.utcnow()
+
+        self.assertEqual(0, self.sender.send_due(now))
+        [queued] = self.outbox()
+        self.assertEqual((STATUS_PENDING, 1), (queued.status, queued.attempts))
+        self.assertEqual(now + FIRST_RETRY_DELAY, queued.next_attempt_at)
+
+        # Not due again until the delay has passed.
+        self.assertEqual(0, self.sender.send_due(now + FIRST_RETRY_DELAY / 2))
+        self.assertEqual(1, self.mailgun.n_requests)
+
+        now += FIRST_RETRY_DELAY
+        self.assertEqual(0, self.sender.send_due(now))
+        [queued] = self.outbox()
+        self.assertEqual(now + FIRST_RETRY_DELAY * 2, queued.next_attempt_at)
+
+        self.assertEqual(1, self.sender.send_due(now + FIRST_RETRY_DELAY * 2))
+        [queued] = self.outbox()
+        self.assertEqual((STATUS_SENT, 3), (queued.status, queued.attempts))
+
+    def test_rejected_mail_is_not_retried(self):
+        mail.MailgunMailer.send(make_email())
+        self.mailgun.fail_next(400)
+
+        self.assertEqual(0, self.sender.send_due())
+
+        [queued] = self.outbox()
+        self.assertEqual(STATUS_FAILED, queued.status)
+        self.assertIn('400', queued.last_error)
+
+    def queue_same_content(self, n):
+        for i in range(n):
+            email = make_email(i)
+            email.subject = 'Same subject'
+            email.content = '<p>Same content</p>'
+            mail.MailgunMailer.send(email)
+
+    def test_rejected_address_only_fails_its_own_mail(self):
+        self.queue_same_content(8)
+        self.mailgun.rejected_addresses.add('user5@example.org')
+
+        self.assertEqual(7, self.sender.send_due())
+
+        statuses = {queued.to_address: queued.status for queued in self.outbox()}
+        self.assertEqual(STATUS_FAILED, statuses.pop('user5@example.org'))
+        self.assertEqual({STATUS_SENT}, set(statuses.values()))
+        self.assertEqual(7, len(self.mailgun.messages))
+        # The batch is halved down to the bad address, not sent mail by mail.
+        self.assertEqual(7, self.mailgun.n_requests)
+
+    def test_account_errors_fail_the_batch_without_splitting(self):
+        self.queue_same_content(8)
+        self.mailgun.fail_next(401)
+
+        self.assertEqual(0, self.sender.send_due())
+
+        self.assertEqual(1, self.mailgun.n_requests)
+        self.assertEqual({STATUS_FAILED}, {queued.status for queued in self.outbox()})
+
+    def test_unreachable_service_is_retried(self):
+        mail.MailgunMailer.send(make_email())
+        with mock.patch.object(mail, 'MAILGUN_API_URL', 'http://127.0.0.1:1/v2'):
+            self.assertEqual(0, self.sender.send_due())
+
+        [queued] = self.outbox()
+        self.assertEqual((STATUS_PENDING, 1), (queued.status, queued.attempts))
+
+    def test_unexpected_errors_only_fail_their_batch(self):
+        for i in range(3):
+            mail.MailgunMailer.send(make_email(i))
+
+        def deliver(emails, idempotency_keys):
+            if emails[0].to_address == 'user1@example.org':
+                raise ValueError('Unexpected')
+            mail.deliver_with_mailgun(emails, idempotency_keys)
+        sender = MailSender(pool_size=2, deliver=deliver)
+        self.addCleanup(sender.stop)
+
+        self.assertEqual(2, sender.send_due())
+
+        self.assertEqual(
+            [(STATUS_SENT, 1), (STATUS_PENDING, 1), (STATUS_SENT, 1)],
+            [(queued.status, queued.attempts) for queued in self.outbox()],
+        )
+
+    def test_claimed_mail_is_left_to_its_sender(self):
+        for i in range(4):
+            mail.MailgunMailer.send(make_email(i))
+        now = datetime.datetime.utcnow()
+        claimed = OutboxMail.claim_due(store.session, 'other', now, limit=2)
+        self.assertEqual(2, len(claimed))
+
+        self.assertEqual(2, self.sender.send_due(now))
+
+        self.assertEqual(
+            [STATUS_PENDING] * 2 + [STATUS_SENT] * 2,
+            [queued.status for queued in self.outbox()],
+        )
+        # The other sender's claim runs out if it never sends them.
+        self.assertEqual(2, self.sender.send_due(now + CLAIM_DURATION * 2))
+        self.assertEqual(4, self.mailgun.n_requests)
+
+    def test_mail_is_sent_concurrently(self):
+        for i in range(8):
+            mail.MailgunMailer.send(make_email(i))
+        self.mailgun.delay = 0.2
+        sender = MailSender(pool_size=8)
+        self.addCleanup(sender.stop)
+
+        started = time.monotonic()
+        self.assertEqual(8, sender.send_due())
+
+        # One at a time this would take 1.6s.
+        self.assertLess(time.monotonic() - started, 0.8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,355 @@
+import datetime
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import community_share_thumbnails
+from community_share import Base, config, picture_utils, s3_connection
+from community_share.models.picture import STALE_UPLOAD, PictureObject
+from community_share.models.user import User
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.picture_utils import (
+    CHUNK_SIZE,
+    THUMBNAIL_SIZES,
+    UNREFERENCED_PICTURE_GRACE,
+    delete_unreferenced_pictures,
+    image_to_filename,
+    is_allowable_image,
+    make_thumbnails,
+    picture_urls,
+    stage_image,
+    store_image,
+    thumbnail_filename,
+    upload_stale_pictures,
+)
+from community_share.s3_connection import MAX_ATTEMPTS, S3Uploader
+from community_share.test.fake_s3 import FakeS3
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 1000
+
+
+class StageImageTest(unittest.TestCase):
+    def test_stage_image(self):
+        image = stage_image(io.BytesIO(PNG))
+        self.addCleanup(os.remove, image.path)
+
+        self.assertGreater(len(PNG), CHUNK_SIZE)
+        with open(image.path, 'rb') as staged:
+            self.assertEqual(PNG, staged.read())
+        self.assertEqual(len(PNG), image.size)
+        self.assertTrue(is_allowable_image(image.header))
+        self.assertEqual(
+            'picture_{}.png'.format(hashlib.sha1(PNG).hexdigest()),
+            image_to_filename(image),
+        )
+
+    def test_failed_read_leaves_no_file(self):
+        stream = mock.Mock()
+        stream.read.side_effect = [PNG[:CHUNK_SIZE], OSError('Connection reset')]
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(tempfile, 'tempdir', directory):
+                with self.assertRaises(OSError):
+                    stage_image(stream)
+            self.assertEqual([], os.listdir(directory))
+
+
+def make_picture(size, mode='RGBA', image_format='PNG'):
+    data = io.BytesIO()
+    Image.new(mode, size, (200, 100, 50, 128)[:len(mode)]).save(data, image_format)
+    return data.getvalue()
+
+
+class ThumbnailTest(unittest.TestCase):
+    def test_make_thumbnails(self):
+        image = stage_image(io.BytesIO(make_picture((1000, 500))))
+        self.addCleanup(os.remove, image.path)
+
+        thumbnails = make_thumbnails(image.path)
+
+        self.assertEqual(set(THUMBNAIL_SIZES), set(thumbnails))
+        for size, filename in thumbnails.items():
+            self.addCleanup(os.remove, filename)
+            with Image.open(filename) as thumbnail:
+                self.assertEqual(('JPEG', 'RGB'), (thumbnail.format, thumbnail.mode))
+                self.assertEqual((size, size // 2), thumbnail.size)
+                # Transparency is flattened onto white.
+                for actual, expected in zip(thumbnail.getpixel((0, 0)), (227, 177, 152)):
+                    self.assertAlmostEqual(expected, actual, delta=3)
+
+    def test_small_pictures_are_not_scaled_up(self):
+        image = stage_image(io.BytesIO(make_picture((100, 120), 'RGB', 'JPEG')))
+        self.addCleanup(os.remove, image.path)
+
+        thumbnails = make_thumbnails(image.path)
+
+        sizes = {}
+        for size, filename in thumbnails.items():
+            self.addCleanup(os.remove, filename)
+            with Image.open(filename) as thumbnail:
+                sizes[size] = thumbnail.size
+        self.assertEqual({64: (53, 64), 160: (100, 120), 480: (100, 120)}, sizes)
+
+    def test_picture_urls(self):
+        filename = 'user_3_{}.png'.format('a' * 40)
+
+        urls = picture_urls('https://pictures.example.org/', filename, True)
+
+        self.assertEqual('https://pictures.example.org/' + filename, urls['original'])
+        self.assertEqual(
+            'https://pictures.example.org/user_3_{}_160.jpg'.format('a' * 40),
+            urls['160'],
+        )
+        self.assertEqual(
+            ['https://pictures.example.org/llama.jpg'] * 4,
+            list(picture_urls('https://pictures.example.org/', 'llama.jpg', False).values()),
+        )
+
+
+class Store:
+    # One connection shared by every thread, for the uploader's thread.
+    engine = create_engine(
+        'sqlite://',
+        connect_args={'check_same_thread': False},
+        poolclass=StaticPool,
+    )
+    session = scoped_session(sessionmaker(bind=engine))
+
+
+store = Store()
+
+
+class FakeS3TestCase(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3()
+        self.s3.start()
+        self.addCleanup(self.s3.stop)
+        for target, name, value in [
+            (s3_connection, 'S3_URL', self.s3.url),
+            (s3_connection, 'FIRST_RETRY_DELAY', 0),
+            (config, 'S3_BUCKETNAME', 'pictures'),
+            (config, 'S3_USERNAME', 'user'),
+            (config, 'S3_KEY', 'key'),
+        ]:
+            patcher = mock.patch.object(target, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.uploader = S3Uploader()
+
+    def stage(self, data=PNG):
+        return stage_image(io.BytesIO(data)).path
+
+
+class S3UploaderTest(FakeS3TestCase):
+    def test_uploads_in_the_background(self):
+        paths = [self.stage(PNG + bytes([i])) for i in range(3)]
+        for i, path in enumerate(paths):
+            self.uploader.submit(path, 'user_{}.png'.format(i))
+        self.uploader.join()
+
+        headers, body = self.s3.objects[('pictures', 'user_2.png')]
+        self.assertEqual(PNG + bytes([2]), body)
+        self.assertEqual('image/png', headers['Content-Type'])
+        self.assertEqual('public-read', headers['x-amz-acl'])
+        self.assertEqual(3, len(self.s3.objects))
+        # Every upload went over the same connection.
+        self.assertEqual(1, self.s3.n_connections)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_retries(self):
+        path = self.stage()
+        self.s3.fail_next(503)
+
+        self.assertTrue(self.uploader.upload(path, 'user_1.png'))
+
+        self.assertEqual(2, self.s3.n_requests)
+        self.assertFalse(os.path.exists(path))
+
+    def test_gives_up(self):
+        path = self.stage()
+        self.s3.fail_next(403, n=MAX_ATTEMPTS)
+
+        with self.assertLogs(s3_connection.logger, 'ERROR'):
+            self.assertFalse(self.uploader.upload(path, 'user_1.png'))
+
+        self.assertEqual(MAX_ATTEMPTS, self.s3.n_requests)
+        self.assertEqual({}, self.s3.objects)
+        self.assertFalse(os.path.exists(path))
+
+
+class PictureStoreTest(FakeS3TestCase):
+    def setUp(self):
+        super().setUp()
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        patcher = mock.patch.object(picture_utils, 'store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(store.session.remove)
+        picture_utils.thumbnailed_pictures.clear()
+        self.addCleanup(picture_utils.thumbnailed_pictures.clear)
+
+    def store_picture(self, data, kept=False):
+        image = stage_image(io.BytesIO(data))
+        filename = image_to_filename(image)
+        stored = store_image(image, filename)
+        s3_connection.s3_uploader.join()
+        self.assertEqual(kept, os.path.exists(image.path))
+        return filename, stored
+
+    def keys(self):
+        return {key for (bucket, key) in self.s3.objects}
+
+    def test_store_image_uploads_thumbnails(self):
+        filename, stored = self.store_picture(make_picture((600, 600)))
+
+        self.assertTrue(stored)
+        expected = {filename} | {thumbnail_filename(filename, size) for size in THUMBNAIL_SIZES}
+        self.assertEqual(expected, self.keys())
+        headers, _ = self.s3.objects[('pictures', thumbnail_filename(filename, 64))]
+        self.assertEqual('image/jpeg', headers['Content-Type'])
+        [picture] = store.session.query(PictureObject).all()
+        self.assertEqual(filename, picture.filename)
+        self.assertIsNotNone(picture.uploaded_at)
+
+    def test_same_picture_is_uploaded_once(self):
+        data = make_picture((600, 600))
+        self.store_picture(data)
+
+        filename, stored = self.store_picture(data)
+
+        self.assertFalse(stored)
+        self.assertEqual(1 + len(THUMBNAIL_SIZES), self.s3.n_requests)
+
+    def test_failed_upload_is_made_again_by_the_worker(self):
+        self.s3.fail_next(503, n=MAX_ATTEMPTS)
+        with self.assertLogs(s3_connection.logger, 'ERROR'):
+            filename, stored = self.store_picture(PNG, kept=True)
+        self.assertTrue(stored)
+        self.assertEqual(set(), self.keys())
+        # Someone else uploading it meanwhile leaves it to the worker.
+        self.assertFalse(self.store_picture(PNG)[1])
+        later = datetime.datetime.utcnow() + STALE_UPLOAD * 2
+
+        self.assertEqual(1, upload_stale_pictures(later))
+
+        self.assertEqual({filename}, self.keys())
+        self.assertEqual(0, upload_stale_pictures(later))
+
+    def test_lost_upload_is_made_by_the_worker(self):
+        image = stage_image(io.BytesIO(make_picture((600, 600))))
+        filename = image_to_filename(image)
+        with mock.patch.object(s3_connection.s3_uploader, 'call'):
+            self.assertTrue(store_image(image, filename))
+        self.assertEqual(set(), self.keys())
+        later = datetime.datetime.utcnow() + STALE_UPLOAD * 2
+
+        self.assertEqual(1, upload_stale_pictures(later))
+
+        expected = {filename} | {thumbnail_filename(filename, size) for size in THUMBNAIL_SIZES}
+        self.assertEqual(expected, self.keys())
+        self.assertFalse(os.path.exists(image.path))
+
+    def test_upload_staged_on_another_host_is_left_alone(self):
+        image = stage_image(io.BytesIO(PNG))
+        with mock.patch.object(s3_connection.s3_uploader, 'call'):
+            self.assertTrue(store_image(image, image_to_filename(image)))
+        os.remove(image.path)
+
+        self.assertEqual(0, upload_stale_pictures(datetime.datetime.utcnow() + STALE_UPLOAD * 2))
+
+        [picture] = store.session.query(PictureObject).all()
+        self.assertEqual(image.path, picture.staged_path)
+        self.assertIsNone(picture.uploaded_at)
+
+    def test_staged_file_is_removed_if_the_claim_fails(self):
+        image = stage_image(io.BytesIO(PNG))
+        with mock.patch.object(PictureObject, 'claim', side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                store_image(image, image_to_filename(image))
+
+        self.assertFalse(os.path.exists(image.path))
+
+    def test_original_is_uploaded_without_thumbnails(self):
+        thumbnailed, _ = self.store_picture(make_picture((100, 100)))
+        self.assertTrue(picture_utils.thumbnails_exist(thumbnailed))
+
+        with self.assertLogs('community_share.picture_utils', 'ERROR'):
+            filename, _ = self.store_picture(b'GIF89a not really a picture')
+
+        self.assertIn(filename, self.keys())
+        self.assertNotIn(thumbnail_filename(filename, 64), self.keys())
+        [picture] = store.session.query(PictureObject).filter_by(filename=filename).all()
+        self.assertIsNotNone(picture.uploaded_at)
+        self.assertFalse(picture_utils.thumbnails_exist(filename))
+        self.assertTrue(picture_utils.thumbnails_exist(thumbnailed))
+        urls = picture_urls('https://pictures.example.org/', filename, False)
+        self.assertEqual({'https://pictures.example.org/' + filename}, set(urls.values()))
+
+    def test_delete_unreferenced_pictures(self):
+        kept, _ = self.store_picture(make_picture((100, 100)))
+        deleted, _ = self.store_picture(make_picture((200, 200)))
+        store.session.execute(User.__table__.insert(), {
+            'name': 'User', 'email': 'user@example.org', 'picture_filename': kept,
+        })
+        store.session.commit()
+        now = datetime.datetime.utcnow()
+
+        self.assertEqual(0, delete_unreferenced_pictures(now))
+        self.assertEqual(1, delete_unreferenced_pictures(now + UNREFERENCED_PICTURE_GRACE * 2))
+
+        self.assertEqual(
+            {kept} | {thumbnail_filename(kept, size) for size in THUMBNAIL_SIZES},
+            self.keys(),
+        )
+        self.assertEqual([kept], [p.filename for p in store.session.query(PictureObject)])
+        # Uploaded again if a user wants it after all.
+        self.assertTrue(self.store_picture(make_picture((200, 200)))[1])
+        self.assertIn(deleted, self.keys())
+
+    def test_backfill_records_which_pictures_have_thumbnails(self):
+        legacy = {
+            'user_1_{}.png'.format('a' * 40): make_picture((600, 600)),
+            'user_2_{}.gif'.format('b' * 40): b'GIF89a not really a picture',
+        }
+        for i, (filename, data) in enumerate(sorted(legacy.items())):
+            self.s3.objects[('pictures', filename)] = ({}, data)
+            store.session.execute(User.__table__.insert(), {
+                'name': 'User', 'email': 'user{}@example.org'.format(i),
+                'picture_filename': filename,
+            })
+        store.session.commit()
+        thumbnailed, broken = sorted(legacy)
+        # Until backfilled, old pictures are shown at full size.
+        self.assertFalse(picture_utils.thumbnails_exist(thumbnailed))
+        upload_location = self.s3.url.format(bucket='pictures', key='')
+        for target, name, value in [
+            (community_share_thumbnails, 'store', store),
+            (config, 'UPLOAD_LOCATION', upload_location),
+        ]:
+            patcher = mock.patch.object(target, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        community_share_thumbnails.make_missing_thumbnails()
+
+        picture_utils.thumbnailed_pictures.clear()
+        self.assertTrue(picture_utils.thumbnails_exist(thumbnailed))
+        self.assertIn(thumbnail_filename(thumbnailed, 64), self.keys())
+        self.assertFalse(picture_utils.thumbnails_exist(broken))
+        pictures = {p.filename: p for p in store.session.query(PictureObject)}
+        self.assertEqual((True, False), (pictures[thumbnailed].has_thumbnails,
+                                         pictures[broken].has_thumbnails))
+        self.assertEqual(len(legacy[broken]), pictures[broken].size)
+
+
+if __name__ == '__main__':
+    unittest.main()
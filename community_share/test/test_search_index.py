@@ -0,0 +1,258 @@
+import math
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from community_share import Base, search_index as search_index_module
+from community_share.cache import TTLCache
+from community_share.models.search import Label, Search
+from community_share.models import survey  # noqa: F401, registers Answer for Event
+from community_share.models.user import User
+from community_share import geo
+from community_share.search_index import RANK_BY_COMBINED, SearchIndex
+from community_share.search_utils import (
+    find_matching_searches,
+    get_searches_ordered_by_label_matches,
+    query_searches_ordered_by_label_matches,
+)
+
+
+class Store:
+    engine = create_engine('sqlite:///:memory:')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+
+store = Store()
+
+LABEL_NAMES = ['Math', 'Science', 'Art', 'Music', 'History']
+
+TUCSON = (32.22, -110.97)
+MARANA = (32.44, -111.22)
+PHOENIX = (33.45, -112.07)
+
+
+def add_search(user, labels, searcher_role='partner', searching_for_role='educator',
+               location=(None, None), distance=None):
+    search = Search(
+        searcher_user=user,
+        searcher_role=searcher_role,
+        searching_for_role=searching_for_role,
+        labels=labels,
+        latitude=location[0],
+        longitude=location[1],
+        distance=distance,
+    )
+    store.session.add(search)
+    return search
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(store.engine)
+        Base.metadata.create_all(store.engine)
+        store.session.expunge_all()
+
+        self.index = SearchIndex(rebuild_interval=None)
+        self.match_cache = TTLCache(16)
+        for name, patched in [
+            ('store', store),
+            ('search_index', self.index),
+            ('match_cache', self.match_cache),
+        ]:
+            patcher = mock.patch('community_share.search_utils.{}'.format(name), patched)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(search_index_module, 'search_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.labels = [Label(name=name) for name in LABEL_NAMES]
+        self.users = [
+            User(name='User {}'.format(i), email='user{}@example.com'.format(i),
+                 email_confirmed=True)
+            for i in range(4)
+        ]
+        self.users[3].email_confirmed = False
+        store.session.add_all(self.labels + self.users)
+
+        self.searches = [
+            add_search(self.users[0], self.labels[:3]),
+            add_search(self.users[1], self.labels[1:2]),
+            add_search(self.users[2], self.labels[2:5]),
+            add_search(self.users[3], self.labels),
+            add_search(self.users[0], self.labels, searcher_role='educator'),
+        ]
+        store.session.commit()
+
+    def ordered(self, labels, offset_number=0, max_number=10):
+        return get_searches_ordered_by_label_matches(
+            labels, 'partner', 'educator', offset_number=offset_number, max_number=max_number)
+
+    def test_matches_database_ordering(self):
+        for labels in [self.labels, self.labels[:2], self.labels[2:3], self.labels[4:]]:
+            expected = query_searches_ordered_by_label_matches(labels, 'partner', 'educator')
+            self.assertEqual(expected, self.ordered(labels))
+
+    def test_label_names_are_case_insensitive(self):
+        search = Search(labels=[Label(name='mATH')])
+        self.assertEqual([self.searches[0]], self.ordered(search.labels))
+
+    def test_pages_are_stable(self):
+        ranked = self.ordered(self.labels)
+        pages = self.ordered(self.labels, 0, 2) + self.ordered(self.labels, 1, 2)
+        self.assertEqual(ranked, pages)
+
+    def test_follows_committed_searches(self):
+        self.ordered(self.labels)
+        search = add_search(self.users[1], self.labels[3:5])
+        store.session.commit()
+
+        self.assertIn(search, self.ordered(self.labels[4:]))
+
+        search.active = False
+        store.session.commit()
+
+        self.assertNotIn(search, self.ordered(self.labels[4:]))
+
+    def test_follows_deactivated_users(self):
+        self.ordered(self.labels)
+        self.users[2].active = False
+        store.session.commit()
+
+        self.assertEqual([], self.ordered(self.labels[4:]))
+
+    def test_ignores_rolled_back_changes(self):
+        self.ordered(self.labels)
+        add_search(self.users[1], self.labels[3:5])
+        store.session.flush()
+        store.session.rollback()
+
+        self.assertEqual([self.searches[2]], self.ordered(self.labels[4:]))
+
+    def test_version_changes_on_commit(self):
+        self.ordered(self.labels)
+        version = self.index.version
+        add_search(self.users[1], self.labels[3:5])
+        store.session.commit()
+
+        self.assertGreater(self.index.version, version)
+
+    def test_rankings_for_older_versions_are_dropped(self):
+        self.ordered(self.labels)
+        self.ordered(self.labels[:2])
+        add_search(self.users[1], self.labels[3:5])
+        store.session.commit()
+        self.ordered(self.labels)
+
+        self.assertEqual(1, len(self.match_cache))
+
+    def test_later_pages_reuse_ranking(self):
+        self.ordered(self.labels, 0, 1)
+        with mock.patch.object(self.index, 'ranked_matches') as ranked_matches:
+            second_page = self.ordered(self.labels, 1, 1)
+
+        ranked_matches.assert_not_called()
+        self.assertEqual(self.ordered(self.labels)[1:2], second_page)
+        self.assertEqual({'hits': 2, 'misses': 1, 'size': 1}, self.match_cache.stats())
+
+    def test_label_order_and_case_share_ranking(self):
+        self.ordered(self.labels[:2])
+        self.ordered([Label(name='science'), Label(name='MATH')])
+
+        self.assertEqual(1, self.match_cache.misses)
+
+    def test_ranking_recomputed_after_change(self):
+        self.assertEqual([self.searches[2]], self.ordered(self.labels[4:]))
+        search = add_search(self.users[1], self.labels[4:])
+        store.session.commit()
+
+        self.assertEqual([self.searches[2], search], self.ordered(self.labels[4:]))
+
+    def test_unrelated_changes_keep_version(self):
+        self.ordered(self.labels)
+        version = self.index.version
+        self.users[0].name = 'Renamed'
+        self.searches[0].zipcode = '85701'
+        store.session.commit()
+
+        self.assertEqual(version, self.index.version)
+
+    def locate(self, *locations):
+        for search, location in zip(self.searches, locations):
+            search.latitude, search.longitude = location
+        store.session.commit()
+
+    def test_leaves_out_distant_searches(self):
+        self.locate(PHOENIX, MARANA, TUCSON)
+        educator_search = add_search(
+            self.users[1], self.labels, 'educator', 'partner', location=TUCSON, distance=50)
+        store.session.commit()
+
+        self.assertEqual([self.searches[2], self.searches[1]],
+                         find_matching_searches(educator_search, 0))
+
+        educator_search.distance = None
+        self.assertEqual([self.searches[0], self.searches[2], self.searches[1]],
+                         find_matching_searches(educator_search, 0))
+
+    def test_wide_distances_skip_the_grid(self):
+        self.locate(PHOENIX, MARANA, TUCSON)
+        educator_search = add_search(
+            self.users[1], self.labels, 'educator', 'partner', location=TUCSON, distance=10 ** 9)
+        store.session.commit()
+
+        with mock.patch.object(geo, 'cells_within') as cells_within:
+            self.assertEqual([self.searches[0], self.searches[2], self.searches[1]],
+                             find_matching_searches(educator_search, 0))
+            self.assertEqual({search.id for search in self.searches[:3]},
+                             self.index.searches_near('partner', 'educator', TUCSON, 10 ** 9))
+        cells_within.assert_not_called()
+
+    def test_combined_ranking_favours_nearby_searches(self):
+        self.locate(PHOENIX, MARANA, TUCSON)
+        educator_search = add_search(
+            self.users[1], self.labels[:3], 'educator', 'partner', location=TUCSON)
+        store.session.commit()
+
+        self.assertEqual(self.searches[:3], find_matching_searches(educator_search, 0))
+        self.assertEqual(
+            [self.searches[2], self.searches[1], self.searches[0]],
+            find_matching_searches(educator_search, 0, rank_by=RANK_BY_COMBINED),
+        )
+
+
+class GeoTest(unittest.TestCase):
+    def test_distance_between(self):
+        self.assertAlmostEqual(0, geo.distance_between(TUCSON, TUCSON))
+        self.assertAlmostEqual(21, geo.distance_between(TUCSON, MARANA), delta=1)
+        self.assertAlmostEqual(107, geo.distance_between(TUCSON, PHOENIX), delta=2)
+
+    def test_cells_within_cover_nearby_locations(self):
+        for location in [TUCSON, (0.1, 179.9), (89.9, 10.0), (-45.0, -0.1)]:
+            cells = set(geo.cells_within(location, 60))
+            for bearing in range(0, 360, 15):
+                nearby = (
+                    max(-90, min(90, location[0] + 0.85 * math.cos(math.radians(bearing)))),
+                    (location[1] + 0.85 * math.sin(math.radians(bearing)) + 180) % 360 - 180,
+                )
+                if geo.distance_between(location, nearby) <= 60:
+                    self.assertIn(geo.cell_of(nearby), cells)
+
+    def test_cells_within_shrink_with_distance(self):
+        self.assertEqual([geo.cell_of(TUCSON)], list(geo.cells_within(TUCSON, 1)))
+        self.assertLess(
+            len(list(geo.cells_within(TUCSON, 50))), len(list(geo.cells_within(TUCSON, 200))))
+
+    def test_n_cells_within_counts_cells(self):
+        for distance in [1, 60, 2000]:
+            self.assertEqual(len(list(geo.cells_within(TUCSON, distance))),
+                             geo.n_cells_within(TUCSON, distance))
+        self.assertEqual(geo.n_cells_within(TUCSON, geo.MAX_DISTANCE),
+                         geo.n_cells_within(TUCSON, 10 ** 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import datetime
+import threading
+import time
+import unittest
+from unittest import mock
+
+from community_share import worker
+from community_share.worker import (
+    MIN_DELAY,
+    REMINDER_POLL_INTERVAL,
+    STATISTICS_DELAY,
+    Worker,
+    next_day_rollover,
+    next_reminder_time,
+    timed_job,
+)
+
+NOW = datetime.datetime(2016, 3, 14, 15, 9, 26)
+
+
+class FakeSender(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+        self.runs = 0
+        # Set once mail has been sent a few times.
+        self.runs_done = threading.Event()
+
+    def send_all_due(self):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running -= 1
+            self.runs += 1
+            if self.runs >= 3:
+                self.runs_done.set()
+
+    def stop(self):
+        pass
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        for name, patched in [
+            ('store', mock.Mock()),
+            ('job_metrics', {}),
+            ('Lease', mock.Mock()),
+        ]:
+            patcher = mock.patch.object(worker, name, patched)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        worker.Lease.acquire.return_value = True
+
+    def test_next_day_rollover(self):
+        self.assertEqual(
+            datetime.datetime(2016, 3, 15) + STATISTICS_DELAY,
+            next_day_rollover(NOW),
+        )
+
+    def test_next_reminder_time(self):
+        for due, expected in [
+            (None, NOW + REMINDER_POLL_INTERVAL),
+            (NOW + datetime.timedelta(minutes=3), NOW + datetime.timedelta(minutes=3)),
+            (NOW + datetime.timedelta(hours=2), NOW + REMINDER_POLL_INTERVAL),
+            (NOW + datetime.timedelta(seconds=0.5), NOW + MIN_DELAY),
+            (NOW, NOW + worker.RESCHEDULE_FALLBACK),
+            (NOW - datetime.timedelta(minutes=3), NOW + worker.RESCHEDULE_FALLBACK),
+        ]:
+            with mock.patch.object(
+                    worker.EventReminder, 'next_oneday_reminder_time', return_value=due):
+                self.assertEqual(expected, next_reminder_time(NOW))
+
+    def test_timed_job_records_runs(self):
+        outcomes = [None, ValueError()]
+
+        def job():
+            outcome = outcomes.pop(0)
+            if outcome is not None:
+                raise outcome
+
+        run_job = timed_job('job', job)
+        run_job()
+        with self.assertRaises(ValueError):
+            run_job()
+
+        metrics = worker.job_metrics['job']
+        self.assertEqual((2, 1), (metrics.runs, metrics.failures))
+        self.assertIsNotNone(metrics.mean_seconds)
+        self.assertEqual(2, worker.store.session.remove.call_count)
+
+    def test_run_exclusively(self):
+        job = mock.Mock()
+        job_worker = Worker(scheduler=mock.Mock(), sender=FakeSender(0), holder='me')
+
+        self.assertTrue(job_worker.run_exclusively('job', job))
+        worker.Lease.release.assert_called_once_with(worker.store.session, 'job', 'me')
+
+        worker.Lease.acquire.return_value = False
+        self.assertFalse(job_worker.run_exclusively('job', job))
+        self.assertEqual(1, job.call_count)
+
+    def test_reschedules_when_next_time_fails(self):
+        scheduler = mock.Mock()
+        job_worker = Worker(scheduler=scheduler, sender=FakeSender(0), holder='me')
+
+        with mock.patch.object(worker, 'next_reminder_time', side_effect=OSError()), \
+                mock.patch.object(worker.reminder, 'send_reminders'):
+            before = datetime.datetime.utcnow()
+            job_worker.send_reminders()
+
+        worker.store.session.rollback.assert_called_with()
+        [call] = scheduler.add_date_job.call_args_list
+        job, when = call[0]
+        self.assertIs(job_worker._send_reminders, job)
+        self.assertGreaterEqual(when, worker.utc_to_local(before + worker.RESCHEDULE_FALLBACK))
+
+    def test_failed_run_is_retried_after_fallback(self):
+        scheduler = mock.Mock()
+        job_worker = Worker(scheduler=scheduler, sender=FakeSender(0), holder='me')
+
+        with mock.patch.object(worker, 'next_reminder_time') as next_time, \
+                mock.patch.object(worker.reminder, 'send_reminders', side_effect=ValueError()):
+            before = datetime.datetime.utcnow()
+            with self.assertRaises(ValueError):
+                job_worker.send_reminders()
+
+        next_time.assert_not_called()
+        [call] = scheduler.add_date_job.call_args_list
+        job, when = call[0]
+        self.assertIs(job_worker._send_reminders, job)
+        self.assertGreaterEqual(when, worker.utc_to_local(before + worker.RESCHEDULE_FALLBACK))
+
+    @mock.patch.object(worker.mail_sender, 'POLL_INTERVAL', 0.1)
+    @mock.patch.object(worker, 'next_reminder_time')
+    @mock.patch.object(worker.Statistic, 'check_statistics')
+    @mock.patch.object(worker.StatisticCounter, 'reconcile')
+    @mock.patch.object(worker.reminder, 'send_reminders')
+    def test_runs_jobs_on_their_schedules(
+            self, send_reminders, reconcile, check_statistics, next_reminder_time):
+        next_reminder_time.side_effect = lambda now: now + datetime.timedelta(seconds=0.05)
+        reminders_done = threading.Event()
+        send_reminders.side_effect = \
+            lambda: send_reminders.call_count >= 3 and reminders_done.set()
+        statistics_done = threading.Event()
+        check_statistics.side_effect = statistics_done.set
+        sender = FakeSender(seconds=0.3)
+        job_worker = Worker(sender=sender)
+        thread = threading.Thread(target=job_worker.run)
+        thread.start()
+        try:
+            self.assertTrue(reminders_done.wait(10))
+            self.assertTrue(statistics_done.wait(10))
+            self.assertTrue(sender.runs_done.wait(10))
+        finally:
+            job_worker.stop()
+            thread.join()
+
+        # Statistics ran once at startup and wait for the day to end.
+        self.assertEqual(1, check_statistics.call_count)
+        self.assertEqual(1, reconcile.call_count)
+        # Mail is due every 0.1s but takes longer than that, so runs
+        # are skipped rather than overlapping.
+        self.assertEqual(1, sender.most_running)
+        self.assertEqual(0, worker.job_metrics['reminders'].failures)
+
+if __name__ == '__main__':
+    unittest.main()
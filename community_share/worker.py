@@ -1,15 +1,316 @@
-import logging, datetime, time
+"""Background jobs of the worker (clock) process
 
-from community_share import reminder
-from community_share.models.statistics import Statistic
+`Worker` runs each job on its own schedule with APScheduler:
+
+- queued mail is sent every few seconds,
+- reminders are sent when the next event enters the reminder window,
+  checking at least every `REMINDER_POLL_INTERVAL` for events created
+  since,
+- statistics are stored and their counters reconciled shortly after
+  each day ends (UTC),
+- pictures no user refers to are deleted every `PICTURE_GC_INTERVAL`,
+- pictures staged on this host whose upload failed, or was lost with
+  its web process, are uploaded every `PICTURE_UPLOAD_INTERVAL`,
+- page views are added to their rollups every `PAGE_VIEW_ROLLUP_INTERVAL`.
+
+Between jobs the scheduler sleeps until the next one is due.  A job
+is never started again while it is still running, and the duration
+of every run is kept in `job_metrics`.
+
+Several worker processes can run side by side.  Every job but mail and
+picture uploads is only run by the worker holding the job's lease, and
+each worker sends the mail and uploads the pictures it has claimed.
+"""
+import datetime
+import logging
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from apscheduler.scheduler import Scheduler
+from apscheduler.threadpool import ThreadPool
+
+from community_share import mail_sender, picture_utils, reminder, store
+from community_share.models.analytics import roll_up_page_views
+from community_share.models.lease import Lease, make_holder_id
+from community_share.models.share import EventReminder
+from community_share.models.statistics import Statistic, StatisticCounter
 
 logger = logging.getLogger(__name__)
 
+# Events are created by the web processes, which cannot wake the worker,
+# so an event created less than a day ahead is noticed this late at most.
+REMINDER_POLL_INTERVAL = datetime.timedelta(minutes=10)
+# Statistics for a day are stored this long after it ends.
+STATISTICS_DELAY = datetime.timedelta(minutes=5)
+PICTURE_GC_INTERVAL = datetime.timedelta(hours=6)
+PICTURE_UPLOAD_INTERVAL = datetime.timedelta(minutes=5)
+PAGE_VIEW_ROLLUP_INTERVAL = datetime.timedelta(minutes=10)
+# A job that schedules itself runs again after this if its next time
+# cannot be worked out, e.g. while the database is unreachable.
+RESCHEDULE_FALLBACK = REMINDER_POLL_INTERVAL
+# APScheduler refuses to add a job due in the past.
+MIN_DELAY = datetime.timedelta(seconds=1)
+# A job that cannot start within this long of its time is skipped.
+# Reminder and statistics jobs schedule their own next run, so they
+# must not be skipped while another job holds up the thread pool.
+MISFIRE_GRACE_TIME = 3600  # seconds
+JOB_THREADS = 3
+# Longer than reminders or statistics take to run.  If a worker dies
+# holding a lease, another one takes over the job after this.
+LEASE_DURATION = datetime.timedelta(minutes=30)
+
+
+class JobMetrics(object):
+    def __init__(self) -> None:
+        self.runs = 0
+        self.failures = 0
+        self.last_seconds = None
+        self.max_seconds = 0.0
+        self.total_seconds = 0.0
+        self.last_finished = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.runs += 1
+            if failed:
+                self.failures += 1
+            self.last_seconds = seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.total_seconds += seconds
+            self.last_finished = datetime.datetime.utcnow()
+
+    @property
+    def mean_seconds(self) -> Optional[float]:
+        if self.runs == 0:
+            return None
+        return self.total_seconds / self.runs
+
+    def serialize(self) -> Dict[str, Any]:
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_seconds': self.last_seconds,
+            'mean_seconds': self.mean_seconds,
+            'max_seconds': self.max_seconds,
+            'last_finished': self.last_finished,
+        }
+
+
+# job name -> JobMetrics
+job_metrics = {}
+
+
+def timed_job(name: str, func: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Wrap `func` to run as a job, recording its duration under `name`
+
+    The job thread's database session is discarded after every run,
+    so a failed run cannot leave a broken transaction for the next.
+    """
+    metrics = job_metrics.setdefault(name, JobMetrics())
+
+    @wraps(func)
+    def run_job():
+        started = time.monotonic()
+        failed = True
+        try:
+            result = func()
+            failed = False
+            return result
+        finally:
+            seconds = time.monotonic() - started
+            metrics.record(seconds, failed)
+            logger.info(
+                'Job {} {} in {:.2f}s (mean {:.2f}s over {} runs)'
+                .format(name, 'failed' if failed else 'finished', seconds,
+                        metrics.mean_seconds, metrics.runs)
+            )
+            store.session.remove()
+
+    return run_job
+
+
+def next_day_rollover(now: datetime.datetime) -> datetime.datetime:
+    """When to store statistics for the day of `now`"""
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return tomorrow + STATISTICS_DELAY
+
+
+def next_reminder_time(now: datetime.datetime) -> datetime.datetime:
+    """
+    When to next look for events to send reminders for
+
+    A reminder already due was not sent by the run just made, most
+    likely because sending it failed, so it is retried after
+    `RESCHEDULE_FALLBACK` rather than straight away.
+    """
+    latest = now + REMINDER_POLL_INTERVAL
+    due = EventReminder.next_oneday_reminder_time(now)
+    if due is None:
+        return latest
+    if due <= now:
+        return now + RESCHEDULE_FALLBACK
+    return max(now + MIN_DELAY, min(due, latest))
+
+
+def after_fallback(now: datetime.datetime) -> datetime.datetime:
+    return now + RESCHEDULE_FALLBACK
+
+
+def utc_to_local(when: datetime.datetime) -> datetime.datetime:
+    # APScheduler works in naive local time.
+    return when + (datetime.datetime.now() - datetime.datetime.utcnow())
+
+
+class Worker(object):
+    def __init__(
+            self,
+            scheduler: Optional[Scheduler]=None,
+            sender: Optional[mail_sender.MailSender]=None,
+            holder: Optional[str]=None,
+    ) -> None:
+        if scheduler is None:
+            scheduler = Scheduler(
+                standalone=True,
+                coalesce=True,
+                misfire_grace_time=MISFIRE_GRACE_TIME,
+                threadpool=ThreadPool(core_threads=JOB_THREADS, max_threads=JOB_THREADS),
+            )
+        if holder is None:
+            holder = make_holder_id()
+        if sender is None:
+            sender = mail_sender.MailSender(holder=holder)
+        self.scheduler = scheduler
+        self.sender = sender
+        self.holder = holder
+        self._send_mail = timed_job('mail', self.sender.send_all_due)
+        self._send_reminders = timed_job('reminders', self.send_reminders)
+        self._update_statistics = timed_job('statistics', self.update_statistics)
+        self._delete_pictures = timed_job('pictures', self.delete_pictures)
+        self._upload_pictures = timed_job('picture_uploads', picture_utils.upload_stale_pictures)
+        self._roll_up_page_views = timed_job('page_views', self.roll_up_page_views)
+
+    def run_exclusively(self, name: str, func: Callable[[], Any]) -> bool:
+        """
+        Run `func` if no other worker is running the job `name`
+
+        :return: whether `func` was run
+        """
+        if not Lease.acquire(store.session, name, self.holder, LEASE_DURATION):
+            logger.info('Skipping {}, another worker holds its lease'.format(name))
+            return False
+        try:
+            func()
+        finally:
+            store.session.rollback()
+            Lease.release(store.session, name, self.holder)
+        return True
+
+    def send_reminders(self) -> None:
+        # A failed run is not retried before `RESCHEDULE_FALLBACK`.
+        next_time = after_fallback
+        try:
+            self.run_exclusively('reminders', reminder.send_reminders)
+            next_time = next_reminder_time
+        finally:
+            self.schedule_next(self._send_reminders, next_time)
+
+    def update_statistics(self) -> None:
+        try:
+            self.run_exclusively('statistics', self._store_statistics)
+        finally:
+            self.schedule_next(self._update_statistics, next_day_rollover)
+
+    def schedule_next(
+            self,
+            job: Callable[[], Any],
+            next_time: Callable[[datetime.datetime], datetime.datetime],
+    ) -> None:
+        """
+        Run `job` again at `next_time(now)`, or after
+        `RESCHEDULE_FALLBACK` if that cannot be worked out, so that a
+        job which schedules itself is never left unscheduled
+        """
+        now = datetime.datetime.utcnow()
+        try:
+            # The run may have left the session in a failed transaction.
+            store.session.rollback()
+            when = next_time(now)
+        except Exception:
+            logger.exception('Could not work out when to run {} next'.format(job.__name__))
+            when = now + RESCHEDULE_FALLBACK
+        self.schedule(job, when)
+
+    def delete_pictures(self) -> None:
+        self.run_exclusively('pictures', picture_utils.delete_unreferenced_pictures)
+
+    def roll_up_page_views(self) -> None:
+        self.run_exclusively('page_views', self._store_page_view_rollups)
+
+    @staticmethod
+    def _store_page_view_rollups():
+        roll_up_page_views(store.session)
+
+    @staticmethod
+    def _store_statistics():
+        StatisticCounter.reconcile()
+        Statistic.check_statistics()
+
+    def schedule(self, job: Callable[[], Any], when: datetime.datetime) -> None:
+        """Run `job` once at `when`, in UTC"""
+        logger.debug('Scheduling {} at {}'.format(job.__name__, when))
+        self.scheduler.add_date_job(job, utc_to_local(when), name=job.__name__)
+
+    def add_jobs(self) -> None:
+        """Schedule every job, reminders and statistics straight away"""
+        self.scheduler.add_interval_job(
+            self._send_mail,
+            seconds=mail_sender.POLL_INTERVAL,
+            name='send_mail',
+            max_instances=1,
+        )
+        self.scheduler.add_interval_job(
+            self._delete_pictures,
+            seconds=PICTURE_GC_INTERVAL.total_seconds(),
+            name='delete_pictures',
+            max_instances=1,
+        )
+        self.scheduler.add_interval_job(
+            self._upload_pictures,
+            seconds=PICTURE_UPLOAD_INTERVAL.total_seconds(),
+            name='upload_pictures',
+            max_instances=1,
+        )
+        self.scheduler.add_interval_job(
+            self._roll_up_page_views,
+            seconds=PAGE_VIEW_ROLLUP_INTERVAL.total_seconds(),
+            name='roll_up_page_views',
+            max_instances=1,
+        )
+        now = datetime.datetime.utcnow()
+        self.schedule(self._send_reminders, now + MIN_DELAY)
+        self.schedule(self._update_statistics, now + MIN_DELAY)
+
+    def run(self) -> None:
+        """Run jobs until `stop` is called"""
+        self.add_jobs()
+        self.scheduler.start()
+
+    def stop(self) -> None:
+        self.scheduler.shutdown()
+        self.sender.stop()
+
 
 def do_work():
+    """Run every job once, one after the other"""
     logger.info('Running do_work')
     reminder.send_reminders()
+    StatisticCounter.reconcile()
     Statistic.check_statistics()
+    roll_up_page_views(store.session)
 
 
 default_target_time = datetime.timedelta(seconds=600)
@@ -0,0 +1,89 @@
+#! /usr/bin/python3
+"""Make the thumbnails of pictures uploaded before there were any
+
+Each picture is added to the manifest, recording whether it has
+thumbnails, so that users are only shown thumbnails that exist.
+Pictures already in the manifest are skipped, and pictures whose
+smallest thumbnail already exists are not made again, so this can be
+run again if it is interrupted.  A picture whose thumbnails could not
+be uploaded is left out of the manifest and tried on the next run.
+
+    python community_share_thumbnails.py
+"""
+import logging
+import os
+
+import requests
+
+from community_share import config, store
+from community_share.models.picture import PictureObject
+from community_share.models.user import User
+from community_share.picture_utils import (
+    THUMBNAIL_SIZES,
+    UPLOADED_FILENAME_PATTERN,
+    make_thumbnails,
+    stage_image,
+    thumbnail_filename,
+    upload_thumbnail_files,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def has_thumbnails(picture_filename):
+    url = config.UPLOAD_LOCATION + thumbnail_filename(picture_filename, min(THUMBNAIL_SIZES))
+    return requests.head(url).status_code == 200
+
+
+def make_thumbnails_of(image, picture_filename):
+    """
+    Make and upload the thumbnails of a downloaded picture
+
+    :return: whether the picture has thumbnails, or None if they could
+        not be uploaded
+    """
+    if has_thumbnails(picture_filename):
+        return True
+    try:
+        thumbnails = make_thumbnails(image.path)
+    except (OSError, ValueError) as e:
+        logger.warning('Could not make thumbnails of {}, showing the original: {}'.format(
+            picture_filename, e))
+        return False
+    if not upload_thumbnail_files(thumbnails, picture_filename):
+        return None
+    return True
+
+
+def make_missing_thumbnails():
+    query = store.session.query(User.picture_filename).filter(User.picture_filename != None)
+    filenames = {filename for (filename, ) in query if UPLOADED_FILENAME_PATTERN.match(filename)}
+    query = store.session.query(PictureObject.filename).filter(PictureObject.uploaded_at != None)
+    filenames -= {filename for (filename, ) in query}
+    for picture_filename in sorted(filenames):
+        response = requests.get(config.UPLOAD_LOCATION + picture_filename, stream=True)
+        if response.status_code != 200:
+            logger.warning('Could not download {}: {}'.format(
+                picture_filename, response.status_code))
+            continue
+        image = stage_image(response.raw)
+        try:
+            made = make_thumbnails_of(image, picture_filename)
+        finally:
+            os.remove(image.path)
+        if made is None:
+            logger.warning('Could not upload thumbnails of {}, retrying on the next run'.format(
+                picture_filename))
+            continue
+        sha1 = UPLOADED_FILENAME_PATTERN.match(picture_filename).group('sha1')
+        if not PictureObject.record_existing(
+                store.session, sha1, picture_filename, image.size, made):
+            logger.warning('{} is in the manifest under another name'.format(picture_filename))
+        elif made:
+            logger.info('Made thumbnails of {}'.format(picture_filename))
+
+
+if __name__ == '__main__':
+    config.load_config('./config/config.production.json')
+    logger.info('Making missing thumbnails.')
+    make_missing_thumbnails()
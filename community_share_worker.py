@@ -19,4 +19,4 @@ if __name__ == '__main__':
             f.write(pid)
     config.load_config('./config/config.production.json')
     logger.info('Starting community share worker.')
-    worker.work_loop()
+    worker.Worker().run()
@@ -5,13 +5,15 @@ import time
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
 from community_share.models.analytics import PageView
-from community_share.models.search import Label, Search
+from community_share.models.lease import Lease  # noqa: F401, creates the lease table
+from community_share.models.search import Label, Search, label_catalogue, label_registry
 from community_share.models.user import User, UserReview
 from community_share.models.secret import Secret
 from community_share.models.survey import Question, SuggestedAnswer
 from community_share.models.conversation import Conversation, Message
 from community_share.models.institution import InstitutionAssociation, Institution
 from community_share.models.share import Share, Event, EventReminder
+from community_share.search_index import search_index
 from community_share import store, Base, config, setup_data
 
 logger = logging.getLogger(__name__)
@@ -373,6 +375,10 @@ def init_db():
     Base.metadata.drop_all(store.engine)
     logger.info('Creating all tables.')
     Base.metadata.create_all(store.engine)
+    # Forget anything this process has cached from the old tables.
+    search_index.invalidate()
+    label_catalogue.clear()
+    label_registry.clear()
 
 
 def get_creator():
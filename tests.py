@@ -266,6 +266,8 @@ class CommunityShareTestCase(unittest.TestCase):
         userA.is_administrator = True
         store.session.add(userA)
         store.session.commit()
+        # The worker stores the statistics.
+        Statistic.check_statistics()
         # Now we should get stats
         rv = self.app.get('/api/statistics', headers=user_headers['userA'])
         self.assertEqual(rv.status_code, 200)
@@ -329,6 +331,89 @@ class CommunityShareTestCase(unittest.TestCase):
         self.assertEqual(rv.status_code, 200)
         stats = json.loads(rv.data.decode('utf8'))['data']
         self.assertEqual(len(stats.keys()), 30)
+        # A range can be asked for.
+        start = yesterday - datetime.timedelta(days=1)
+        rv = self.app.get(
+            '/api/statistics?start={}&end={}'.format(start.isoformat(), yesterday_string),
+            headers=user_headers['userA'],
+        )
+        self.assertEqual(rv.status_code, 200)
+        stats = json.loads(rv.data.decode('utf8'))['data']
+        self.assertEqual(sorted(stats.keys()), [time_format.to_iso8601(start), yesterday_string])
+        self.assertEqual(stats[yesterday_string]['n_new_users'], 1)
+        # But not a backwards or malformed one.
+        rv = self.app.get(
+            '/api/statistics?start={}&end={}'.format(yesterday.isoformat(), start.isoformat()),
+            headers=user_headers['userA'],
+        )
+        self.assertEqual(rv.status_code, 400)
+        rv = self.app.get('/api/statistics?start=yesterday', headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 400)
+
+    def test_labels_etag(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA})
+        self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner', ['robot dogs'])
+        rv = self.app.get('/api/labels')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data.decode('utf8'))['data'], ['robot dogs'])
+        etag = rv.headers['ETag']
+        self.assertIn('max-age', rv.headers['Cache-Control'])
+        # An unchanged catalogue is not sent again.
+        rv = self.app.get('/api/labels', headers=[('If-None-Match', etag)])
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.data, b'')
+        self.assertEqual(rv.headers['ETag'], etag)
+        # A new label changes the ETag.
+        self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner', ['weather'])
+        rv = self.app.get('/api/labels', headers=[('If-None-Match', etag)])
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data.decode('utf8'))['data'], ['robot dogs', 'weather'])
+        self.assertNotEqual(rv.headers['ETag'], etag)
+
+    def test_paginated_listing(self):
+        user_datas = {
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        }
+        user_ids, user_headers = self.create_users(user_datas)
+        # Only administrators can list users.
+        userA = store.session.query(User).filter(User.id == user_ids['userA']).first()
+        userA.is_administrator = True
+        store.session.add(userA)
+        store.session.commit()
+        # The first page should have two users and a link to the next.
+        rv = self.app.get('/api/user?limit=2', headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 200)
+        data = json.loads(rv.data.decode('utf8'))
+        first_ids = [user['id'] for user in data['data']]
+        self.assertEqual(len(first_ids), 2)
+        next_links = [link['href'] for link in data['links'] if link['rel'] == 'next_page']
+        self.assertEqual(len(next_links), 1)
+        # The last page should have the remaining user and no next link.
+        rv = self.app.get(chop_link(next_links[0]), headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 200)
+        data = json.loads(rv.data.decode('utf8'))
+        last_ids = [user['id'] for user in data['data']]
+        self.assertEqual(len(last_ids), 1)
+        self.assertEqual([l for l in data['links'] if l['rel'] == 'next_page'], [])
+        self.assertEqual(sorted(first_ids + last_ids), sorted(user_ids.values()))
+        # Without a limit, every user after after_id.
+        rv = self.app.get(
+            '/api/user?after_id={}'.format(first_ids[-1]), headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 200)
+        data = json.loads(rv.data.decode('utf8'))
+        self.assertEqual([user['id'] for user in data['data']], last_ids)
+        # Administrators can stream every user.
+        rv = self.app.get('/api/user?stream=true', headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 200)
+        data = json.loads(rv.data.decode('utf8'))
+        self.assertEqual(sorted(u['id'] for u in data['data']), sorted(user_ids.values()))
+        # Other users cannot stream.
+        rv = self.app.get('/api/search?stream=true', headers=user_headers['userB'])
+        self.assertEqual(rv.status_code, 403)
 
     def test_account_deletion(self):
         user_datas = {